@@ -0,0 +1,81 @@
+"""
+維運指令：
+
+    python admin.py reconcile                               以堂數帳本重算所有學生的剩餘堂數
+    python admin.py report-cache warm --from 2024-01 --to 2024-12 [--force]
+                                                            預先建立月報表快取
+    python admin.py report-cache invalidate [--from 2024-01] [--to 2024-12]
+                                                            清除月報表快取
+    python admin.py export --from 2023-01 --to 2025-12 --format parquet [--out history.parquet]
+                                                            匯出出勤明細（CSV / Parquet / XLSX）
+    python admin.py export --from 2023-01 --to 2025-12 --format parquet --by-month [--out DIR] [--force]
+                                                            每月一檔，只寫入新月份與有異動的月份
+"""
+import argparse
+
+from exports import AttendanceExporter, EXPORT_FORMATS
+from services import AttendanceService, DATABASE_URL, REPORT_CHUNK_SIZE, month_bounds, parse_month
+
+
+def cmd_reconcile(service, _args):
+    fixed = service.reconcile_balances()
+    print(f"已依帳本重算剩餘堂數，修正 {fixed} 位學生。")
+
+
+def cmd_report_cache(service, args):
+    end = month_bounds(args.to.year, args.to.month)[1] if args.to else None
+    if args.action == "warm":
+        if not args.start or not end:
+            raise SystemExit("warm 需要指定 --from 與 --to")
+        result = service.warm_report_cache(args.start, end, force=args.force)
+        if result is None:
+            raise SystemExit(1)
+        print(f"重建 {result['rebuilt']} 個月份，{result['fresh']} 個月份已是最新。")
+    else:
+        n = service.invalidate_report_cache(args.start, end)
+        print(f"已清除 {n} 個月份的報表快取。")
+
+
+def cmd_export(service, args):
+    end = month_bounds(args.to.year, args.to.month)[1]
+    exporter = AttendanceExporter(service, chunk_size=args.chunk_size)
+    if args.by_month:
+        result = exporter.export_months(args.start, end, args.format, args.out, force=args.force)
+        print(f"匯出至 {result['dir']}：寫入 {len(result['written'])} 個月份，"
+              f"{len(result['unchanged'])} 個月份未異動，移除 {len(result['removed'])} 個空月份。")
+    else:
+        result = exporter.export(args.start, end, args.format, args.out)
+        print(f"已匯出 {result['rows']} 筆至 {result['path']}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="學生點名系統維運指令")
+    ap.add_argument("--db", default=DATABASE_URL, help="資料庫 URL（預設為 attendance.db）")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("reconcile", help="以帳本重算剩餘堂數").set_defaults(func=cmd_reconcile)
+    rc = sub.add_parser("report-cache", help="建立或清除月報表快取")
+    rc.add_argument("action", choices=("warm", "invalidate"))
+    rc.add_argument("--from", dest="start", type=parse_month, help="起始月份 YYYY-MM")
+    rc.add_argument("--to", type=parse_month, help="結束月份 YYYY-MM（含）")
+    rc.add_argument("--force", action="store_true", help="warm 時不論是否異動一律重建")
+    rc.set_defaults(func=cmd_report_cache)
+    ex = sub.add_parser("export", help="匯出出勤明細（CSV / Parquet / XLSX）")
+    ex.add_argument("--from", dest="start", type=parse_month, required=True, help="起始月份 YYYY-MM")
+    ex.add_argument("--to", type=parse_month, required=True, help="結束月份 YYYY-MM（含）")
+    ex.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    ex.add_argument("--out", help="輸出檔案（--by-month 時為資料夾）；預設在 reports/exports/<格式>/")
+    ex.add_argument("--by-month", action="store_true", help="每月一檔，只寫入新月份與有異動的月份")
+    ex.add_argument("--force", action="store_true", help="--by-month 時不論是否異動一律重寫")
+    ex.add_argument("--chunk-size", type=int, default=REPORT_CHUNK_SIZE, help="每批讀取的筆數")
+    ex.set_defaults(func=cmd_export)
+    args = ap.parse_args(argv)
+
+    service = AttendanceService(args.db)
+    try:
+        args.func(service, args)
+    finally:
+        service.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import select, func, case
+
+from models import Student, Teacher, Course, CourseSchedule, AttendanceRecord
+
+STATUS_PRESENT, STATUS_LATE, STATUS_ABSENT = "有到", "遲到", "曠課"
+
+SUMMARY_COLUMNS = ["sessions", "present", "late", "absent", "deducted", "attendance_rate"]
+
+
+def _month_expr(dialect_name: str):
+    """把 AttendanceRecord.date 轉成 'YYYY-MM' 字串的 SQL 運算式。"""
+    if dialect_name == "postgresql":
+        return func.to_char(AttendanceRecord.date, "YYYY-MM")
+    if dialect_name in ("mysql", "mariadb"):
+        return func.date_format(AttendanceRecord.date, "%Y-%m")
+    return func.strftime("%Y-%m", AttendanceRecord.date)
+
+
+class AttendanceAnalytics:
+    """
+    出勤統計：出席率、遲到 / 曠課次數、扣堂數，可依學生、課程、老師、月份任意組合分組。
+    所有彙總都在資料庫以單一 GROUP BY 查詢完成，結果為 DataFrame。
+    """
+
+    DIMENSIONS = ("student", "course", "teacher", "month")
+
+    def __init__(self, service):
+        self.service = service
+
+    def _dimension_columns(self, dim: str):
+        if dim == "student":
+            return [Student.id.label("student_id"), Student.name.label("student_name")]
+        if dim == "course":
+            return [Course.id.label("course_id"), Course.name.label("course_name")]
+        if dim == "teacher":
+            return [Teacher.id.label("teacher_id"), Teacher.name.label("teacher_name")]
+        if dim == "month":
+            return [_month_expr(self.service.engine.dialect.name).label("month")]
+        raise ValueError(f"未知的統計維度：{dim}（可用：{', '.join(self.DIMENSIONS)}）")
+
+    def summary(self, group_by=("student",), start_date: date | None = None,
+                end_date: date | None = None, student_id: int | None = None,
+                course_id: int | None = None, teacher_id: int | None = None) -> pd.DataFrame:
+        if isinstance(group_by, str):
+            group_by = (group_by,)
+        dims = [c for d in group_by for c in self._dimension_columns(d)]
+
+        present = func.sum(case((AttendanceRecord.status == STATUS_PRESENT, 1), else_=0))
+        late = func.sum(case((AttendanceRecord.status == STATUS_LATE, 1), else_=0))
+        q = (select(*dims,
+                    func.count(AttendanceRecord.id).label("sessions"),
+                    present.label("present"),
+                    late.label("late"),
+                    func.sum(case((AttendanceRecord.status == STATUS_ABSENT, 1), else_=0)).label("absent"),
+                    func.sum(case((AttendanceRecord.class_deducted.is_(True), 1), else_=0)).label("deducted"))
+             .join(Student, AttendanceRecord.student_id == Student.id)
+             .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
+             .join(Course, CourseSchedule.course_id == Course.id)
+             .join(Teacher, Course.teacher_id == Teacher.id))
+        if start_date is not None:
+            q = q.where(AttendanceRecord.date >= start_date)
+        if end_date is not None:
+            q = q.where(AttendanceRecord.date <= end_date)
+        if student_id is not None:
+            q = q.where(AttendanceRecord.student_id == int(student_id))
+        if course_id is not None:
+            q = q.where(Course.id == int(course_id))
+        if teacher_id is not None:
+            q = q.where(Course.teacher_id == int(teacher_id))
+        if dims:
+            q = q.group_by(*dims).order_by(*dims)
+
+        with self.service.session_scope() as session:
+            result = session.execute(q)
+            df = pd.DataFrame(result.all(), columns=list(result.keys()))
+
+        if df.empty:
+            return pd.DataFrame(columns=[c.name for c in dims] + SUMMARY_COLUMNS)
+        counts = SUMMARY_COLUMNS[:-1]
+        df[counts] = df[counts].fillna(0).astype(int)   # 無資料時 SUM 為 NULL
+        sessions = df["sessions"].where(df["sessions"] > 0)
+        df["attendance_rate"] = ((df["present"] + df["late"]) / sessions).fillna(0.0).round(4)
+        return df
+
+    def by_student(self, **filters) -> pd.DataFrame:
+        return self.summary(("student",), **filters)
+
+    def by_course(self, **filters) -> pd.DataFrame:
+        return self.summary(("course",), **filters)
+
+    def by_teacher(self, **filters) -> pd.DataFrame:
+        return self.summary(("teacher",), **filters)
+
+    def by_month(self, **filters) -> pd.DataFrame:
+        return self.summary(("month",), **filters)
+
+    def yearly_dashboard(self, year: int, group_by=("month", "course")) -> pd.DataFrame:
+        """整年度儀表板：預設依「月份 × 課程」一次查詢取得。"""
+        return self.summary(group_by, start_date=date(year, 1, 1), end_date=date(year, 12, 31))
@@ -0,0 +1,149 @@
+"""
+AttendanceService 的 asyncio 版本，供多台平板同時連線的網路部署使用（見 server.py）。
+
+以 SQLAlchemy async engine（本機為 aiosqlite）執行；每個操作在一個 AsyncSession 交易內
+透過 run_sync 呼叫 AttendanceService 的 session 層級輔助函式（_query_* / _apply_* /
+_record_attendance），因此點名、報名等規則與桌面版完全相同。
+回傳值與同步版的預設（dto 輕量資料列）一致；失敗時同樣回傳 None。
+"""
+import asyncio
+from datetime import date
+
+from sqlalchemy.exc import IntegrityError
+
+from cache import ResultCache
+from database import make_async_engine
+from models import Base, upgrade_connection
+from search import SEARCH_LIMIT, fts_available, search_students
+from services import (
+    AttendanceService, DB_PATH, STUDENT_PAGE_SIZE, expand_occurrences, occurrence_records
+)
+
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+
+class AsyncAttendanceService:
+    def __init__(self, db_url: str = ASYNC_DATABASE_URL, profile: str = "desktop", cache_size: int = 128):
+        """
+        db_url：async driver 的 URL，例如 sqlite+aiosqlite:///attendance.db。
+        profile：引擎設定檔（見 database.ENGINE_PROFILES），多人同時寫入建議使用 "desktop"（WAL）。
+        建立後需先 await init_schema()。
+        """
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        self.engine = make_async_engine(db_url, profile)
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.cache = ResultCache(cache_size)
+        # SQLite 同時只允許一個寫入者：在行程內先排隊，避免多條連線互相等待 busy_timeout
+        self._write_lock = asyncio.Lock() if self.engine.dialect.name == "sqlite" else None
+        self._fts = False
+
+    async def init_schema(self):
+        """首次自動建表並補建索引（等同同步版建構子做的事）。"""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(upgrade_connection)
+            self._fts = await conn.run_sync(fts_available)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    async def _run(self, fn, *args, write: bool = False):
+        """在一個交易內以 run_sync 執行 session 層級函式；write=False 時不 commit。"""
+        async with self.Session() as session:
+            if not write:
+                return await session.run_sync(fn, *args)
+            if self._write_lock is None:
+                async with session.begin():
+                    return await session.run_sync(fn, *args)
+            async with self._write_lock, session.begin():
+                return await session.run_sync(fn, *args)
+
+    async def _cached(self, key, fn, *args):
+        return await self.cache.aget_or_load(key, lambda: self._run(fn, *args))
+
+    # ---------- 名單 ----------
+    async def get_all_students(self):
+        return await self._cached(("students",), AttendanceService._query_all_students)
+
+    async def search_students(self, prefix: str = "", after=None, limit: int = STUDENT_PAGE_SIZE,
+                              course_id: int | None = None, enrolled: bool | None = None):
+        """同 AttendanceService.search_students：回傳 (本頁學生, 下一頁游標)。"""
+        return await self._run(AttendanceService._query_student_page,
+                               prefix, after, limit, course_id, enrolled)
+
+    async def find_students(self, query: str, limit: int = SEARCH_LIMIT, fuzzy: bool = True):
+        """同 AttendanceService.find_students：依相關程度排序的部分 / 模糊比對。"""
+        return await self._run(search_students, query, limit, fuzzy, self._fts)
+
+    async def get_all_teachers(self):
+        return await self._cached(("teachers",), AttendanceService._query_all_teachers)
+
+    async def get_all_courses_with_schedules(self):
+        return await self._cached(("courses",), AttendanceService._query_courses_with_schedules)
+
+    async def get_students_for_course(self, course_id: int):
+        cid = int(course_id)
+        return await self._cached(("enrollment", cid, True),
+                                  AttendanceService._query_students_for_course, cid)
+
+    # ---------- Occurrence ----------
+    async def get_course_occurrences_frame(self, start_date: date, end_date: date,
+                                           teacher_id: int | None = None, course_id: int | None = None):
+        rows = await self._run(AttendanceService._query_schedule_rows, teacher_id, course_id)
+        # 展開為 CPU 運算，移到執行緒避免卡住事件迴圈
+        return await asyncio.to_thread(expand_occurrences, rows, start_date, end_date)
+
+    async def get_courses_for_period(self, start_date: date, end_date: date,
+                                     teacher_id: int | None = None, course_id: int | None = None):
+        df = await self.get_course_occurrences_frame(start_date, end_date, teacher_id, course_id)
+        return occurrence_records(df)
+
+    # ---------- 報名 / 點名 ----------
+    async def update_course_enrollments(self, course_id: int, student_ids: list[int]):
+        """
+        同 AttendanceService.update_course_enrollments（成功、{"conflicts": [...]}、課程不存在回傳 None），
+        但寫入失敗時不吞掉例外，由呼叫端區分「找不到課程」與資料庫錯誤。
+        """
+        cid = int(course_id)
+        applied = await self._run(AttendanceService._apply_enrollments, cid, student_ids, write=True)
+        if applied is None:
+            return None
+        result, added, removed = applied
+        if added or removed:
+            self.cache.invalidate(("enrollment", cid))
+        return result
+
+    async def take_attendance(self, course_schedule_id: int, attendance_date: date,
+                              student_statuses: dict[int, str]):
+        """同 AttendanceService.take_attendance：回傳 {student_id: 結果}，失敗回傳 None。"""
+        for attempt in range(2):
+            try:
+                outcomes = await self._run(AttendanceService._record_attendance,
+                                           course_schedule_id, attendance_date, student_statuses, write=True)
+                break
+            except IntegrityError:
+                # 兩台裝置同時送出同一堂點名：唯一索引擋下後重試一次，重試時會判定為 duplicate
+                if attempt:
+                    return None
+            except Exception as e:
+                print("點名失敗：", e)
+                return None
+        if outcomes:
+            self.cache.invalidate(("students",), ("enrollment",))
+        return outcomes
+
+    async def take_attendance_batch(self, entries, atomic: bool = True):
+        """同 AttendanceService.take_attendance_batch：整批一個交易，回傳與 entries 對齊的 list。"""
+        entries = list(entries or ())
+        try:
+            results = await self._run(AttendanceService._apply_attendance_batch, entries, atomic, write=True)
+        except Exception as e:
+            print("批次點名失敗：", e)
+            return None
+        if results and any(results):
+            self.cache.invalidate(("students",), ("enrollment",))
+        return results
@@ -0,0 +1,153 @@
+"""
+多行程批次產生 Excel 報表：年底一次要十二個月（或每門課程、每位老師）的報表時，
+把各份報表分給行程池同時產生。報表時間主要花在 openpyxl 序列化（CPU），單一行程逐份產生用不到多核心。
+
+    python batch_reports.py months   --from 2025-01 --to 2025-12 [--workers 4] [--out reports/2025]
+    python batch_reports.py courses  --from 2025-01 --to 2025-12 [--ids 3 5 8]
+    python batch_reports.py teachers --from 2025-01 --to 2025-12
+
+每個工作行程各自以唯讀連線開啟資料庫（profile="readonly"：SQLite 為 mode=ro + query_only），
+不建表、不補索引；月報表快取只在版本相符時讀取，不會寫入。
+WAL 資料庫放在無法寫入的資料夾（唯讀網路磁碟、封存備份）時 mode=ro 可能因無法建立 -shm 檔而開不了：
+沒有 -wal 檔時改以 immutable=1 開啟（此時不應有其他程式寫入該資料庫），
+有 -wal 檔則直接結束並提示先在可寫入的位置開啟一次資料庫完成 checkpoint（見 database.make_engine）。
+結果以 JSON 輸出：每份報表的路徑或錯誤訊息、沒有資料而略過的項目，以及整體耗時。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from itertools import chain
+
+from sqlalchemy.exc import OperationalError
+
+from services import AttendanceService, DATABASE_URL, month_bounds, months_between, parse_month
+
+BATCH_KINDS = ("months", "courses", "teachers")
+
+# 工作行程內的服務物件（由 _init_worker 建立，每個行程一個）
+_service = None
+
+
+def _init_worker(db_url, profile, reports_dir):
+    global _service
+    _service = AttendanceService(db_url, profile=profile, read_only=True, reports_dir=reports_dir,
+                                 cache_size=0)
+
+
+def _job_label(job):
+    kind, key, _, _ = job
+    return f"{key[0]}-{key[1]:02d}" if kind == "month" else f"{kind} {key}"
+
+
+def _run_job(job):
+    """在工作行程執行一份報表，回傳 {"job", "path", "rows", "error", "seconds"}；rows 為 0 表示沒有資料。"""
+    kind, key, start_date, end_date = job
+    t0 = time.perf_counter()
+    result = {"job": _job_label(job), "path": None, "rows": 0, "error": None}
+    try:
+        if kind == "month":
+            chunks = _service.iter_monthly_attendance_report(*key)
+            filename = None
+        else:
+            chunks = _service.iter_attendance_report(start_date, end_date, **{f"{kind}_id": key})
+            filename = f"{kind}_report_{key}_{start_date:%Y%m}_{end_date:%Y%m}.xlsx"
+        first = next(chunks, None)
+        if first:
+            counted = []
+
+            def rows():
+                for chunk in chain((first,), chunks):
+                    counted.append(len(chunk))
+                    yield from chunk
+
+            year, month = key if kind == "month" else (start_date.year, start_date.month)
+            result["path"] = _service.export_report_to_excel(rows(), year, month, filename=filename)
+            result["rows"] = sum(counted)
+            if result["path"] is None:
+                result["error"] = "寫入 Excel 失敗"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def plan_jobs(service, kind, start_date: date, end_date: date, ids=None):
+    """列出要產生的報表：(種類, 鍵, 起日, 迄日)。課程 / 老師未指定 ids 時為全部。"""
+    if kind == "months":
+        return [("month", ym, *month_bounds(*ym)) for ym in months_between(start_date, end_date)]
+    if ids is None:
+        rows = service.get_all_courses_with_schedules() if kind == "courses" else service.get_all_teachers()
+        ids = [r.id for r in rows]
+    return [(kind[:-1], int(i), start_date, end_date) for i in ids]
+
+
+def run_batch(db_url, kind, start_date: date, end_date: date, ids=None, workers=None,
+              reports_dir=None, profile="readonly"):
+    """
+    以行程池產生報表，回傳 {"kind", "workers", "jobs", "wall_s", "reports", "skipped", "errors"}。
+    reports 為成功的 {"job", "path", "rows", "seconds"}，errors 為失敗的 {"job", "error"}。
+    """
+    if kind not in BATCH_KINDS:
+        raise ValueError(f"未知的報表種類：{kind}")
+    # 先在父行程以唯讀連線開啟一次：資料庫打不開時直接丟出例外，不必等每個工作行程各自失敗
+    service = AttendanceService(db_url, profile=profile, read_only=True)
+    try:
+        jobs = plan_jobs(service, kind, start_date, end_date, ids)
+    finally:
+        service.dispose()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    results = []
+    t0 = time.perf_counter()
+    if jobs:
+        # spawn：工作行程不繼承父行程的連線與執行緒，Windows / macOS 行為一致
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(db_url, profile, reports_dir)) as pool:
+            futures = {pool.submit(_run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # 工作行程異常結束（例如記憶體不足被終止）
+                    results.append({"job": _job_label(futures[future]), "path": None, "rows": 0,
+                                    "error": f"{type(e).__name__}: {e}", "seconds": None})
+    wall = time.perf_counter() - t0
+
+    order = {_job_label(job): i for i, job in enumerate(jobs)}
+    results.sort(key=lambda r: order[r["job"]])
+    return {"kind": kind, "workers": workers, "jobs": len(jobs), "wall_s": round(wall, 3),
+            "reports": [r for r in results if r["path"]],
+            "skipped": [r["job"] for r in results if not r["path"] and not r["error"]],
+            "errors": [{"job": r["job"], "error": r["error"]} for r in results if r["error"]]}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="多行程批次產生 Excel 出勤報表")
+    ap.add_argument("kind", choices=BATCH_KINDS, help="每月一份 / 每門課程一份 / 每位老師一份")
+    ap.add_argument("--from", dest="start", type=parse_month, required=True, help="起始月份 YYYY-MM")
+    ap.add_argument("--to", type=parse_month, required=True, help="結束月份 YYYY-MM（含）")
+    ap.add_argument("--ids", type=int, nargs="+", help="只產生指定課程 / 老師 id 的報表")
+    ap.add_argument("--workers", type=int, help="工作行程數（預設為 CPU 核心數）")
+    ap.add_argument("--out", help="報表輸出資料夾（預設為 reports/）")
+    ap.add_argument("--db", default=DATABASE_URL, help="資料庫 URL（預設為 attendance.db）")
+    ap.add_argument("--profile", default="readonly", help="工作行程的引擎設定檔")
+    args = ap.parse_args(argv)
+
+    end = month_bounds(args.to.year, args.to.month)[1]
+    try:
+        result = run_batch(args.db, args.kind, args.start, end, args.ids, args.workers, args.out, args.profile)
+    except OperationalError as e:
+        raise SystemExit(f"無法以唯讀方式開啟資料庫：{e.orig}")
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    if result["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
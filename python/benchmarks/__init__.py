@@ -0,0 +1,9 @@
+"""
+服務層效能基準測試。請在 python/ 資料夾下執行：
+
+    python -m benchmarks.run --students 2000 --years 2 --out bench.json
+    python -m benchmarks.run --compare bench.json      # 與上次結果比較
+    python -m benchmarks.loadtest --clients 20         # 點名伺服器併發負載測試
+
+datagen 產生合成資料，run 對暫存 SQLite 檔執行各情境並輸出 JSON。
+"""
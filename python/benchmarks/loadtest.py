@@ -0,0 +1,172 @@
+"""
+點名伺服器的併發負載測試：模擬多台平板在換堂時同時送出整班點名。
+
+    python -m benchmarks.loadtest --clients 20 --requests 400
+    python -m benchmarks.loadtest --url http://192.168.1.10:8080 --clients 50   # 測試既有伺服器
+
+未指定 --url 時，會以 datagen 在暫存 SQLite 檔產生資料並在同一行程啟動 server.py。
+每位 client 以一條 keep-alive 連線依序送出 POST /attendance，每次都是新的 (排程, 日期)，
+結果輸出每秒點名數與延遲分佈（JSON）。
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+from benchmarks.datagen import generate
+
+
+class _Client:
+    """最小 HTTP/1.1 keep-alive client（只處理 server.py 的 JSON 回應）。"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+            + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def _build_jobs(host, port, requests, start_date):
+    """取得排程與報名名單，產生 requests 筆互不重複的整班點名請求。"""
+    client = _Client(host, port)
+    try:
+        _, courses = await client.request("GET", "/courses")
+        rosters = {}
+        for c in courses:
+            _, students = await client.request("GET", f"/courses/{c['id']}/students")
+            rosters[c["id"]] = [s["id"] for s in students]
+    finally:
+        await client.close()
+    schedules = [(s["id"], s["course_id"]) for c in courses for s in c["schedules"] if rosters[c["id"]]]
+    if not schedules:
+        raise SystemExit("資料庫中沒有已報名學生的排程")
+    jobs = []
+    for i in range(requests):
+        sched_id, cid = schedules[i % len(schedules)]
+        day = start_date + timedelta(days=i // len(schedules))
+        jobs.append({"schedule_id": sched_id, "date": day.isoformat(),
+                     "statuses": {str(sid): "有到" for sid in rosters[cid]}})
+    return jobs
+
+
+async def _worker(host, port, queue, latencies, errors):
+    client = _Client(host, port)
+    try:
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            status, body = await client.request("POST", "/attendance", job)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if status != 200:
+                errors.append(body)
+    finally:
+        await client.close()
+
+
+async def run_load(host, port, clients, requests, start_date):
+    jobs = await _build_jobs(host, port, requests, start_date)
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_worker(host, port, queue, latencies, errors) for _ in range(clients)))
+    wall = time.perf_counter() - t0
+    marks = sum(len(j["statuses"]) for j in jobs)
+    return {"clients": clients, "requests": len(jobs), "errors": len(errors),
+            "wall_s": round(wall, 3),
+            "requests_per_s": round(len(jobs) / wall, 1),
+            "students_marked_per_s": round(marks / wall, 1),
+            "latency_ms": {"p50": round(_percentile(latencies, 50), 2),
+                           "p95": round(_percentile(latencies, 95), 2),
+                           "max": round(max(latencies), 2),
+                           "mean": round(statistics.fmean(latencies), 2)}}
+
+
+async def _run_local(args):
+    import server
+    from services import AttendanceService
+
+    with tempfile.TemporaryDirectory(prefix="rollcall-load-") as tmp:
+        path = f"{tmp}/load.db"
+        service = AttendanceService(f"sqlite:///{path}", profile=args.profile)
+        info = generate(service, students=args.students, courses=args.courses,
+                        students_per_course=args.students_per_course, years=0, seed=args.seed)
+        service.dispose()
+
+        ready = asyncio.Event()
+        task = asyncio.create_task(server.serve("127.0.0.1", args.port, f"sqlite+aiosqlite:///{path}",
+                                                args.profile, ready=ready))
+        await ready.wait()
+        try:
+            result = await run_load("127.0.0.1", args.port, args.clients, args.requests,
+                                    args.start_date or date.today() + timedelta(days=1))
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return {"dataset": info, "profile": args.profile, **result}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="點名伺服器併發負載測試")
+    ap.add_argument("--url", help="既有伺服器位址（例如 http://127.0.0.1:8080）；未指定則在本機啟動")
+    ap.add_argument("--clients", type=int, default=20, help="同時連線的裝置數")
+    ap.add_argument("--requests", type=int, default=400, help="整班點名請求總數")
+    ap.add_argument("--port", type=int, default=8765, help="本機啟動時使用的埠號")
+    ap.add_argument("--profile", default="desktop", help="本機啟動時的引擎設定檔")
+    ap.add_argument("--students", type=int, default=1000)
+    ap.add_argument("--courses", type=int, default=40)
+    ap.add_argument("--students-per-course", type=int, default=30)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--start-date", type=date.fromisoformat,
+                    help="點名起始日期（測試既有伺服器時請選沒有點名記錄的日期）")
+    args = ap.parse_args(argv)
+
+    if args.url:
+        parts = urlsplit(args.url)
+        start = args.start_date or date.today() + timedelta(days=1)
+        result = asyncio.run(run_load(parts.hostname, parts.port or 80, args.clients, args.requests, start))
+    else:
+        result = asyncio.run(_run_local(args))
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import sqlalchemy
+
+from database import ENGINE_PROFILES
+from services import AttendanceService, SESSION_MODES
+from benchmarks.datagen import generate
+
+
+def _timeit(fn, repeats):
+    samples = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"repeats": repeats,
+            "min_ms": round(min(samples), 3),
+            "median_ms": round(statistics.median(samples), 3),
+            "mean_ms": round(statistics.fmean(samples), 3),
+            "max_ms": round(max(samples), 3)}
+
+
+def scenarios(service, info, end_date, seed):
+    """回傳 [(名稱, fn(i), repeats)]；每個 fn 以第 i 次重複為參數。"""
+    rng = random.Random(seed)
+    students = info["students"]
+    month = (end_date.replace(day=1) - timedelta(days=1))   # 上個月，資料完整
+    schedule = service.get_course_schedule_by_id(1)
+    roster = [s.id for s in service.get_students_for_course(schedule.course_id)]
+
+    def take_attendance(i):
+        # 每次用未來的新日期，避免被判為重複點名
+        d = end_date + timedelta(days=7 * (i + 1))
+        service.take_attendance(schedule.id, d, {sid: "有到" for sid in roster})
+
+    batch_schedules = [service.get_course_schedule_by_id(i) for i in range(1, 5)]
+    batch_rosters = [(sc.id, [st.id for st in service.get_students_for_course(sc.course_id)])
+                     for sc in batch_schedules if sc]
+
+    def take_attendance_batch(i):
+        # 連堂情境：四堂課的點名一次提交（日期與 take_attendance 情境錯開）
+        d = end_date + timedelta(days=7 * (i + 1) + 1)
+        service.take_attendance_batch([(sid, d, {st: "有到" for st in ids}) for sid, ids in batch_rosters])
+
+    def courses_for_year(_):
+        service.get_courses_for_period(end_date - timedelta(days=365), end_date)
+
+    def student_history(_):
+        service.get_student_attendance(rng.randint(1, students))
+
+    def monthly_report(_):
+        service.get_monthly_attendance_report(month.year, month.month)
+
+    def export_report(_):
+        service.export_monthly_report(month.year, month.month)
+
+    def update_enrollments(i):
+        # 一次只加入/移除一位學生，量測差異更新的成本
+        extra = [] if i % 2 else [rng.randint(1, students)]
+        service.update_course_enrollments(schedule.course_id, roster + extra)
+
+    def student_page(i):
+        # 學生清單第一頁與電話開頭搜尋各一次（GUI 打開學生分頁 / 輸入搜尋字串）
+        service.search_students()
+        service.search_students(f"09{i % 10}")
+
+    return [
+        ("take_attendance", take_attendance, 20),
+        ("take_attendance_batch_4", take_attendance_batch, 20),
+        ("get_courses_for_period_1y", courses_for_year, 10),
+        ("get_student_attendance", student_history, 50),
+        ("get_monthly_attendance_report", monthly_report, 10),
+        ("export_report_to_excel", export_report, 3),
+        ("update_course_enrollments", update_enrollments, 20),
+        ("search_students_page", student_page, 50),
+    ]
+
+
+def run(args):
+    end_date = date.today()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="rollcall-bench-") as tmp:
+        for profile in args.profiles:
+            for mode in args.session_modes:
+                # 每個 (設定檔, session 模式) 各用一份新產生的資料庫，點名情境寫入的資料互不影響
+                service = AttendanceService(f"sqlite:///{tmp}/bench_{profile}_{mode}.db", profile=profile,
+                                            session_mode=mode, cache_size=0, reports_dir=f"{tmp}/reports")
+                t0 = time.perf_counter()
+                info = generate(service, students=args.students, teachers=args.teachers,
+                                courses=args.courses, students_per_course=args.students_per_course,
+                                years=args.years, end_date=end_date, seed=args.seed)
+                info["generate_s"] = round(time.perf_counter() - t0, 3)
+                for name, fn, repeats in scenarios(service, info, end_date, args.seed):
+                    r = _timeit(fn, max(1, int(repeats * args.scale)))
+                    r.update(name=name, profile=profile, session_mode=mode)
+                    results.append(r)
+                    print(f"{profile:8} {mode:8} {name:32} median {r['median_ms']:>10.3f} ms", file=sys.stderr)
+                service.dispose()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "dataset": info,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def _result_key(r):
+    # 加入 session_mode 之前的結果檔沒有此欄位，當時一律是 per_call
+    return r["profile"], r.get("session_mode", "per_call"), r["name"]
+
+
+def compare(current, previous_path):
+    """印出與前次結果的中位數比值（>1 代表變慢），以 (設定檔, session 模式, 情境) 對應。"""
+    with open(previous_path, encoding="utf-8") as f:
+        prev = {_result_key(r): r for r in json.load(f)["results"]}
+    for r in current["results"]:
+        p = prev.get(_result_key(r))
+        if p and p["median_ms"]:
+            ratio = r["median_ms"] / p["median_ms"]
+            flag = "  <-- 變慢" if ratio > 1.2 else ""
+            print(f"{r['profile']:8} {r['session_mode']:8} {r['name']:32} x{ratio:.2f}{flag}", file=sys.stderr)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="AttendanceService 效能基準測試")
+    ap.add_argument("--students", type=int, default=1000)
+    ap.add_argument("--teachers", type=int, default=20)
+    ap.add_argument("--courses", type=int, default=40)
+    ap.add_argument("--students-per-course", type=int, default=30)
+    ap.add_argument("--years", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--scale", type=float, default=1.0, help="各情境重複次數倍率")
+    ap.add_argument("--profiles", nargs="+", default=["default"], choices=[
+        p for p in ENGINE_PROFILES if p != "server"])
+    ap.add_argument("--session-modes", nargs="+", default=list(SESSION_MODES), choices=SESSION_MODES,
+                    help="要量測的 session 模式（預設兩種都跑）")
+    ap.add_argument("--out", help="JSON 結果輸出路徑（預設印到 stdout）")
+    ap.add_argument("--compare", help="與先前的 JSON 結果比較")
+    args = ap.parse_args(argv)
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from datetime import date
+
+from sqlalchemy import func, select
+
+from benchmarks.datagen import generate
+from models import AttendanceRecord, Student, student_course_association
+from services import AttendanceService
+
+SMALL = dict(students=40, teachers=3, courses=4, students_per_course=8, years=1,
+             end_date=date(2025, 6, 30), seed=7)
+
+
+def _snapshot(service):
+    with service.engine.connect() as conn:
+        return (conn.execute(select(AttendanceRecord.student_id, AttendanceRecord.date, AttendanceRecord.status)
+                             .order_by(AttendanceRecord.id)).all(),
+                conn.execute(select(Student.remaining_classes).order_by(Student.id)).scalars().all())
+
+
+def test_generate_counts_match_tables_and_balances_reconcile(service):
+    info = generate(service, **SMALL)
+    with service.engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(AttendanceRecord)) == info["attendance_records"] > 0
+        assert conn.scalar(select(func.count()).select_from(student_course_association)) == info["enrollments"] == 32
+    assert service.reconcile_balances() == 0          # 期初帳本與剩餘堂數一致
+    assert min(s.remaining_classes for s in service.get_all_students()) >= 0
+
+
+def test_generate_is_deterministic_for_a_seed(service, tmp_path):
+    generate(service, **SMALL)
+    other = AttendanceService(f"sqlite:///{tmp_path / 'other.db'}", reports_dir=tmp_path)
+    try:
+        generate(other, **SMALL)
+        assert _snapshot(service) == _snapshot(other)
+    finally:
+        other.dispose()
@@ -0,0 +1,18 @@
+import json
+
+from benchmarks.run import compare
+
+
+def test_compare_matches_old_results_without_session_mode_as_per_call(tmp_path, capsys):
+    old = tmp_path / "old.json"
+    old.write_text(json.dumps({"results": [{"profile": "default", "name": "take_attendance", "median_ms": 2.0}]}),
+                   encoding="utf-8")
+    current = {"results": [
+        {"profile": "default", "session_mode": "per_call", "name": "take_attendance", "median_ms": 3.0},
+        {"profile": "default", "session_mode": "scoped", "name": "take_attendance", "median_ms": 1.0},
+    ]}
+    compare(current, old)
+    lines = capsys.readouterr().err.splitlines()
+    # 舊結果只對得上 per_call；scoped 沒有可比較的前次結果
+    assert len(lines) == 1
+    assert "per_call" in lines[0] and "x1.50" in lines[0] and "變慢" in lines[0]
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    有上限的 LRU 查詢結果快取（執行緒安全）。
+    key 為 tuple，例如 ("students",)、("enrollment", course_id, True)；
+    invalidate 以 key 前綴清除，例如 ("enrollment", 3) 會清掉該課程的兩份名單。
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0   # 載入期間若被 invalidate，結果不寫回快取
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: tuple, loader):
+        if self.maxsize <= 0:
+            return loader()
+        hit, generation = self._lookup(key)
+        if hit is not None:
+            return hit
+        return self._store(key, loader(), generation)
+
+    async def aget_or_load(self, key: tuple, loader):
+        """get_or_load 的 asyncio 版本：loader 回傳 awaitable（供 async_service 使用）。"""
+        if self.maxsize <= 0:
+            return await loader()
+        hit, generation = self._lookup(key)
+        if hit is not None:
+            return hit
+        return self._store(key, await loader(), generation)
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return list(self._data[key]), None
+            self.misses += 1
+            return None, self._generation
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            # 載入期間若被 invalidate，結果不寫回快取
+            if generation != self._generation:
+                return list(value)
+            self._data[key] = tuple(value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return list(value)
+
+    def invalidate(self, *prefixes: tuple):
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._data
+                        if any(k[:len(p)] == p for p in prefixes)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._data), "maxsize": self.maxsize}
@@ -0,0 +1,48 @@
+"""
+pytest 共用 fixture：每個測試使用 tmp_path 下的全新 SQLite 檔，互不影響。
+
+    cd python && python -m pytest -q
+"""
+from datetime import date
+
+import pytest
+
+from services import AttendanceService
+
+# 2025-01-06 是星期一；測試資料的點名日期都以此推算
+MONDAY = date(2025, 1, 6)
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'attendance.db'}"
+
+
+@pytest.fixture
+def service(db_url, tmp_path):
+    svc = AttendanceService(db_url, reports_dir=tmp_path / "reports")
+    yield svc
+    svc.dispose()
+
+
+@pytest.fixture
+def school(service):
+    """
+    一位老師、一門課（每週一 18:00）、三位學生（各 10 堂）皆已報名。
+    回傳 {"teacher", "course", "schedule", "students"}（皆為 id）。
+    """
+    assert service.add_teacher("王老師", "0911000000", "台北")
+    teacher = service.get_all_teachers()[0].id
+    assert service.add_course("鋼琴", teacher)
+    course = service.get_all_courses_with_schedules()[0].id
+    assert service.add_course_schedule(course, "MON", "18:00")
+    schedule = service.get_all_courses_with_schedules()[0].schedules[0].id
+    students = [add_student(service, f"學生{i}", 10, f"09220000{i:02d}") for i in range(1, 4)]
+    service.update_course_enrollments(course, students)
+    return {"teacher": teacher, "course": course, "schedule": schedule, "students": students}
+
+
+def add_student(service, name, classes=0, phone=None):
+    """新增學生並回傳 id（add_student 回傳的 ORM 物件在 Session 關閉後已無法讀取屬性）。"""
+    assert service.add_student(name, phone, None, classes)
+    return next(s.id for s in service.get_all_students() if s.name == name)
@@ -0,0 +1,254 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+
+from sqlalchemy import and_, create_engine, event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+# 引擎設定檔：
+#   default  —— 與舊版相同，不額外設定
+#   desktop  —— 單機 SQLite：WAL、synchronous=NORMAL，減少每次 commit 的 fsync
+#   shared   —— desktop + SQLite shared cache（同一行程多連線共用 page cache）
+#   server   —— 伺服器資料庫（PostgreSQL/MySQL 等）的連線池設定
+#   readonly —— 唯讀：SQLite 以 mode=ro 開啟並設定 query_only（批次報表的工作行程）；
+#               資料夾無法寫入而開不了 WAL 資料庫時改以 immutable=1 開啟（見 _open_read_only）
+ENGINE_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "shared_cache": False,
+        "read_only": False,
+        "pool": {},
+    },
+    "desktop": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+            "cache_size": -16000,   # 約 16MB
+        },
+        "shared_cache": False,
+        "read_only": False,
+        "pool": {},
+    },
+    "shared": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+        },
+        "shared_cache": True,
+        "read_only": False,
+        "pool": {},
+    },
+    "server": {
+        "pragmas": {},
+        "shared_cache": False,
+        "read_only": False,
+        "pool": {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+        },
+    },
+    # 批次報表的工作行程：SQLite 以 mode=ro 開檔，再加 query_only 防止任何寫入
+    "readonly": {
+        "pragmas": {
+            "query_only": "ON",
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+            "cache_size": -16000,
+        },
+        "shared_cache": False,
+        "read_only": True,
+        "pool": {},
+    },
+}
+
+
+def _engine_args(db_url: str, profile: str):
+    """依設定檔整理 (url, create_engine 參數, 是否 SQLite, PRAGMA)。"""
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"未知的引擎設定檔：{profile}")
+    cfg = ENGINE_PROFILES[profile]
+    url = make_url(db_url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    pragmas = cfg["pragmas"]
+    if is_sqlite:
+        # SQLite 預設不檢查外鍵；開啟後 ondelete（例如帳本的 SET NULL）才會生效
+        pragmas = {"foreign_keys": "ON", **pragmas}
+
+    kwargs = {}
+    if is_sqlite:
+        if cfg["shared_cache"] and url.database and url.database != ":memory:":
+            url = url.set(database=f"file:{url.database}",
+                          query={**url.query, "cache": "shared", "uri": "true"})
+        elif cfg["read_only"] and url.database and url.database != ":memory:":
+            url = url.set(database=f"file:{url.database}",
+                          query={**url.query, "mode": "ro", "uri": "true"})
+    else:
+        kwargs.update(cfg["pool"])
+    return url, kwargs, is_sqlite, pragmas
+
+
+def _install_pragmas(engine, pragmas):
+    """每條新連線建立時套用 SQLite PRAGMA。"""
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for key, value in pragmas.items():
+                cur.execute(f"PRAGMA {key}={value}")
+        finally:
+            cur.close()
+
+
+def _install_sqlite_begin(engine):
+    """
+    pysqlite 預設只在 DML 前才自動 BEGIN：savepoint 若是第一個陳述式，RELEASE 時就直接 commit。
+    改由 SQLAlchemy 在交易開始時明確送出 BEGIN，begin_nested() 才會是外層交易內的 savepoint。
+    """
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_begin(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+def _create_sqlite_engine(url, kwargs, pragmas):
+    engine = create_engine(url, future=True, **kwargs)
+    if pragmas:
+        _install_pragmas(engine, pragmas)
+    _install_sqlite_begin(engine)
+    return engine
+
+
+def _probe(engine):
+    """實際開一條連線讀取 schema：mode=ro 的錯誤要到第一次讀取時才會出現。"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT count(*) FROM sqlite_master").scalar()
+
+
+def _open_read_only(url, kwargs, pragmas):
+    """
+    WAL 資料庫以 mode=ro 開啟時仍需建立 / 寫入 -shm 檔；資料庫放在無法寫入的資料夾
+    （唯讀網路磁碟、封存的備份）且沒有 -shm 時會開不了。
+    此時若沒有 -wal 檔（所有變更都已合併回主檔、也沒有連線正在寫入）就改以 immutable=1 開啟，
+    不使用 -shm 與鎖定；有 -wal 檔時 immutable 會讀不到其中的變更，直接丟出錯誤。
+    """
+    engine = _create_sqlite_engine(url, kwargs, pragmas)
+    try:
+        _probe(engine)
+        return engine
+    except OperationalError as e:
+        engine.dispose()
+        path = url.database.removeprefix("file:")
+        if os.path.exists(path + "-wal"):
+            raise OperationalError(None, None, sqlite3.OperationalError(
+                f"{e.orig}；資料庫有尚未合併的 WAL 檔（{path}-wal），但無法以唯讀方式讀取。"
+                "請在可寫入的位置開啟一次資料庫完成 checkpoint，或讓資料夾可寫入")) from e
+    engine = _create_sqlite_engine(url.update_query_dict({"immutable": "1"}), kwargs, pragmas)
+    _probe(engine)
+    return engine
+
+
+def make_engine(db_url: str, profile: str = "default"):
+    """依設定檔建立 engine；SQLite 的 PRAGMA 會在每條新連線建立時套用。"""
+    url, kwargs, is_sqlite, pragmas = _engine_args(db_url, profile)
+    if not is_sqlite:
+        return create_engine(url, future=True, **kwargs)
+    if url.query.get("mode") == "ro":
+        return _open_read_only(url, kwargs, pragmas)
+    return _create_sqlite_engine(url, kwargs, pragmas)
+
+
+def make_async_engine(db_url: str, profile: str = "default"):
+    """
+    make_engine 的 asyncio 版本（例如 sqlite+aiosqlite:///...、postgresql+asyncpg://...），
+    設定檔與 PRAGMA 相同；事件掛在 sync_engine 上。
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url, kwargs, is_sqlite, pragmas = _engine_args(db_url, profile)
+    engine = create_async_engine(url, **kwargs)
+    if is_sqlite:
+        if pragmas:
+            _install_pragmas(engine.sync_engine, pragmas)
+        _install_sqlite_begin(engine.sync_engine)
+    return engine
+
+
+# 支援 INSERT ... ON CONFLICT 的資料庫；其他資料庫由 insert_ignore / upsert 改用先查詢再寫入
+ON_CONFLICT_DIALECTS = ("sqlite", "postgresql")
+
+
+def dialect_insert(dialect_name: str):
+    """回傳支援 on_conflict_do_update / do_nothing 的 insert()（SQLite、PostgreSQL）。"""
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"{dialect_name} 不支援 ON CONFLICT upsert")
+    return insert
+
+
+def _split_existing(conn, table, rows, keys):
+    """把 rows 依 keys 分成 (新資料列, 已存在的資料列)；同一批內重複的鍵只保留第一列。"""
+    first = table.c[keys[0]]
+    existing = set()
+    values = list({r[keys[0]] for r in rows})
+    for i in range(0, len(values), 500):
+        existing.update(tuple(r) for r in conn.execute(
+            select(*(table.c[k] for k in keys)).where(first.in_(values[i:i + 500]))))
+    new, old, seen = [], [], set()
+    for r in rows:
+        key = tuple(r[k] for k in keys)
+        if key in seen:
+            continue
+        seen.add(key)
+        (old if key in existing else new).append(r)
+    return new, old
+
+
+def insert_ignore(dialect_name: str, conn, table, rows, keys) -> int:
+    """
+    INSERT 多列，keys 相同的資料已存在時略過該列，回傳新增的列數。
+    conn 可為 Connection 或 Session；不支援 ON CONFLICT 的資料庫先查出已存在的鍵再寫入。
+    """
+    if not rows:
+        return 0
+    if dialect_name in ON_CONFLICT_DIALECTS:
+        insert = dialect_insert(dialect_name)
+        res = conn.execute(insert(table).on_conflict_do_nothing(), rows)
+        return max(res.rowcount, 0)
+    new, _ = _split_existing(conn, table, rows, keys)
+    if new:
+        conn.execute(table.insert(), new)
+    return len(new)
+
+
+def upsert(dialect_name: str, conn, table, rows, keys, set_):
+    """
+    以 keys 為鍵 upsert 多列：新資料直接 INSERT，已存在者以 set_(excluded) 回傳的欄位更新。
+    excluded 為這一列要寫入的值（ON CONFLICT 時是 stmt.excluded，否則是該列的值），
+    例如 set_=lambda ex: {"phone": func.coalesce(ex.phone, table.c.phone)}。
+    """
+    if not rows:
+        return
+    if dialect_name in ON_CONFLICT_DIALECTS:
+        stmt = dialect_insert(dialect_name)(table).values(rows)
+        conn.execute(stmt.on_conflict_do_update(index_elements=keys, set_=set_(stmt.excluded)))
+        return
+    new, old = _split_existing(conn, table, rows, keys)
+    if new:
+        conn.execute(table.insert(), new)
+    for r in old:
+        conn.execute(table.update()
+                     .where(and_(*(table.c[k] == r[k] for k in keys)))
+                     .values(set_(SimpleNamespace(**r))))
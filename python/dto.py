@@ -0,0 +1,75 @@
+from datetime import date, time, datetime
+from typing import NamedTuple
+
+# 查詢 API 回傳的輕量資料列：直接由欄位查詢建立，不帶 ORM identity map / instance state，
+# Session 關閉後也能安全存取（不會觸發 lazy load）。
+
+
+class StudentRow(NamedTuple):
+    id: int
+    name: str
+    phone: str
+    address: str
+    registered_classes: int
+    remaining_classes: int
+
+
+class TeacherRow(NamedTuple):
+    id: int
+    name: str
+    phone: str
+    address: str
+
+
+class ScheduleRow(NamedTuple):
+    id: int
+    course_id: int
+    day_of_week: str
+    start_time: time
+    end_time: time
+
+
+class CourseRow(NamedTuple):
+    id: int
+    name: str
+    teacher_id: int
+    teacher_name: str
+    duration_minutes: int
+    break_minutes: int
+    schedules: tuple = ()     # tuple[ScheduleRow, ...]
+
+
+class ScheduleDetailRow(NamedTuple):
+    id: int
+    course_id: int
+    course_name: str
+    teacher_name: str
+    day_of_week: str
+    start_time: time
+    end_time: time
+
+
+class AttendanceRow(NamedTuple):
+    id: int
+    date: date
+    student_id: int
+    course_schedule_id: int
+    course_id: int
+    course_name: str
+    status: str
+    class_deducted: bool
+
+
+class LedgerRow(NamedTuple):
+    id: int
+    student_id: int
+    kind: str
+    amount: int
+    attendance_record_id: int
+    created_at: datetime
+    note: str
+
+
+def columns_for(model, row_type):
+    """取出 model 上與 row_type 欄位同名的 Column，供 select() 使用。"""
+    return [getattr(model, f) for f in row_type._fields]
@@ -0,0 +1,243 @@
+"""
+出勤明細匯出：把 AttendanceRecord 與學生、課程、排程、老師的 join 分批串流寫成 CSV / Parquet / XLSX，
+記憶體用量不隨資料量成長，適合多年歷史資料的下游分析。
+
+    exporter = AttendanceExporter(service)
+    exporter.export(date(2023, 1, 1), date(2025, 12, 31), "parquet", "history.parquet")
+    exporter.export_months(date(2023, 1, 1), date.today(), "parquet")   # 每月一檔，只重寫有異動的月份
+
+依月份分檔時，目錄中的 _manifest_<格式>.json 記錄每個月份匯出時的報表版本（models.report_month_version，
+與月報表快取共用同一組觸發器：點名、學生 / 老師 / 課程名稱、排程時間異動都會遞增）；
+再次執行只會寫入新月份與版本有變動的月份。資料庫沒有版本觸發器（非 SQLite）時每次都重寫。
+Parquet 需要 pyarrow（選用套件），XLSX 使用 openpyxl write-only 模式。
+"""
+import csv
+import json
+import os
+import pathlib
+from datetime import date, datetime
+
+from sqlalchemy import select, exists
+
+from models import Student, Teacher, Course, CourseSchedule, AttendanceRecord, report_month_version
+from services import REPORT_CHUNK_SIZE, month_bounds, months_between
+
+EXPORT_FORMATS = ("csv", "parquet", "xlsx")
+EXPORT_COLUMNS = ["record_id", "date", "student_id", "student_name", "course_id", "course_name",
+                  "schedule_id", "day_of_week", "start_time", "end_time", "teacher_id", "teacher_name",
+                  "status", "class_deducted"]
+# Excel 單一工作表上限 1,048,576 列（含標題列）
+XLSX_MAX_ROWS = 1_048_575
+
+
+def _history_query(start_date: date, end_date: date):
+    return (select(
+                AttendanceRecord.id, AttendanceRecord.date, Student.id, Student.name,
+                Course.id, Course.name, CourseSchedule.id, CourseSchedule.day_of_week,
+                CourseSchedule.start_time, CourseSchedule.end_time, Teacher.id, Teacher.name,
+                AttendanceRecord.status, AttendanceRecord.class_deducted)
+            .join(Student, AttendanceRecord.student_id == Student.id)
+            .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
+            .join(Course, CourseSchedule.course_id == Course.id)
+            .join(Teacher, Course.teacher_id == Teacher.id)
+            .where(AttendanceRecord.date.between(start_date, end_date))
+            .order_by(AttendanceRecord.date, AttendanceRecord.id))
+
+
+# ---------- 各格式的串流寫入 ----------
+class _CsvWriter:
+    def __init__(self, path):
+        # utf-8-sig：Excel 直接開啟時中文不會變亂碼
+        self.f = open(path, "w", newline="", encoding="utf-8-sig")
+        self.w = csv.writer(self.f)
+        self.w.writerow(EXPORT_COLUMNS)
+        self._iso = {}    # 日期 / 時間重複率高：轉字串的結果快取起來
+
+    def _isoformat(self, v):
+        s = self._iso.get(v)
+        if s is None:
+            s = self._iso[v] = v.isoformat() if v is not None else ""
+        return s
+
+    def write(self, rows):
+        # 逐欄轉換比逐列 str() 快：date、start_time、end_time 轉 ISO 字串，class_deducted 轉 0/1
+        columns = list(zip(*rows))
+        for i in (1, 8, 9):
+            columns[i] = [self._isoformat(v) for v in columns[i]]
+        columns[13] = [1 if v else 0 for v in columns[13]]
+        self.w.writerows(zip(*columns))
+
+    def close(self):
+        self.f.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("匯出 Parquet 需要安裝 pyarrow：pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("record_id", pa.int64()), ("date", pa.date32()),
+            ("student_id", pa.int64()), ("student_name", pa.string()),
+            ("course_id", pa.int64()), ("course_name", pa.string()),
+            ("schedule_id", pa.int64()), ("day_of_week", pa.string()),
+            ("start_time", pa.time64("us")), ("end_time", pa.time64("us")),
+            ("teacher_id", pa.int64()), ("teacher_name", pa.string()),
+            ("status", pa.string()), ("class_deducted", pa.bool_()),
+        ])
+        # 每批資料寫成一個 row group
+        self.w = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.w.write_batch(self.pa.RecordBatch.from_arrays(
+            [self.pa.array(col, type=field.type) for col, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.w.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path):
+        from openpyxl import Workbook
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        self.ws = self.wb.create_sheet(f"Sheet{self.sheets}")
+        self.ws.append(EXPORT_COLUMNS)
+        self.rows = 0
+
+    def write(self, rows):
+        for r in rows:
+            if self.rows >= XLSX_MAX_ROWS:
+                self._new_sheet()
+            self.ws.append(list(r))
+            self.rows += 1
+
+    def close(self):
+        self.wb.save(self.path)
+
+
+_WRITERS = {"csv": _CsvWriter, "parquet": _ParquetWriter, "xlsx": _XlsxWriter}
+
+
+class AttendanceExporter:
+    """出勤明細匯出；service 為 AttendanceService，共用其資料庫連線與 reports_dir。"""
+
+    def __init__(self, service, chunk_size: int = REPORT_CHUNK_SIZE):
+        self.service = service
+        self.chunk_size = chunk_size
+
+    def _default_dir(self, fmt):
+        return pathlib.Path(self.service.reports_dir) / "exports" / fmt
+
+    @staticmethod
+    def _check_format(fmt):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支援的匯出格式：{fmt}（可用：{', '.join(EXPORT_FORMATS)}）")
+
+    def _write(self, conn, start_date, end_date, fmt, path) -> int:
+        """分批寫入暫存檔，完成後才換成正式檔名（中途失敗不會留下不完整的檔案）。"""
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        writer = _WRITERS[fmt](tmp)
+        rows = 0
+        try:
+            result = conn.execute(
+                _history_query(start_date, end_date).execution_options(yield_per=self.chunk_size))
+            for chunk in result.partitions():
+                writer.write(chunk)
+                rows += len(chunk)
+            writer.close()
+        except BaseException:
+            try:
+                writer.close()
+            finally:
+                tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, path)
+        return rows
+
+    def export(self, start_date: date, end_date: date, fmt: str = "csv", path=None):
+        """
+        匯出 [start_date, end_date] 的出勤明細為單一檔案，回傳 {"path": 檔案路徑, "rows": 筆數}。
+        path 省略時寫到 reports_dir/exports/<格式>/attendance_<起>_<迄>.<格式>。
+        """
+        self._check_format(fmt)
+        if path is None:
+            path = self._default_dir(fmt) / f"attendance_{start_date:%Y%m%d}_{end_date:%Y%m%d}.{fmt}"
+        # 直接用 Core 連線串流（不經 ORM Session，每列少一層處理）
+        with self.service.engine.connect() as conn:
+            rows = self._write(conn, start_date, end_date, fmt, path)
+        return {"path": str(pathlib.Path(path).resolve()), "rows": rows}
+
+    # ---------- 依月份分檔（增量） ----------
+    @staticmethod
+    def _has_rows(conn, year: int, month: int) -> bool:
+        return conn.scalar(select(exists().where(AttendanceRecord.date.between(*month_bounds(year, month)))))
+
+    @staticmethod
+    def _load_manifest(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"months": {}}
+
+    @staticmethod
+    def _save_manifest(path, manifest):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def export_months(self, start_date: date, end_date: date, fmt: str = "parquet",
+                      out_dir=None, force: bool = False):
+        """
+        範圍內每個月份寫成 out_dir/attendance_YYYY-MM.<格式>；只寫入新月份與報表版本有變動的月份
+        （force=True 或無法取得版本時全部重寫），沒有資料的月份會移除舊檔。
+        回傳 {"dir", "written": [...], "unchanged": [...], "removed": [...]}（月份字串 YYYY-MM）。
+        """
+        self._check_format(fmt)
+        out = pathlib.Path(out_dir) if out_dir else self._default_dir(fmt)
+        out.mkdir(parents=True, exist_ok=True)
+        manifest_path = out / f"_manifest_{fmt}.json"
+        manifest = self._load_manifest(manifest_path)
+        months = manifest.setdefault("months", {})
+        manifest["columns"] = EXPORT_COLUMNS
+
+        written, unchanged, removed = [], [], []
+        with self.service.engine.connect() as conn:
+            for year, month in months_between(start_date, end_date):
+                key = f"{year}-{month:02d}"
+                path = out / f"attendance_{key}.{fmt}"
+                # 先讀版本再讀資料：匯出期間的異動會遞增版本，下次執行時重寫
+                version = report_month_version(conn, year, month)
+                entry = months.get(key)
+                if (not force and version is not None and entry and entry.get("version") == version
+                        and path.exists()):
+                    unchanged.append(key)
+                    continue
+                if not self._has_rows(conn, year, month):
+                    if entry is not None or path.exists():
+                        path.unlink(missing_ok=True)
+                        months.pop(key, None)
+                        removed.append(key)
+                    continue
+                rows = self._write(conn, *month_bounds(year, month), fmt, path)
+                months[key] = {"file": path.name, "rows": rows, "version": version,
+                               "exported_at": datetime.now().isoformat(timespec="seconds")}
+                written.append(key)
+                # 每寫完一個月就更新清單：中斷後重跑只需補寫剩下的月份
+                self._save_manifest(manifest_path, manifest)
+        self._save_manifest(manifest_path, manifest)
+        return {"dir": str(out.resolve()), "written": written, "unchanged": unchanged, "removed": removed}
@@ -0,0 +1,241 @@
+"""
+點名的本機預寫日誌（offline-first）。
+
+點名送出時先 append 到本機的 JSONL 日誌並 fsync，立即回報成功；
+JournalSyncer 在背景把尚未同步的點名以 take_attendance_batch 分批寫入資料庫。
+資料庫以 (學生, 排程, 日期) 唯一索引判斷重複，同一筆點名重送只會得到 duplicate，
+因此程式在「已寫入資料庫、尚未記下已同步」之間中斷也不會重複扣堂。
+
+日誌與同步記錄都只新增不修改；全部同步完成後才一起清空。
+日誌放在每台電腦本機的使用者資料夾（見 journal_path_for），資料庫在網路磁碟上時各台電腦互不干擾。
+"""
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import threading
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy.engine import make_url
+
+SYNC_BATCH_SIZE = 50
+APP_DIR_NAME = "rollcall"
+
+
+def local_data_dir() -> pathlib.Path:
+    """本機（不隨漫遊設定檔同步）的使用者資料夾：Windows 為 %LOCALAPPDATA%，macOS 為 ~/Library/Application Support，其他為 $XDG_STATE_HOME 或 ~/.local/state。"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or pathlib.Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = pathlib.Path.home() / "Library" / "Application Support"
+    else:
+        base = os.environ.get("XDG_STATE_HOME") or pathlib.Path.home() / ".local" / "state"
+    return pathlib.Path(base) / APP_DIR_NAME
+
+
+def journal_path_for(db_url, base_dir=None) -> pathlib.Path:
+    """
+    資料庫對應的本機日誌路徑：<本機資料夾>/journal-<資料庫名稱>-<識別碼>.jsonl。
+    識別碼取自資料庫的絕對路徑（SQLite）或不含密碼的連線 URL，開啟不同資料庫時日誌不會混用。
+    """
+    url = make_url(str(db_url))
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        identity = str(pathlib.Path(url.database).resolve())
+        stem = pathlib.Path(url.database).stem
+    else:
+        identity = url.render_as_string(hide_password=True)
+        stem = url.database or url.get_backend_name()
+    digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:12]
+    base = pathlib.Path(base_dir) if base_dir else local_data_dir()
+    return base / f"journal-{pathlib.Path(stem).name}-{digest}.jsonl"
+
+
+class RollCallJournal:
+    def __init__(self, path):
+        """path：日誌檔（JSONL，所在資料夾不存在時自動建立）；同步記錄寫在旁邊的 <path>.synced。"""
+        self.path = os.fspath(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.ack_path = self.path + ".synced"
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _append_line(path, record):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _read_lines(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue    # 寫到一半就中斷的最後一行
+        except FileNotFoundError:
+            return
+
+    def append(self, schedule_id: int, attendance_date: date, statuses: dict[int, str]) -> str:
+        """寫入一筆點名並 fsync，回傳日誌 id。"""
+        entry_id = uuid.uuid4().hex
+        record = {"id": entry_id, "schedule_id": int(schedule_id), "date": attendance_date.isoformat(),
+                  "statuses": {str(sid): status for sid, status in statuses.items()},
+                  "at": datetime.now().isoformat(timespec="seconds")}
+        with self._lock:
+            self._append_line(self.path, record)
+        return entry_id
+
+    def mark(self, entry_ids, result: str = "synced", reason: str | None = None):
+        """記下已處理的日誌 id；result 為 synced（已寫入）或 rejected（永久失敗，例如排程已刪除）。"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            with open(self.ack_path, "a", encoding="utf-8") as f:
+                for entry_id in entry_ids:
+                    f.write(json.dumps({"id": entry_id, "result": result, "reason": reason, "at": now},
+                                       ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self):
+        """尚未同步的點名：[(日誌 id, schedule_id, date, {student_id: 狀態})]，依寫入順序。"""
+        with self._lock:
+            done = {r.get("id") for r in self._read_lines(self.ack_path)}
+            return [(r["id"], r["schedule_id"], date.fromisoformat(r["date"]),
+                     {int(sid): status for sid, status in r["statuses"].items()})
+                    for r in self._read_lines(self.path) if r.get("id") not in done]
+
+    def rejected(self):
+        """被判定為永久失敗的記錄（供人工檢查）。"""
+        with self._lock:
+            return [r for path in (self.path + ".rejected", self.ack_path)
+                    for r in self._read_lines(path) if r.get("result") == "rejected"]
+
+    def compact(self) -> bool:
+        """全部同步完成時清空日誌與同步記錄（保留被拒絕的記錄），回傳是否有清空。"""
+        with self._lock:
+            done = {r.get("id") for r in self._read_lines(self.ack_path)}
+            if any(r.get("id") not in done for r in self._read_lines(self.path)):
+                return False
+            rejected = [r for r in self._read_lines(self.ack_path) if r.get("result") == "rejected"]
+            # 先清日誌再清同步記錄：中途中斷時最多留下無用的同步記錄
+            open(self.path, "w").close()
+            if rejected:
+                with open(self.path + ".rejected", "a", encoding="utf-8") as f:
+                    for r in rejected:
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            open(self.ack_path, "w").close()
+            return True
+
+
+class JournalSyncer:
+    """
+    背景執行緒：定期（或被 wake() 喚醒時）把日誌同步到資料庫。
+    on_status(待同步筆數) 在每次同步後於同步所在的執行緒呼叫（讀檔計數不佔用 GUI 執行緒），
+    不可直接操作 GUI：應只把數字放進 queue.Queue，由 GUI 主執行緒以 after() 輪詢取出。
+    """
+
+    def __init__(self, journal: RollCallJournal, service, interval: float = 5.0,
+                 batch_size: int = SYNC_BATCH_SIZE, on_status=None):
+        self.journal = journal
+        self.service = service
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_status = on_status
+        self.last_error = None
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="journal-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def pending_count(self) -> int:
+        return len(self.journal.pending())
+
+    def _report_status(self):
+        # 回報失敗（讀不到日誌檔、回呼出錯）只影響狀態顯示，不能讓同步迴圈結束
+        if self.on_status is None:
+            return
+        try:
+            self.on_status(self.pending_count())
+        except Exception as e:
+            print("回報待同步點名數失敗：", e)
+
+    def _run(self):
+        self._report_status()
+        delay = self.interval
+        while not self._stop.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                result = self.sync_now()
+            except Exception as e:
+                # 日誌檔暫時無法讀寫等非預期錯誤：視同同步失敗，下次再試
+                self.last_error = str(e)
+                result = None
+            # 資料庫無法連線時逐步拉長重試間隔（最多 60 秒）
+            delay = self.interval if result is not None else min(delay * 2, 60.0)
+
+    def sync_now(self):
+        """
+        同步所有待寫入的點名，回傳 {日誌 id: 點名結果}（本次寫入者）；
+        資料庫無法寫入時回傳 None，日誌保留待下次重試。
+        """
+        try:
+            return self._sync()
+        finally:
+            self._report_status()
+
+    def _sync(self):
+        with self._sync_lock:
+            synced = {}
+            pending = self.journal.pending()
+            for i in range(0, len(pending), self.batch_size):
+                chunk = pending[i:i + self.batch_size]
+                try:
+                    results = self.service.take_attendance_batch(
+                        [(sched_id, d, statuses) for _, sched_id, d, statuses in chunk], atomic=False)
+                except Exception as e:
+                    results = None
+                    self.last_error = str(e)
+                if results is None:
+                    return None
+                ok, failed = [], []
+                for (entry_id, sched_id, _, _), outcome in zip(chunk, results):
+                    if outcome is not None:
+                        ok.append(entry_id)
+                        synced[entry_id] = outcome
+                    else:
+                        failed.append((entry_id, sched_id))
+                if ok:
+                    self.journal.mark(ok)
+                for entry_id, sched_id in failed:
+                    # 排程已不存在才算永久失敗；查詢本身出錯視為暫時性錯誤
+                    try:
+                        missing = self.service.get_course_schedule_by_id(sched_id) is None
+                    except Exception as e:
+                        self.last_error = str(e)
+                        return None
+                    if not missing:
+                        return None
+                    self.journal.mark([entry_id], "rejected", f"找不到排程 {sched_id}")
+            self.last_error = None
+            self.journal.compact()
+            return synced
@@ -1,8 +1,160 @@
 # main_gui.py
+import queue
+import threading
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 from services import AttendanceService
+from journal import RollCallJournal, JournalSyncer, journal_path_for
+from exports import AttendanceExporter
+
+ROLL_CALL_STATUSES = ("有到", "遲到", "曠課")
+# 搜尋框停止輸入多久後才查詢（毫秒）
+SEARCH_DELAY_MS = 300
+# 狀態列「待同步點名」的更新間隔（毫秒）：只取出同步執行緒放進佇列的數字，不讀檔
+JOURNAL_STATUS_POLL_MS = 500
+
+class BackgroundWorker:
+    """
+    在執行緒池執行服務呼叫，完成後經由 after() 輪詢把結果送回 Tk 主執行緒。
+    同一個 key 的新工作會讓舊工作失效（尚未開始者直接取消，已在跑的結果會被丟棄）。
+    """
+    POLL_MS = 50
+
+    def __init__(self, root, on_busy_change=None, max_workers=2):
+        self.root = root
+        self.on_busy_change = on_busy_change
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="service")
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.tokens = {}      # key -> 最新一次 submit 的 token
+        self.futures = {}     # key -> Future
+        self.pending = 0
+        self.next_token = 0
+        self.root.after(self.POLL_MS, self._poll)
+
+    def submit(self, key, fn, *args, on_done=None, on_error=None, **kwargs):
+        with self.lock:
+            self.next_token += 1
+            token = self.tokens[key] = self.next_token
+            old = self.futures.pop(key, None)
+        if old is not None and old.cancel():
+            self._set_pending(-1)
+        self._set_pending(+1)
+
+        def run():
+            try:
+                self.results.put((key, token, True, fn(*args, **kwargs), on_done, on_error))
+            except Exception as e:
+                self.results.put((key, token, False, e, on_done, on_error))
+
+        with self.lock:
+            self.futures[key] = self.executor.submit(run)
+
+    def cancel(self, prefix=""):
+        """讓 key 以 prefix 開頭的工作失效，例如切換分頁時取消上一頁的刷新。"""
+        with self.lock:
+            keys = [k for k in self.tokens if k.startswith(prefix)]
+            futures = [self.futures.pop(k, None) for k in keys]
+            for k in keys:
+                del self.tokens[k]
+        for f in futures:
+            if f is not None and f.cancel():
+                self._set_pending(-1)
+
+    def _set_pending(self, delta):
+        with self.lock:
+            before = self.pending
+            self.pending += delta
+            after = self.pending
+        if self.on_busy_change and (before == 0) != (after == 0):
+            self.root.after(0, self.on_busy_change, after > 0)
+
+    def _poll(self):
+        try:
+            while True:
+                key, token, ok, value, on_done, on_error = self.results.get_nowait()
+                self._set_pending(-1)
+                with self.lock:
+                    current = self.tokens.get(key) == token
+                    if current:
+                        del self.tokens[key]
+                        self.futures.pop(key, None)
+                if not current:
+                    continue   # 已被更新的工作取代或被取消
+                if ok:
+                    if on_done:
+                        on_done(value)
+                elif on_error:
+                    on_error(value)
+                else:
+                    messagebox.showerror("錯誤", f"背景作業失敗：{value}")
+        except queue.Empty:
+            pass
+        self.root.after(self.POLL_MS, self._poll)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class PagedLoader:
+    """
+    以 keyset 分頁逐批載入清單：reset() 載入第一頁，more()（捲到接近底部時）載入下一頁。
+    fetch(query, cursor) 在背景執行緒回傳 (rows, next_cursor)；
+    on_page(rows, first) 在主執行緒把資料放進元件，first 為 True 時應先清空。
+    """
+
+    def __init__(self, worker, key, fetch, on_page):
+        self.worker = worker
+        self.key = key
+        self.fetch = fetch
+        self.on_page = on_page
+        self.query = ""
+        self.cursor = None
+        self.exhausted = True
+        self.loading = False
+        self._after_id = None
+
+    def reset(self, query=""):
+        self.query, self.cursor, self.exhausted = query.strip(), None, False
+        self._load(first=True)
+
+    def reset_later(self, query):
+        """搜尋框每次按鍵呼叫；連續輸入時只查詢最後一次。"""
+        if self._after_id is not None:
+            self.worker.root.after_cancel(self._after_id)
+        self._after_id = self.worker.root.after(SEARCH_DELAY_MS, self._reset_now, query)
+
+    def _reset_now(self, query):
+        self._after_id = None
+        self.reset(query)
+
+    def more(self):
+        if not self.exhausted and not self.loading:
+            self._load(first=False)
+
+    def _load(self, first):
+        self.loading = True
+        self.worker.submit(self.key, self.fetch, self.query, None if first else self.cursor,
+                           on_done=lambda page: self._on_page(page, first), on_error=self._on_error)
+
+    def _on_page(self, page, first):
+        rows, self.cursor = page
+        self.exhausted = self.cursor is None
+        self.loading = False
+        self.on_page(rows, first)
+
+    def _on_error(self, e):
+        self.loading = False
+        messagebox.showerror("錯誤", f"載入清單失敗：{e}")
+
+    def yscrollcommand(self, scrollbar):
+        """給 Treeview / Listbox 的 yscrollcommand：同步捲軸，捲到 90% 之後載入下一頁。"""
+        def command(first, last):
+            scrollbar.set(first, last)
+            if float(last) >= 0.9:
+                self.more()
+        return command
 
 class App(tk.Tk):
     def __init__(self):
@@ -10,11 +162,27 @@ class App(tk.Tk):
         self.title("學生點名系統")
         self.geometry("1000x700")
 
-        self.service = AttendanceService()
+        self.service = AttendanceService(profile="desktop", session_mode="scoped", session_calendar=True)
+        # 點名先寫入本機日誌，背景執行緒再同步到資料庫（資料庫暫時無法寫入時不會遺失）
+        # 待同步筆數由同步執行緒計算後放進佇列，主執行緒以 after() 輪詢取出（同步執行緒不碰 Tk）
+        self.journal = RollCallJournal(journal_path_for(self.service.engine.url))
+        self.journal_status = queue.Queue()
+        self.syncer = JournalSyncer(self.journal, self.service, on_status=self.journal_status.put)
 
         style = ttk.Style(self)
         style.configure("Danger.TButton", foreground="red")
 
+        # 狀態列：背景作業進行中時顯示忙碌指示
+        status = ttk.Frame(self); status.pack(fill="x", side="bottom", padx=10, pady=(0, 5))
+        self.busy_label = ttk.Label(status, text="")
+        self.busy_label.pack(side="left")
+        self.busy_bar = ttk.Progressbar(status, mode="indeterminate", length=120)
+        self.journal_label = ttk.Label(status, text="")
+        self.journal_label.pack(side="right")
+
+        self.worker = BackgroundWorker(self, on_busy_change=self.set_busy)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(pady=10, padx=10, fill="both", expand=True)
 
@@ -25,6 +193,40 @@ class App(tk.Tk):
         self.create_tab("查詢與報表", self.setup_report_tab)
 
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
+        self.syncer.start()
+        self.after(JOURNAL_STATUS_POLL_MS, self._poll_journal_status)
+
+    def set_busy(self, busy):
+        if busy:
+            self.busy_label.config(text="處理中…")
+            self.busy_bar.pack(side="left", padx=5)
+            self.busy_bar.start(10)
+            self.config(cursor="watch")
+        else:
+            self.busy_bar.stop()
+            self.busy_bar.pack_forget()
+            self.busy_label.config(text="")
+            self.config(cursor="")
+
+    def _poll_journal_status(self):
+        n = None
+        try:
+            while True:
+                n = self.journal_status.get_nowait()    # 只需要最新的一筆
+        except queue.Empty:
+            pass
+        if n is not None:
+            self._update_journal_label(n)
+        self.after(JOURNAL_STATUS_POLL_MS, self._poll_journal_status)
+
+    def _update_journal_label(self, n):
+        self.journal_label.config(text=f"待同步點名：{n} 堂" if n else "")
+
+    def on_close(self):
+        self.worker.shutdown()
+        self.syncer.stop()
+        self.service.dispose()
+        self.destroy()
 
     def create_tab(self, text, setup_function):
         frame = ttk.Frame(self.notebook, padding="10")
@@ -32,6 +234,8 @@ class App(tk.Tk):
         setup_function(frame)
 
     def on_tab_change(self, _):
+        # 快速切換分頁時，上一頁尚未完成的刷新已無意義
+        self.worker.cancel("tab:")
         tab = self.notebook.tab(self.notebook.select(), "text")
         if tab == "課程管理":
             self.refresh_teacher_combobox()
@@ -85,10 +289,22 @@ class App(tk.Tk):
             right_ops, text="刪除選定學生", command=self.delete_student, style="Danger.TButton"
         ).pack(fill="x")
 
+        ttk.Button(
+            right_ops, text="批次匯入學生 (CSV/Excel)", command=self.import_students
+        ).pack(fill="x", pady=(6, 0))
+
         # 學生列表區塊（這裡不再放按鈕）
         list_frame = ttk.LabelFrame(parent, text="學生列表與操作")
         list_frame.pack(fill="both", expand=True, padx=5, pady=5)
 
+        search_bar = ttk.Frame(list_frame)
+        search_bar.pack(fill="x", pady=(0, 5))
+        ttk.Label(search_bar, text="搜尋（姓名 / 電話開頭）:").pack(side="left", padx=5)
+        self.student_search_entry = ttk.Entry(search_bar, width=30)
+        self.student_search_entry.pack(side="left", padx=5)
+        self.student_search_entry.bind(
+            "<KeyRelease>", lambda _: self.student_loader.reset_later(self.student_search_entry.get()))
+
         table_container = ttk.Frame(list_frame)
         table_container.pack(side="left", fill="both", expand=True)
 
@@ -106,9 +322,14 @@ class App(tk.Tk):
         self.student_tree.column("id", width=50)
         self.student_tree.pack(side="left", fill="both", expand=True)
 
+        # 學生數量可能很多：依 (姓名, id) 分頁，捲動到底部附近再載入下一頁
+        self.student_loader = PagedLoader(
+            self.worker, "students",
+            lambda q, cursor: self.service.search_students(q, cursor),
+            self._fill_student_list)
         scrollbar = ttk.Scrollbar(table_container, orient="vertical", command=self.student_tree.yview)
         scrollbar.pack(side="right", fill="y")
-        self.student_tree.configure(yscrollcommand=scrollbar.set)
+        self.student_tree.configure(yscrollcommand=self.student_loader.yscrollcommand(scrollbar))
 
         self.student_tree.tag_configure("zero_classes", foreground="red")
 
@@ -126,16 +347,44 @@ class App(tk.Tk):
             n = int(cls) if cls else 0
         except ValueError:
             messagebox.showerror("錯誤", "報名堂數必須是數字！"); return
-        if self.service.add_student(name, phone, addr, n):
+        self.worker.submit("write:add_student", self.service.add_student, name, phone, addr, n,
+                           on_done=self._on_student_added)
+
+    def _on_student_added(self, obj):
+        if obj:
             self.refresh_student_list()
             for e in (self.student_name_entry, self.student_phone_entry,
                       self.student_address_entry, self.student_classes_entry):
                 e.delete(0, tk.END)
 
+    def import_students(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="選擇學生名冊",
+            filetypes=[("名冊檔案", "*.csv *.xlsx"), ("CSV", "*.csv"), ("Excel", "*.xlsx")])
+        if not path:
+            return
+        self.worker.submit("import_students", self.service.import_students, path,
+                           on_done=self._on_students_imported)
+
+    def _on_students_imported(self, report):
+        msg = f"已匯入 / 更新 {report.imported} 位學生。"
+        if report.errors:
+            msg += f"\n\n有 {len(report.errors)} 列未匯入："
+            for e in report.errors[:10]:
+                where = f"第 {e.row} 列" if e.row else "檔案"
+                msg += f"\n{where} {e.name}：{e.message}"
+            if len(report.errors) > 10:
+                msg += f"\n……其餘 {len(report.errors) - 10} 列略"
+        (messagebox.showwarning if report.errors else messagebox.showinfo)("匯入結果", msg)
+        self.refresh_student_list()
+
     def refresh_student_list(self):
-        for i in self.student_tree.get_children():
-            self.student_tree.delete(i)
-        for s in self.service.get_all_students():
+        self.student_loader.reset(self.student_search_entry.get())
+
+    def _fill_student_list(self, students, first=True):
+        if first:
+            self.student_tree.delete(*self.student_tree.get_children())
+        for s in students:
             tags = ("zero_classes",) if s.remaining_classes <= 0 else ()
             self.student_tree.insert("", "end",
                 values=(s.id, s.name, s.phone, s.address, s.registered_classes, s.remaining_classes),
@@ -147,8 +396,9 @@ class App(tk.Tk):
             messagebox.showwarning("警告", "請先選擇一位學生。"); return
         sid, name = self.student_tree.item(it)["values"][0:2]
         n = simpledialog.askinteger("增加堂數", f"要為學生 {name} 增加幾堂課？", minvalue=1, parent=self)
-        if n and self.service.add_classes_to_student(sid, n):
-            self.refresh_student_list()
+        if n:
+            self.worker.submit("write:add_classes", self.service.add_classes_to_student, sid, n,
+                               on_done=lambda ok: ok and self.refresh_student_list())
 
     def delete_student(self):
         it = self.student_tree.focus()
@@ -156,9 +406,13 @@ class App(tk.Tk):
             messagebox.showwarning("警告", "請先選擇一位學生。"); return
         sid, name = self.student_tree.item(it)["values"][0:2]
         if messagebox.askyesno("確認刪除", f"確定刪除學生【{name}】？此操作無法復原！", icon="warning"):
-            if self.service.delete_student(sid):
-                self.refresh_student_list()
-                self.refresh_report_student_list()
+            self.worker.submit("write:delete_student", self.service.delete_student, sid,
+                               on_done=self._on_student_deleted)
+
+    def _on_student_deleted(self, ok):
+        if ok:
+            self.refresh_student_list()
+            self.refresh_report_student_list()
 
     # ===== 老師管理 =====
     def setup_teacher_tab(self, parent):
@@ -186,15 +440,22 @@ class App(tk.Tk):
         addr = self.teacher_address_entry.get().strip()
         if not name:
             messagebox.showerror("錯誤", "老師姓名不能為空！"); return
-        if self.service.add_teacher(name, phone, addr):
+        self.worker.submit("write:add_teacher", self.service.add_teacher, name, phone, addr,
+                           on_done=self._on_teacher_added)
+
+    def _on_teacher_added(self, obj):
+        if obj:
             self.refresh_teacher_list()
             for e in (self.teacher_name_entry, self.teacher_phone_entry, self.teacher_address_entry):
                 e.delete(0, tk.END)
 
     def refresh_teacher_list(self):
+        self.worker.submit("teachers", self.service.get_all_teachers, on_done=self._fill_teacher_list)
+
+    def _fill_teacher_list(self, teachers):
         for i in self.teacher_tree.get_children():
             self.teacher_tree.delete(i)
-        for t in self.service.get_all_teachers():
+        for t in teachers:
             self.teacher_tree.insert("", "end", values=(t.id, t.name, t.phone, t.address))
 
     def delete_teacher(self):
@@ -202,7 +463,11 @@ class App(tk.Tk):
         if not it:
             messagebox.showwarning("警告", "請先選擇一位老師。"); return
         tid, name = self.teacher_tree.item(it)["values"][0:2]
-        ok, msg = self.service.delete_teacher(tid)
+        self.worker.submit("write:delete_teacher", self.service.delete_teacher, tid,
+                           on_done=self._on_teacher_deleted)
+
+    def _on_teacher_deleted(self, res):
+        ok, msg = res
         if ok:
             self.refresh_teacher_list()
         else:
@@ -240,20 +505,27 @@ class App(tk.Tk):
         self.refresh_course_list()
 
     def refresh_teacher_combobox(self):
-        t = self.service.get_all_teachers()
+        self.worker.submit("tab:course:teachers", self.service.get_all_teachers,
+                           on_done=self._fill_teacher_combobox)
+
+    def _fill_teacher_combobox(self, t):
         self.teacher_map = {x.name: x.id for x in t}
         self.course_teacher_combo["values"] = list(self.teacher_map.keys())
 
     def refresh_course_list(self):
+        self.worker.submit("tab:course:courses", self.service.get_all_courses_with_schedules,
+                           on_done=self._fill_course_list)
+
+    def _fill_course_list(self, courses):
         for i in self.course_tree.get_children():
             self.course_tree.delete(i)
         names = []
         self.course_map = {}
-        for c in self.service.get_all_courses_with_schedules():
+        for c in courses:
             names.append(f"{c.id}: {c.name}")
             self.course_map[f"{c.id}: {c.name}"] = c.id
             sched = ", ".join([f"{s.day_of_week} {s.start_time.strftime('%H:%M')}" for s in c.schedules])
-            self.course_tree.insert("", "end", values=(c.id, c.name, c.teacher.name, sched))
+            self.course_tree.insert("", "end", values=(c.id, c.name, c.teacher_name, sched))
         self.schedule_course_combo["values"] = names
 
     def add_course(self):
@@ -262,7 +534,11 @@ class App(tk.Tk):
         if not name or not tname:
             messagebox.showerror("錯誤", "課程名稱和授課老師皆須選擇。"); return
         tid = self.teacher_map[tname]
-        if self.service.add_course(name, tid):
+        self.worker.submit("write:add_course", self.service.add_course, name, tid,
+                           on_done=self._on_course_added)
+
+    def _on_course_added(self, obj):
+        if obj:
             self.refresh_course_list()
             self.course_name_entry.delete(0, tk.END)
 
@@ -277,11 +553,46 @@ class App(tk.Tk):
         except ValueError:
             messagebox.showerror("錯誤", "時間格式錯誤，請使用 HH:MM。"); return
         cid = self.course_map[course_str]
+        self.worker.submit("add_schedule", self._add_schedule_job, cid, day, tstr,
+                           on_done=lambda res: self._on_schedule_added(res, day, tstr))
+
+    def _add_schedule_job(self, cid, day, tstr):
+        """
+        背景執行緒：新增排程；失敗時一併查出衝突說明（最多 10 筆）要用的名稱。
+        回傳 (是否成功, 說明文字列, 衝突總數)。
+        """
         if self.service.add_course_schedule(cid, day, tstr):
+            return True, [], 0
+        conflicts = self.service.find_schedule_conflicts(cid, day, tstr) or []
+        if not conflicts:
+            return False, [], 0
+        names = {c.id: c.name for c in self.service.get_all_courses_with_schedules()}
+        teachers = {t.id: t.name for t in self.service.get_all_teachers()}
+        # 只查詢要顯示的學生姓名，不載入整份學生名單
+        students = {}
+        for c in conflicts[:10]:
+            if c.kind == "student" and c.owner_id not in students:
+                stu = self.service.get_student_by_id(c.owner_id)
+                students[c.owner_id] = stu.name if stu else c.owner_id
+        lines = []
+        for c in conflicts[:10]:
+            who = (f"老師 {teachers.get(c.owner_id, c.owner_id)}" if c.kind == "teacher"
+                   else f"學生 {students.get(c.owner_id, c.owner_id)}")
+            lines.append(f"{who}：{names.get(c.other_course_id, c.other_course_id)} "
+                         f"{c.other_start.strftime('%H:%M')}-{c.other_end.strftime('%H:%M')}")
+        return False, lines, len(conflicts)
+
+    def _on_schedule_added(self, res, day, tstr):
+        ok, lines, total = res
+        if ok:
             self.refresh_course_list()
             self.schedule_time_entry.delete(0, tk.END)
-        else:
-            messagebox.showerror("錯誤", "新增課程時間失敗，請檢查是否與午休衝突。")
+            return
+        if not total:
+            messagebox.showerror("錯誤", "新增課程時間失敗，請檢查是否與午休衝突。"); return
+        if total > 10:
+            lines.append(f"……其餘 {total - 10} 筆略")
+        messagebox.showerror("時段衝突", f"{day} {tstr} 與以下既有課程重疊：\n" + "\n".join(lines))
 
     def delete_course(self):
         it = self.course_tree.focus()
@@ -289,8 +600,8 @@ class App(tk.Tk):
             messagebox.showwarning("警告", "請先選擇一門課程。"); return
         cid, name = self.course_tree.item(it)["values"][0:2]
         if messagebox.askyesno("確認刪除", f"確定刪除課程【{name}】？此操作會刪除其時間表與點名記錄！", icon="warning"):
-            if self.service.delete_course(cid):
-                self.refresh_course_list()
+            self.worker.submit("write:delete_course", self.service.delete_course, cid,
+                               on_done=lambda ok: ok and self.refresh_course_list())
 
     def open_enrollment_window(self):
         it = self.course_tree.focus()
@@ -310,13 +621,44 @@ class App(tk.Tk):
 
         self.attendance_frame = ttk.LabelFrame(parent, text="學生點名 (請先選擇上方課程)")
         self.attendance_frame.pack(fill="both", expand=True, padx=5, pady=10)
-        self.student_attendance_widgets = []
+
+        # 點名表只建立一次：Treeview 只繪製可見列，千人課程也不會產生上千個元件
+        bar = ttk.Frame(self.attendance_frame); bar.pack(fill="x", padx=10, pady=5)
+        for txt in ROLL_CALL_STATUSES:
+            ttk.Button(bar, text=f"全部{txt}", command=lambda v=txt: self.set_roll_call_status(v, all_rows=True)
+                       ).pack(side="left", padx=(0, 5))
+        self.roll_call_hint = ttk.Label(bar, text="點選狀態欄或按 1/2/3 設定選取學生，空白鍵切換，Ctrl+A 全選")
+        self.roll_call_hint.pack(side="left", padx=10)
+
+        table = ttk.Frame(self.attendance_frame); table.pack(fill="both", expand=True, padx=10)
+        self.roll_call_tree = ttk.Treeview(table, columns=("name", "remaining", "status"), show="headings")
+        for k, t, w in [("name", "學生姓名", 200), ("remaining", "剩餘堂數", 100), ("status", "出勤狀態", 100)]:
+            self.roll_call_tree.heading(k, text=t)
+            self.roll_call_tree.column(k, width=w)
+        self.roll_call_tree.tag_configure("遲到", foreground="orange")
+        self.roll_call_tree.tag_configure("曠課", foreground="red")
+        sb = ttk.Scrollbar(table, orient="vertical", command=self.roll_call_tree.yview)
+        self.roll_call_tree.configure(yscrollcommand=sb.set)
+        self.roll_call_tree.pack(side="left", fill="both", expand=True); sb.pack(side="right", fill="y")
+
+        self.roll_call_tree.bind("<Button-1>", self.on_roll_call_click)
+        self.roll_call_tree.bind("<space>", lambda e: self.cycle_roll_call_status())
+        self.roll_call_tree.bind("<Control-a>", lambda e: self.roll_call_tree.selection_set(self.roll_call_tree.get_children()))
+        for i, txt in enumerate(ROLL_CALL_STATUSES, start=1):
+            self.roll_call_tree.bind(str(i), lambda e, v=txt: self.set_roll_call_status(v))
+
+        self.roll_call_submit = ttk.Button(self.attendance_frame, text="完成點名", command=self.submit_attendance)
+        self.roll_call_submit.pack(pady=10)
+        self.roll_call_status = {}   # iid(student_id 字串) -> 出勤狀態
 
     def refresh_today_class_list(self):
+        today = date.today()
+        self.worker.submit("tab:attendance:today", self.service.get_courses_for_period, today, today,
+                           on_done=self._fill_today_class_list)
+
+    def _fill_today_class_list(self, occ):
         for i in self.today_class_tree.get_children():
             self.today_class_tree.delete(i)
-        today = date.today()
-        occ = self.service.get_courses_for_period(today, today)
         if not occ:
             messagebox.showinfo("資訊", "今天沒有排定的課程。"); return
         self.today_courses_map = {}
@@ -325,10 +667,12 @@ class App(tk.Tk):
             iid = self.today_class_tree.insert("", "end", values=(tstr, o["course_name"],o['course_id'], o["teacher_name"]))
             self.today_courses_map[iid] = o
 
+    def clear_roll_call(self):
+        self.roll_call_tree.delete(*self.roll_call_tree.get_children())
+        self.roll_call_status = {}
+
     def on_class_select(self, _):
-        for w in self.attendance_frame.winfo_children():
-            w.destroy()
-        self.student_attendance_widgets = []
+        self.clear_roll_call()
 
         it = self.today_class_tree.focus()
         if not it: return
@@ -336,55 +680,109 @@ class App(tk.Tk):
         if not sel: return
 
         self.attendance_frame.config(text=f"學生點名 - {sel['course_name']} ({sel['start_time'].strftime('%H:%M')})")
+        self.worker.submit("tab:attendance:roster", self.service.get_students_for_course, sel["course_id"],
+                           on_done=self._build_roll_call)
 
-        students = self.service.get_students_for_course(sel["course_id"])
+    def _build_roll_call(self, students):
         if not students:
-            ttk.Label(self.attendance_frame, text="沒有已報名的學生。請先在『課程管理→管理課程學生』加入學生。").pack(pady=20)
+            self.attendance_frame.config(text="沒有已報名的學生。請先在『課程管理→管理課程學生』加入學生。")
             return
-
-        header = ttk.Frame(self.attendance_frame); header.pack(fill="x", padx=10, pady=5)
-        ttk.Label(header, text="學生姓名", width=20, font=("Arial",10,"bold")).pack(side="left")
-        ttk.Label(header, text="剩餘堂數", width=10, font=("Arial",10,"bold")).pack(side="left", padx=10)
-        ttk.Label(header, text="出勤狀態", font=("Arial",10,"bold")).pack(side="left", padx=20)
-
-        canvas = tk.Canvas(self.attendance_frame)
-        sb = ttk.Scrollbar(self.attendance_frame, orient="vertical", command=canvas.yview)
-        inner = ttk.Frame(canvas)
-        inner.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.create_window((0,0), window=inner, anchor="nw")
-        canvas.configure(yscrollcommand=sb.set)
-        canvas.pack(side="left", fill="both", expand=True); sb.pack(side="right", fill="y")
-
+        default = ROLL_CALL_STATUSES[0]
         for s in students:
-            row = ttk.Frame(inner); row.pack(fill="x", padx=10, pady=2)
-            ttk.Label(row, text=s.name, width=20).pack(side="left")
-            ttk.Label(row, text=f"{s.remaining_classes} 堂", width=10).pack(side="left", padx=10)
-            var = tk.StringVar(value="有到")
-            for txt in ("有到","遲到","曠課"):
-                ttk.Radiobutton(row, text=txt, variable=var, value=txt).pack(side="left", padx=5)
-            self.student_attendance_widgets.append({"student_id": s.id, "status_var": var})
-
-        ttk.Button(self.attendance_frame, text="完成點名", command=self.submit_attendance).pack(pady=20)
+            iid = str(s.id)
+            self.roll_call_tree.insert("", "end", iid=iid,
+                                       values=(s.name, f"{s.remaining_classes} 堂", default))
+            self.roll_call_status[iid] = default
+        self.roll_call_tree.focus_set()
+
+    def set_roll_call_status(self, status, all_rows=False, rows=None):
+        tree = self.roll_call_tree
+        targets = tree.get_children() if all_rows else (rows or tree.selection())
+        for iid in targets:
+            self.roll_call_status[iid] = status
+            tree.set(iid, "status", status)
+            tree.item(iid, tags=(status,))
+
+    def cycle_roll_call_status(self, rows=None):
+        for iid in rows or self.roll_call_tree.selection():
+            cur = self.roll_call_status.get(iid, ROLL_CALL_STATUSES[0])
+            nxt = ROLL_CALL_STATUSES[(ROLL_CALL_STATUSES.index(cur) + 1) % len(ROLL_CALL_STATUSES)]
+            self.set_roll_call_status(nxt, rows=(iid,))
+
+    def on_roll_call_click(self, event):
+        # 點在「出勤狀態」欄上時直接切換該列狀態
+        tree = self.roll_call_tree
+        if tree.identify_region(event.x, event.y) != "cell" or tree.identify_column(event.x) != "#3":
+            return
+        iid = tree.identify_row(event.y)
+        if iid:
+            self.cycle_roll_call_status(rows=(iid,))
 
     def submit_attendance(self):
         it = self.today_class_tree.focus()
         if not it:
             messagebox.showwarning("警告", "請先選擇一門課程。"); return
         sel = self.today_courses_map.get(it)
-        stat = {w["student_id"]: w["status_var"].get() for w in self.student_attendance_widgets}
-        if self.service.take_attendance(sel["schedule_id"], date.today(), stat):
-            messagebox.showinfo("成功", "點名完成！已更新剩餘堂數。")
-            for w in self.attendance_frame.winfo_children(): w.destroy()
+        if not self.roll_call_status:
+            messagebox.showwarning("警告", "這堂課沒有可點名的學生。"); return
+        stat = {int(iid): status for iid, status in self.roll_call_status.items()}
+        entry_id = self.journal.append(sel["schedule_id"], date.today(), stat)
+        self.worker.submit("submit_attendance", self._sync_entry, entry_id,
+                           on_done=self._on_attendance_submitted)
+
+    def _sync_entry(self, entry_id):
+        """
+        背景執行：同步日誌並判斷這筆點名的結果（讀日誌檔不佔用主執行緒）。
+        回傳 ("synced", 各學生結果或 None)、("rejected", None) 或 ("pending", None)。
+        """
+        res = self.syncer.sync_now()
+        if res is not None and entry_id in res:
+            return "synced", list(res[entry_id].values())
+        if any(r["id"] == entry_id for r in self.journal.rejected()):
+            return "rejected", None
+        if any(pid == entry_id for pid, *_ in self.journal.pending()):
+            return "pending", None
+        # 已由背景同步寫入
+        return "synced", None
+
+    def _on_attendance_submitted(self, res):
+        state, outcomes = res
+        if state == "synced" and outcomes is not None:
+            msg = "點名完成！已更新剩餘堂數。"
+            if outcomes.count("duplicate"):
+                msg += f"\n{outcomes.count('duplicate')} 位學生今日已點過名，已略過。"
+            if outcomes.count("not_deducted"):
+                msg += f"\n{outcomes.count('not_deducted')} 位學生剩餘堂數為 0，未扣堂。"
+            if outcomes.count("unknown"):
+                msg += f"\n{outcomes.count('unknown')} 位學生不存在，已略過。"
+            messagebox.showinfo("成功", msg)
+            self.clear_roll_call()
             self.refresh_student_list()
+        elif state == "rejected":
+            messagebox.showerror("錯誤", "點名失敗：找不到這堂課的排程（可能已被刪除）。")
+        elif state == "pending":
+            messagebox.showinfo("已暫存", "資料庫暫時無法寫入，點名已暫存於本機，稍後會自動同步。")
+            self.clear_roll_call()
         else:
-            messagebox.showerror("錯誤", "點名失敗，請查看主控台輸出。")
+            messagebox.showinfo("成功", "點名完成！已更新剩餘堂數。")
+            self.clear_roll_call()
+            self.refresh_student_list()
 
     # ===== 查詢與報表 =====
     def setup_report_tab(self, parent):
         qf = ttk.LabelFrame(parent, text="學生出勤查詢"); qf.pack(fill="x", padx=5, pady=5)
         ttk.Label(qf, text="選擇學生:").pack(side="left", padx=5, pady=5)
-        self.report_student_combo = ttk.Combobox(qf, state="readonly", width=30)
+        # 可直接輸入：依姓名 / 電話 / 地址的部分或模糊比對即時更新選項（依相關程度排序）
+        self.report_student_combo = ttk.Combobox(qf, width=30)
         self.report_student_combo.pack(side="left", padx=5, pady=5)
+        self.report_student_map = {}
+        self.report_student_loader = PagedLoader(
+            self.worker, "report:students",
+            lambda q, cursor: ((self.service.find_students(q, limit=50), None) if q
+                               else self.service.search_students("", cursor)),
+            self._fill_report_student_list)
+        self.report_student_combo.bind(
+            "<KeyRelease>", self._on_report_student_typed)
         ttk.Button(qf, text="查詢", command=self.query_student_attendance).pack(side="left", padx=10)
 
         self.student_attendance_tree = ttk.Treeview(
@@ -403,11 +801,19 @@ class App(tk.Tk):
         self.report_month_combo = ttk.Combobox(mf, values=[f"{m:02d}" for m in range(1,13)], state="readonly")
         self.report_month_combo.set(f"{_dt.now().month:02d}"); self.report_month_combo.pack(side="left", padx=5, pady=5)
         ttk.Button(mf, text="匯出 Excel 報表", command=self.export_monthly_report).pack(side="left", padx=10)
+        ttk.Button(mf, text="匯出全年出勤明細…", command=self.export_year_history).pack(side="left", padx=5)
 
     def refresh_report_student_list(self):
-        students = self.service.get_all_students()
-        self.report_student_map = {s.name: s.id for s in students}
-        self.report_student_combo["values"] = list(self.report_student_map.keys())
+        self.report_student_loader.reset(self.report_student_combo.get())
+
+    def _on_report_student_typed(self, event):
+        if event.keysym not in ("Up", "Down", "Return", "Escape"):
+            self.report_student_loader.reset_later(self.report_student_combo.get())
+
+    def _fill_report_student_list(self, students, first=True):
+        # 下拉選單只放第一頁符合的學生，其餘請繼續輸入縮小範圍
+        self.report_student_map.update((s.name, s.id) for s in students)
+        self.report_student_combo["values"] = [s.name for s in students]
 
     def query_student_attendance(self):
         for i in self.student_attendance_tree.get_children():
@@ -415,25 +821,53 @@ class App(tk.Tk):
         name = self.report_student_combo.get().strip()
         if not name:
             messagebox.showwarning("警告", "請先選擇一位學生。"); return
-        sid = self.report_student_map[name]
-        stu, recs = self.service.get_student_attendance(sid)
-        if stu:
-            self.student_attendance_tree.heading("date", text=f"日期 ( {stu.name} - 剩餘 {stu.remaining_classes} 堂 )")
+        # 不在選項中（直接輸入完整姓名）時以姓名查詢
+        sid = self.report_student_map.get(name, name)
+        self.worker.submit("tab:report:history", self.service.get_student_attendance, sid,
+                           on_done=self._fill_student_attendance)
+
+    def _fill_student_attendance(self, result):
+        stu, recs = result
+        if not stu:
+            messagebox.showwarning("警告", "找不到這位學生。"); return
+        self.student_attendance_tree.heading("date", text=f"日期 ( {stu.name} - 剩餘 {stu.remaining_classes} 堂 )")
         for r in recs:
-            cname = r.course_schedule.course.name if r.course_schedule and r.course_schedule.course else "N/A"
             self.student_attendance_tree.insert("", "end",
-                values=(r.date, cname, r.status, "是" if r.class_deducted else "否"))
+                values=(r.date, r.course_name, r.status, "是" if r.class_deducted else "否"))
 
     def export_monthly_report(self):
         y = self.report_year_combo.get().strip()
         m = self.report_month_combo.get().strip()
         if not y or not m:
             messagebox.showerror("錯誤", "請選擇年份和月份。"); return
-        rows = self.service.get_monthly_attendance_report(int(y), int(m))
-        if not rows:
-            messagebox.showinfo("資訊", f"{y}年{m}月沒有任何點名記錄。"); return
-        path = self.service.export_report_to_excel(rows, int(y), int(m))
-        if path:
+
+        def job():
+            if not self.service.has_attendance_in_month(int(y), int(m)):
+                return False
+            return self.service.export_monthly_report(int(y), int(m))
+
+        self.worker.submit("export", job, on_done=lambda path: self._on_report_exported(path, y, m))
+
+    def export_year_history(self):
+        y = int(self.report_year_combo.get().strip())
+        path = filedialog.asksaveasfilename(
+            parent=self, title=f"匯出 {y} 年出勤明細", initialfile=f"attendance_{y}.csv",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet"), ("Excel", "*.xlsx")])
+        if not path:
+            return
+        fmt = path.rsplit(".", 1)[-1].lower()
+        if fmt not in ("csv", "parquet", "xlsx"):
+            messagebox.showerror("錯誤", "請選擇 .csv、.parquet 或 .xlsx 檔案。"); return
+        exporter = AttendanceExporter(self.service)
+        self.worker.submit("export", exporter.export, date(y, 1, 1), date(y, 12, 31), fmt, path,
+                           on_done=lambda r: messagebox.showinfo(
+                               "成功", f"已匯出 {r['rows']} 筆出勤明細至：\n{r['path']}"))
+
+    def _on_report_exported(self, path, y, m):
+        if path is False:
+            messagebox.showinfo("資訊", f"{y}年{m}月沒有任何點名記錄。")
+        elif path:
             messagebox.showinfo("成功", f"報表已匯出至：\n{path}")
         else:
             messagebox.showerror("錯誤", "匯出失敗。")
@@ -446,11 +880,27 @@ class EnrollmentWindow(tk.Toplevel):
         self.geometry("600x500")
 
         self.service = service
+        self.worker = parent.worker
         self.course_id = int(course_id)
 
+        self.original = {}     # 資料庫中已報名的學生 {id: StudentRow}
+        self.enrolled = {}     # 目前右側名單（尚未儲存的變更）{id: StudentRow}
+        self.unrolled = []     # 左側名單各列對應的 StudentRow
+
         main = ttk.Frame(self, padding=10); main.pack(fill="both", expand=True)
         left = ttk.LabelFrame(main, text="未報名學生"); left.pack(side="left", fill="both", expand=True, padx=5)
+        self.search_entry = ttk.Entry(left); self.search_entry.pack(fill="x", padx=2, pady=(2, 5))
+        self.search_entry.bind("<KeyRelease>", lambda _: self.unrolled_loader.reset_later(self.search_entry.get()))
+        scroll = ttk.Scrollbar(left, orient="vertical"); scroll.pack(side="right", fill="y")
         self.unrolled_listbox = tk.Listbox(left, selectmode=tk.EXTENDED); self.unrolled_listbox.pack(fill="both", expand=True)
+        # 未報名學生可能是全校學生：依搜尋條件分頁，捲到底部附近再載入下一頁
+        cid = self.course_id
+        self.unrolled_loader = PagedLoader(
+            self.worker, "enrollment:unrolled",
+            lambda q, cursor: self.service.search_students(q, cursor, course_id=cid, enrolled=False),
+            self._fill_unrolled)
+        scroll.configure(command=self.unrolled_listbox.yview)
+        self.unrolled_listbox.configure(yscrollcommand=self.unrolled_loader.yscrollcommand(scroll))
         mid = ttk.Frame(main); mid.pack(side="left", fill="y", padx=10)
         ttk.Button(mid, text=">>\n報名", command=self.enroll).pack(pady=10)
         ttk.Button(mid, text="<<\n取消", command=self.unenroll).pack(pady=10)
@@ -460,43 +910,100 @@ class EnrollmentWindow(tk.Toplevel):
 
         self.populate_lists()
 
+    @staticmethod
+    def _label(s):
+        return f"{s.name} (ID: {s.id})"
+
     def populate_lists(self):
-        self.unrolled_listbox.delete(0, tk.END)
+        self.worker.submit("enrollment:enrolled", self.service.get_students_for_course, self.course_id,
+                           on_done=self._fill_enrolled)
+
+    def _fill_enrolled(self, students):
+        if not self.winfo_exists():
+            return
+        self.original = {s.id: s for s in students}
+        self.enrolled = dict(self.original)
         self.enrolled_listbox.delete(0, tk.END)
-        unrolled = {s.id: s.name for s in self.service.get_students_not_in_course(self.course_id)}
-        enrolled = {s.id: s.name for s in self.service.get_students_for_course(self.course_id)}
-        for sid, name in unrolled.items():
-            self.unrolled_listbox.insert(tk.END, f"{name} (ID: {sid})")
-        for sid, name in enrolled.items():
-            self.enrolled_listbox.insert(tk.END, f"{name} (ID: {sid})")
+        for s in students:
+            self.enrolled_listbox.insert(tk.END, self._label(s))
+        self.unrolled_loader.reset(self.search_entry.get())
+
+    def _fill_unrolled(self, students, first=True):
+        if not self.winfo_exists():
+            return
+        if first:
+            self.unrolled_listbox.delete(0, tk.END)
+            # 本次從右側移回、尚未儲存的學生，資料庫仍視為已報名，需自行補在最前面
+            q = self.unrolled_loader.query
+            students = [s for sid, s in self.original.items()
+                        if sid not in self.enrolled
+                        and (s.name.startswith(q) or (s.phone or "").startswith(q))] + list(students)
+            self.unrolled = []
+        for s in students:
+            if s.id in self.enrolled:
+                continue    # 已移到右側（尚未儲存）
+            self.unrolled.append(s)
+            self.unrolled_listbox.insert(tk.END, self._label(s))
 
     def enroll(self):
         for i in reversed(self.unrolled_listbox.curselection()):
-            self.enrolled_listbox.insert(tk.END, self.unrolled_listbox.get(i))
+            s = self.unrolled.pop(i)
+            self.enrolled[s.id] = s
+            self.enrolled_listbox.insert(tk.END, self._label(s))
             self.unrolled_listbox.delete(i)
 
     def unenroll(self):
+        rows = list(self.enrolled.values())
         for i in reversed(self.enrolled_listbox.curselection()):
-            self.unrolled_listbox.insert(tk.END, self.enrolled_listbox.get(i))
+            s = rows[i]
+            del self.enrolled[s.id]
+            self.unrolled.insert(0, s)
+            self.unrolled_listbox.insert(0, self._label(s))
             self.enrolled_listbox.delete(i)
 
     def save_changes(self):
-        ids = []
-        for i in range(self.enrolled_listbox.size()):
-            txt = self.enrolled_listbox.get(i)  # "王小明 (ID: 3)"
-            try:
-                sid = int(txt.rsplit("ID:", 1)[1].strip().rstrip(")"))
-                ids.append(sid)
-            except Exception:
-                pass
-        if self.service.update_course_enrollments(self.course_id, ids):
-            messagebox.showinfo("成功", "學生報名名單已更新！", parent=self)
-            self.destroy()
+        # 差異比對與排課衝突檢查都在背景執行緒進行
+        # 傳入名單的複本：背景執行時使用者仍可能在視窗上加選 / 退選
+        self.worker.submit("enrollment:save", self._save_job, self.course_id, dict(self.enrolled),
+                           on_done=self._on_saved)
+
+    def _save_job(self, course_id, enrolled):
+        """
+        背景執行緒：儲存報名名單 enrolled（{id: StudentRow}）；有時段衝突時一併查出
+        說明（最多 10 筆）要用的課程名稱。回傳 (update_course_enrollments 的結果, 衝突說明文字列)。
+        """
+        res = self.service.update_course_enrollments(course_id, list(enrolled))
+        if res is None or "conflicts" not in res:
+            return res, []
+        names = {c.id: c.name for c in self.service.get_all_courses_with_schedules()}
+        lines = []
+        for c in res["conflicts"][:10]:
+            stu = enrolled.get(c.owner_id)
+            lines.append(f"學生 {stu.name if stu else c.owner_id}：{names.get(c.other_course_id, c.other_course_id)} "
+                         f"{c.day_of_week} {c.other_start.strftime('%H:%M')}-{c.other_end.strftime('%H:%M')}")
+        return res, lines
+
+    def _on_saved(self, saved):
+        if not self.winfo_exists():
+            return
+        res, lines = saved
+        if res is None:
+            messagebox.showerror("錯誤", "儲存失敗！找不到課程或寫入資料庫失敗。", parent=self)
+        elif "conflicts" in res:
+            total = len(res["conflicts"])
+            if total > 10:
+                lines.append(f"……其餘 {total - 10} 筆略")
+            messagebox.showerror("時段衝突", "以下加選的學生在同一時段已有其他課程，名單未儲存：\n"
+                                 + "\n".join(lines), parent=self)
         else:
-            messagebox.showerror("錯誤", "儲存失敗！", parent=self)
+            messagebox.showinfo(
+                "成功",
+                f"學生報名名單已更新！\n新增 {res['added']} 位、移除 {res['removed']} 位、不變 {res['unchanged']} 位。",
+                parent=self)
+            self.destroy()
 
 if __name__ == "__main__":
     # 先確保資料庫就緒
-    _ = AttendanceService()
+    AttendanceService().dispose()
     app = App()
     app.mainloop()
@@ -1,7 +1,8 @@
 from sqlalchemy import (
-    create_engine, Column, Integer, String, Date, Time,
-    ForeignKey, Boolean, Table
+    create_engine, Column, Integer, String, Date, Time, DateTime,
+    ForeignKey, Boolean, Table, Index, select, exists, literal, func, text
 )
+from datetime import datetime
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -34,6 +35,17 @@ class Student(Base):
         secondary=student_course_association,
         back_populates="students"
     )
+    # 堂數帳本（刪學生時連動刪除）
+    ledger_entries = relationship(
+        "ClassLedgerEntry",
+        back_populates="student",
+        cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (
+        # 學生搜尋的電話開頭查詢（姓名已有唯一索引，兼作 (name, id) 分頁的排序索引）
+        Index('ix_students_phone', 'phone'),
+    )
 
 class Teacher(Base):
     __tablename__ = 'teachers'
@@ -68,6 +80,11 @@ class Course(Base):
         back_populates="courses"
     )
 
+    # 與 dto.CourseRow 同名的欄位，orm_results=True 時 GUI 可以照樣讀取（查詢已 joinedload teacher）
+    @property
+    def teacher_name(self):
+        return self.teacher.name if self.teacher else None
+
 class CourseSchedule(Base):
     __tablename__ = 'course_schedules'
     id = Column(Integer, primary_key=True)
@@ -83,6 +100,12 @@ class CourseSchedule(Base):
         back_populates="course_schedule",
         cascade="all, delete-orphan"
     )
+    # 已展開的上課日（刪排程時連動刪除）
+    sessions = relationship(
+        "CourseSession",
+        back_populates="course_schedule",
+        cascade="all, delete-orphan"
+    )
 
 class AttendanceRecord(Base):
     __tablename__ = 'attendance_records'
@@ -95,3 +118,324 @@ class AttendanceRecord(Base):
 
     student = relationship("Student", back_populates="attendance_records")
     course_schedule = relationship("CourseSchedule", back_populates="attendance_records")
+
+    # 與 dto.AttendanceRow 同名的欄位（查詢已 joinedload course_schedule.course）
+    @property
+    def course_id(self):
+        return self.course_schedule.course_id if self.course_schedule else None
+
+    @property
+    def course_name(self):
+        return self.course_schedule.course.name if self.course_schedule else None
+
+    __table_args__ = (
+        # 同一學生、同一排程、同一天只能點一次名（take_attendance 的重複檢查）
+        Index('ux_attendance_student_schedule_date',
+              'student_id', 'course_schedule_id', 'date', unique=True),
+        # 月報表的 date.between 範圍查詢
+        Index('ix_attendance_date', 'date'),
+        # 個人出勤歷史（依日期排序）
+        Index('ix_attendance_student_date', 'student_id', 'date'),
+    )
+
+
+# 上課日狀態：scheduled 依排程產生、cancelled 停課（含國定假日）、makeup 補課
+SESSION_STATUSES = ('scheduled', 'cancelled', 'makeup')
+
+class CourseSession(Base):
+    """由排程展開的實際上課日（滾動產生至 SessionHorizon.end_date）。"""
+    __tablename__ = 'course_sessions'
+    id = Column(Integer, primary_key=True)
+    schedule_id = Column(Integer, ForeignKey('course_schedules.id'), nullable=False)
+    date = Column(Date, nullable=False)
+    start_time = Column(Time, nullable=False)   # 補課可與原排程時間不同
+    end_time = Column(Time, nullable=False)
+    status = Column(String, nullable=False, default='scheduled')   # SESSION_STATUSES
+    note = Column(String)
+
+    course_schedule = relationship("CourseSchedule", back_populates="sessions")
+
+    __table_args__ = (
+        # 同一排程同一天只有一筆（重複產生時以 insert-or-ignore 略過）
+        Index('ux_course_sessions_schedule_date', 'schedule_id', 'date', unique=True),
+        # 今日課程 / 期間課表的範圍查詢
+        Index('ix_course_sessions_date', 'date'),
+    )
+
+class SessionHorizon(Base):
+    """course_sessions 已展開的日期範圍（單列，id 固定為 1）。"""
+    __tablename__ = 'session_horizon'
+    id = Column(Integer, primary_key=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+
+
+# 帳本異動種類：opening 為導入帳本時的期初餘額
+LEDGER_KINDS = ('opening', 'purchase', 'deduction', 'refund')
+
+class ClassLedgerEntry(Base):
+    """堂數帳本（只新增不修改）：remaining_classes 應等於該學生所有 amount 的總和。"""
+    __tablename__ = 'class_ledger'
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, ForeignKey('students.id'), nullable=False)
+    kind = Column(String, nullable=False)        # LEDGER_KINDS
+    amount = Column(Integer, nullable=False)     # 購買 / 退還為正，扣堂為負
+    attendance_record_id = Column(
+        Integer, ForeignKey('attendance_records.id', ondelete='SET NULL'))
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    note = Column(String)
+
+    student = relationship("Student", back_populates="ledger_entries")
+
+    __table_args__ = (
+        Index('ix_ledger_student', 'student_id'),
+    )
+
+
+class SchemaMigration(Base):
+    """已執行過的一次性資料升級（upgrade_connection 依名稱略過已執行者）。"""
+    __tablename__ = 'schema_migrations'
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class ReportMonthVersion(Base):
+    """
+    各月份報表資料的版本號（month 為 'YYYY-MM'）。SQLite 上由 REPORT_VERSION_DDL 的觸發器維護：
+    該月出勤記錄增刪改，或報表用到的學生姓名、課程名稱 / 授課老師、老師姓名、排程時間改變時遞增，
+    與寫入在同一個交易內。月報表快取與逐月匯出都以此判斷該月是否有異動。
+    """
+    __tablename__ = 'report_month_versions'
+    month = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class MonthlyReportState(Base):
+    """月報表快取的狀態：建立快取時該月份的報表版本（ReportMonthVersion.version）。"""
+    __tablename__ = 'report_cache_months'
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    built_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class MonthlyReportRow(Base):
+    """
+    月報表快取內容：依報表順序（seq）逐列存放已 join 好的欄位。
+    不含剩餘堂數，讀取時再 join 學生目前的餘額。
+    """
+    __tablename__ = 'report_cache_rows'
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    student_id = Column(Integer, nullable=False)
+    student_name = Column(String, nullable=False)
+    course_name = Column(String, nullable=False)
+    start_time = Column(Time, nullable=False)
+    end_time = Column(Time, nullable=False)
+    teacher_name = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+
+
+def upgrade_schema(engine):
+    """
+    既有的 attendance.db 升級：create_all 只會替「新建的表」建立索引，
+    這裡補建舊資料表上缺少的索引，不需重建資料庫。
+    """
+    with engine.begin() as conn:
+        upgrade_connection(conn)
+
+
+def upgrade_connection(conn):
+    """upgrade_schema 的連線層級版本（供 AsyncConnection.run_sync 使用）。"""
+    # 資料升級先於補建索引：0004 清掉重複點名後，唯一索引才建得起來
+    _run_migrations(conn)
+
+    for table in Base.metadata.sorted_tables:
+        for idx in table.indexes:
+            try:
+                with conn.begin_nested():
+                    idx.create(conn, checkfirst=True)
+            except Exception as e:
+                # 舊資料若已有重複點名，唯一索引會建立失敗；保留資料，僅提示
+                print(f"建立索引 {idx.name} 失敗：", e)
+
+    if conn.dialect.name == "sqlite":
+        try:
+            with conn.begin_nested():
+                install_student_fts(conn)
+        except Exception as e:
+            # SQLite 未編入 FTS5（或版本過舊不支援 trigram）：search.py 會退回 LIKE 查詢
+            print("建立學生全文索引失敗：", e)
+        try:
+            with conn.begin_nested():
+                install_report_versions(conn)
+        except Exception as e:
+            # 沒有版本觸發器時不使用月報表快取，逐月匯出一律重寫
+            print("建立報表版本觸發器失敗：", e)
+
+
+def _backfill_opening_balances(conn):
+    """導入帳本前就存在的學生：以目前剩餘堂數補一筆期初餘額。"""
+    ledger = ClassLedgerEntry.__table__
+    students = Student.__table__
+    conn.execute(ledger.insert().from_select(
+        ['student_id', 'kind', 'amount', 'created_at', 'note'],
+        select(students.c.id, literal('opening'), func.coalesce(students.c.remaining_classes, 0),
+               literal(datetime.now()), literal('帳本期初餘額'))
+        .where(~exists().where(ledger.c.student_id == students.c.id))
+    ))
+
+
+def _drop_pickled_report_cache(conn):
+    """舊版月報表快取（以 pickle 存放的 report_month_chunks）改為 report_cache_rows，舊表直接刪除。"""
+    conn.execute(text("DROP TABLE IF EXISTS report_month_chunks"))
+    conn.execute(text("DROP TABLE IF EXISTS report_months"))
+
+
+def _recreate_schedule_version_trigger(conn):
+    """排程觸發器加上 day_of_week（逐月匯出有此欄位）：刪除舊版，由 install_report_versions 重建。"""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("DROP TRIGGER IF EXISTS report_version_schedules_au"))
+
+
+def _dedupe_attendance_records(conn):
+    """
+    唯一索引之前的舊資料可能有重複點名：同一學生、同一排程、同一天只保留最新（id 最大）的一筆。
+    被刪除的點名若有扣堂，帳本仍保留該筆扣堂（只清掉對應的點名 id），剩餘堂數不變。
+    """
+    records = AttendanceRecord.__table__
+    ledger = ClassLedgerEntry.__table__
+    keep = (select(func.max(records.c.id))
+            .group_by(records.c.student_id, records.c.course_schedule_id, records.c.date))
+    stale = select(records.c.id).where(records.c.id.not_in(keep))
+    conn.execute(ledger.update().where(ledger.c.attendance_record_id.in_(stale))
+                 .values(attendance_record_id=None))
+    conn.execute(records.delete().where(records.c.id.not_in(keep)))
+
+
+# 一次性資料升級，依序執行；已記錄在 schema_migrations 的不再執行。新的升級只能加在最後
+MIGRATIONS = (
+    ('0001_ledger_opening_balance', _backfill_opening_balances),
+    ('0002_drop_pickled_report_cache', _drop_pickled_report_cache),
+    ('0003_schedule_version_trigger_day', _recreate_schedule_version_trigger),
+    ('0004_dedupe_attendance_records', _dedupe_attendance_records),
+)
+
+
+def _run_migrations(conn):
+    table = SchemaMigration.__table__
+    table.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(table.c.name)).scalars())
+    for name, migrate in MIGRATIONS:
+        if name not in applied:
+            migrate(conn)
+            conn.execute(table.insert().values(name=name, applied_at=datetime.now()))
+
+
+# 學生全文索引（SQLite FTS5，trigram 分詞）：外部內容表，資料仍只存在 students，
+# 由觸發器同步新增 / 刪除 / 修改；只在姓名、電話、地址變動時更新（扣堂不會觸發）
+STUDENT_FTS_TABLE = 'students_fts'
+STUDENT_FTS_DDL = (
+    f"""CREATE VIRTUAL TABLE {STUDENT_FTS_TABLE} USING fts5(
+        name, phone, address, content='students', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+        INSERT INTO {STUDENT_FTS_TABLE}(rowid, name, phone, address)
+        VALUES (new.id, new.name, new.phone, new.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+        INSERT INTO {STUDENT_FTS_TABLE}({STUDENT_FTS_TABLE}, rowid, name, phone, address)
+        VALUES ('delete', old.id, old.name, old.phone, old.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF name, phone, address ON students BEGIN
+        INSERT INTO {STUDENT_FTS_TABLE}({STUDENT_FTS_TABLE}, rowid, name, phone, address)
+        VALUES ('delete', old.id, old.name, old.phone, old.address);
+        INSERT INTO {STUDENT_FTS_TABLE}(rowid, name, phone, address)
+        VALUES (new.id, new.name, new.phone, new.address);
+    END""",
+)
+
+
+def install_student_fts(conn):
+    """建立學生全文索引與同步觸發器；首次建立時以既有學生資料重建索引。"""
+    exists_already = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"),
+        {"n": STUDENT_FTS_TABLE}).first() is not None
+    if not exists_already:
+        conn.execute(text(STUDENT_FTS_DDL[0]))
+    for ddl in STUDENT_FTS_DDL[1:]:
+        conn.execute(text(ddl))
+    if not exists_already:
+        conn.execute(text(f"INSERT INTO {STUDENT_FTS_TABLE}({STUDENT_FTS_TABLE}) VALUES ('rebuild')"))
+
+
+# 報表版本觸發器（SQLite）：月報表快取與 exports.py 的逐月匯出共用，涵蓋兩者輸出的所有欄位。
+# 月份鍵為日期字串的前 7 碼（'YYYY-MM'）。
+# INSERT ... SELECT 搭配 ON CONFLICT 時 SELECT 必須有 WHERE，避免 ON 被當成 join 條件
+_BUMP_MONTH = """INSERT INTO report_month_versions(month, version) VALUES (substr({date}, 1, 7), 1)
+        ON CONFLICT(month) DO UPDATE SET version = version + 1;"""
+_BUMP_MONTHS_OF = """INSERT INTO report_month_versions(month, version)
+        SELECT DISTINCT substr(a.date, 1, 7), 1 FROM attendance_records a {join} WHERE {where}
+        ON CONFLICT(month) DO UPDATE SET version = version + 1;"""
+REPORT_VERSION_TRIGGER = 'report_version_attendance_ai'
+REPORT_VERSION_DDL = (
+    f"""CREATE TRIGGER IF NOT EXISTS {REPORT_VERSION_TRIGGER} AFTER INSERT ON attendance_records BEGIN
+        {_BUMP_MONTH.format(date='new.date')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_attendance_ad AFTER DELETE ON attendance_records BEGIN
+        {_BUMP_MONTH.format(date='old.date')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_attendance_au AFTER UPDATE ON attendance_records BEGIN
+        {_BUMP_MONTH.format(date='old.date')}
+        {_BUMP_MONTH.format(date='new.date')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_students_au AFTER UPDATE OF name ON students
+        WHEN old.name IS NOT new.name BEGIN
+        {_BUMP_MONTHS_OF.format(join='', where='a.student_id = new.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_teachers_au AFTER UPDATE OF name ON teachers
+        WHEN old.name IS NOT new.name BEGIN
+        {_BUMP_MONTHS_OF.format(
+            join='JOIN course_schedules cs ON cs.id = a.course_schedule_id JOIN courses c ON c.id = cs.course_id',
+            where='c.teacher_id = new.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_courses_au AFTER UPDATE OF name, teacher_id ON courses
+        WHEN old.name IS NOT new.name OR old.teacher_id IS NOT new.teacher_id BEGIN
+        {_BUMP_MONTHS_OF.format(join='JOIN course_schedules cs ON cs.id = a.course_schedule_id',
+                                where='cs.course_id = new.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS report_version_schedules_au
+        AFTER UPDATE OF day_of_week, start_time, end_time, course_id ON course_schedules
+        WHEN old.day_of_week IS NOT new.day_of_week OR old.start_time IS NOT new.start_time
+          OR old.end_time IS NOT new.end_time OR old.course_id IS NOT new.course_id BEGIN
+        {_BUMP_MONTHS_OF.format(join='', where='a.course_schedule_id = new.id')}
+    END""",
+)
+
+
+def install_report_versions(conn):
+    """建立報表版本觸發器（可重複執行）。"""
+    for ddl in REPORT_VERSION_DDL:
+        conn.execute(text(ddl))
+
+
+def report_versions_installed(conn) -> bool:
+    """資料庫是否有報表版本觸發器（目前只有 SQLite）；沒有時各月份版本無從得知。"""
+    if conn.dialect.name != "sqlite":
+        return False
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :n"),
+        {"n": REPORT_VERSION_TRIGGER}).first() is not None
+
+
+def report_month_key(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def report_month_version(conn, year: int, month: int):
+    """該月報表資料的版本號（從未異動過為 0）；沒有版本觸發器時回傳 None，呼叫端應視為已異動。"""
+    if not report_versions_installed(conn):
+        return None
+    return conn.scalar(select(ReportMonthVersion.version)
+                       .where(ReportMonthVersion.month == report_month_key(year, month))) or 0
@@ -0,0 +1,167 @@
+"""
+AttendanceService 的選用效能量測：每個公開方法的耗時、執行的 SQL 條數與 SQL 總耗時，
+以及超過門檻的慢呼叫記錄。
+
+啟用方式：
+    AttendanceService(instrument=True, slow_ms=200)
+    或設定環境變數 ROLLCALL_PROFILE=1（ROLLCALL_SLOW_MS / ROLLCALL_SLOW_SQL_MS 調整門檻），
+    程式結束時會把摘要印到 stderr。
+未啟用時不掛任何事件、不包裝任何方法，沒有額外成本。
+"""
+import atexit
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+
+from sqlalchemy import event
+
+logger = logging.getLogger("attendance.profiling")
+
+ENV_ENABLE = "ROLLCALL_PROFILE"
+ENV_SLOW_MS = "ROLLCALL_SLOW_MS"
+ENV_SLOW_SQL_MS = "ROLLCALL_SLOW_SQL_MS"
+
+
+def env_enabled() -> bool:
+    return os.environ.get(ENV_ENABLE, "").lower() in ("1", "true", "yes", "on")
+
+
+# 程式結束時要印出摘要的 profiler。atexit 整個行程只註冊一次；
+# 以 WeakSet 保存，已回收的服務物件不會因此一直留在記憶體中。
+_exit_profilers = weakref.WeakSet()
+_exit_lock = threading.Lock()
+_exit_registered = False
+
+
+def _print_exit_summaries():
+    for profiler in list(_exit_profilers):
+        print(profiler.format_summary(), file=sys.stderr)
+
+
+class _CallFrame:
+    __slots__ = ("statements", "sql_ms")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_ms = 0.0
+
+
+class ServiceProfiler:
+    def __init__(self, engine, slow_ms: float = 200.0, slow_sql_ms: float = 100.0, keep_slow: int = 200):
+        self.engine = engine
+        self.slow_ms = slow_ms
+        self.slow_sql_ms = slow_sql_ms
+        self.slow_calls = deque(maxlen=keep_slow)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._total_statements = 0
+        self._total_sql_ms = 0.0
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    # ----- SQL 事件 -----
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_prof_t0", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        ms = (time.perf_counter() - conn.info["_prof_t0"].pop()) * 1000
+        for frame in getattr(self._local, "stack", ()):
+            frame.statements += 1
+            frame.sql_ms += ms
+        with self._lock:
+            self._total_statements += 1
+            self._total_sql_ms += ms
+        if ms >= self.slow_sql_ms:
+            logger.warning("慢查詢 %.1f ms：%s", ms, " ".join(statement.split())[:300])
+
+    # ----- 方法包裝 -----
+    def wrap(self, service):
+        """包裝 service 的公開方法（產生器方法只量測建立，故略過）。"""
+        for name, member in inspect.getmembers(type(service), inspect.isfunction):
+            if name.startswith("_") or inspect.isgeneratorfunction(member):
+                continue
+            if name in ("profiling_summary", "reset_profiling", "dispose", "cache_stats", "session_scope"):
+                continue
+            setattr(service, name, self._timed(name, getattr(service, name)))
+
+    def _timed(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+            frame = _CallFrame()
+            stack.append(frame)
+            t0 = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                stack.pop()
+                self._record(name, ms, frame)
+        return wrapper
+
+    def _record(self, name, ms, frame):
+        with self._lock:
+            st = self._stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                               "statements": 0, "sql_ms": 0.0})
+            st["calls"] += 1
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+            st["statements"] += frame.statements
+            st["sql_ms"] += frame.sql_ms
+        if ms >= self.slow_ms:
+            entry = {"method": name, "ms": round(ms, 3), "statements": frame.statements,
+                     "sql_ms": round(frame.sql_ms, 3), "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            self.slow_calls.append(entry)
+            logger.warning("慢呼叫 %s：%.1f ms，%d 條 SQL（%.1f ms）",
+                           name, ms, frame.statements, frame.sql_ms)
+
+    # ----- 摘要 -----
+    def summary(self) -> dict:
+        with self._lock:
+            methods = {
+                name: {**st,
+                       "total_ms": round(st["total_ms"], 3),
+                       "max_ms": round(st["max_ms"], 3),
+                       "sql_ms": round(st["sql_ms"], 3),
+                       "avg_ms": round(st["total_ms"] / st["calls"], 3),
+                       "statements_per_call": round(st["statements"] / st["calls"], 2)}
+                for name, st in self._stats.items()
+            }
+            return {"methods": methods,
+                    "total_statements": self._total_statements,
+                    "total_sql_ms": round(self._total_sql_ms, 3),
+                    "slow_calls": list(self.slow_calls)}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_calls.clear()
+            self._total_statements = 0
+            self._total_sql_ms = 0.0
+
+    def format_summary(self) -> str:
+        s = self.summary()
+        lines = [f"{'method':36} {'calls':>6} {'avg ms':>9} {'max ms':>9} {'SQL/call':>9} {'SQL ms':>9}"]
+        for name, st in sorted(s["methods"].items(), key=lambda kv: -kv[1]["total_ms"]):
+            lines.append(f"{name:36} {st['calls']:>6} {st['avg_ms']:>9.2f} {st['max_ms']:>9.2f} "
+                         f"{st['statements_per_call']:>9.1f} {st['sql_ms']:>9.1f}")
+        lines.append(f"共 {s['total_statements']} 條 SQL，{s['total_sql_ms']:.1f} ms；"
+                     f"慢呼叫 {len(s['slow_calls'])} 次")
+        return "\n".join(lines)
+
+    def print_at_exit(self):
+        global _exit_registered
+        with _exit_lock:
+            _exit_profilers.add(self)
+            if not _exit_registered:
+                atexit.register(_print_exit_summaries)
+                _exit_registered = True
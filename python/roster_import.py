@@ -0,0 +1,110 @@
+"""
+學生名冊批次匯入：逐批讀取 CSV / XLSX，驗證每一列並回報錯誤列。
+寫入（以姓名 upsert、選擇性報名課程）由 AttendanceService.import_students 負責。
+"""
+import csv
+import pathlib
+from typing import NamedTuple
+
+# 支援中英文欄名
+COLUMN_ALIASES = {
+    "name": ("name", "姓名", "學生姓名"),
+    "phone": ("phone", "電話"),
+    "address": ("address", "地址"),
+    "registered_classes": ("registered_classes", "classes", "報名堂數", "堂數"),
+}
+
+
+class RowError(NamedTuple):
+    row: int        # 檔案中的列號（含標題列，從 1 起算）
+    name: str
+    message: str
+
+
+class ImportReport(NamedTuple):
+    imported: int           # 新增或更新的學生數
+    enrolled: int           # 新增的報名關聯數
+    errors: list            # list[RowError]
+
+
+def _header_map(header):
+    """把檔案標題列對應到標準欄位名，回傳 {標準欄名: 欄位索引}。"""
+    normalized = [str(h).strip().lower() if h is not None else "" for h in header]
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias.lower() in normalized:
+                mapping[field] = normalized.index(alias.lower())
+                break
+    if "name" not in mapping:
+        raise ValueError("找不到姓名欄位（name / 姓名）")
+    return mapping
+
+
+def _iter_raw_rows(path: pathlib.Path):
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+    elif suffix in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"不支援的檔案格式：{suffix}（僅支援 .csv / .xlsx）")
+
+
+def validate_row(values: dict):
+    """回傳 (清理後的資料, 錯誤訊息)；資料有誤時前者為 None。"""
+    name = str(values.get("name") or "").strip()
+    if not name:
+        return None, "姓名不能為空"
+    raw = values.get("registered_classes")
+    try:
+        classes = int(float(raw)) if raw not in (None, "") else 0
+    except (TypeError, ValueError):
+        return None, f"報名堂數必須是數字：{raw}"
+    if classes < 0:
+        return None, "報名堂數不可為負數"
+    return {
+        "name": name,
+        "phone": str(values.get("phone") or "").strip() or None,
+        "address": str(values.get("address") or "").strip() or None,
+        "registered_classes": classes,
+    }, None
+
+
+def iter_roster_chunks(path, chunk_size: int = 500):
+    """
+    逐批產出 (有效資料列, 錯誤列)：
+    有效資料列為 [(列號, dict)]，錯誤列為 [RowError]。
+    同一檔案內重複的姓名只保留第一次出現者。
+    """
+    path = pathlib.Path(path)
+    rows = _iter_raw_rows(path)
+    header = next(rows, None)
+    if header is None:
+        return
+    mapping = _header_map(header)
+    seen = set()
+    valid, errors = [], []
+    for row_no, raw in enumerate(rows, start=2):
+        if raw is None or all(v in (None, "") for v in raw):
+            continue
+        values = {f: (raw[i] if i < len(raw) else None) for f, i in mapping.items()}
+        data, err = validate_row(values)
+        if err:
+            errors.append(RowError(row_no, str(values.get("name") or ""), err))
+        elif data["name"] in seen:
+            errors.append(RowError(row_no, data["name"], "檔案中姓名重複，已略過"))
+        else:
+            seen.add(data["name"])
+            valid.append((row_no, data))
+        if len(valid) >= chunk_size:
+            yield valid, errors
+            valid, errors = [], []
+    if valid or errors:
+        yield valid, errors
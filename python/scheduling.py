@@ -0,0 +1,181 @@
+"""
+排課衝突檢查：每個 (老師, 星期) 與 (學生, 星期) 各一條依開始時間排序的區間索引，
+建立一次後隨排程 / 報名異動增量更新；查詢以 bisect 找出可能重疊的區段，約 O(log n)。
+"""
+import bisect
+import threading
+from collections import defaultdict
+from datetime import time
+from typing import NamedTuple
+
+
+class Conflict(NamedTuple):
+    kind: str                 # "teacher" / "student"
+    owner_id: int             # 老師 id 或學生 id
+    day_of_week: str
+    schedule_id: int          # 檢查中的排程；新增前檢查時為 None
+    course_id: int
+    other_schedule_id: int    # 與之重疊的既有排程
+    other_course_id: int
+    other_start: time
+    other_end: time
+
+
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+class _Slot(NamedTuple):
+    start: int                # 當天第幾分鐘
+    end: int
+    schedule_id: int
+    course_id: int
+    start_time: time
+    end_time: time
+
+
+class _Lane:
+    """單一 (對象, 星期) 的排程，依開始時間排序。"""
+    __slots__ = ("starts", "slots", "max_len")
+
+    def __init__(self):
+        self.starts = []
+        self.slots = []
+        self.max_len = 0      # 最長區間長度：重疊者的開始時間必落在 (start - max_len, end)
+
+    def add(self, slot: _Slot):
+        i = bisect.bisect_right(self.starts, slot.start)
+        self.starts.insert(i, slot.start)
+        self.slots.insert(i, slot)
+        self.max_len = max(self.max_len, slot.end - slot.start)
+
+    def remove(self, schedule_id: int):
+        for i, slot in enumerate(self.slots):
+            if slot.schedule_id == schedule_id:
+                del self.starts[i], self.slots[i]
+                return
+
+    def overlapping(self, start: int, end: int):
+        lo = bisect.bisect_right(self.starts, start - self.max_len)
+        hi = bisect.bisect_left(self.starts, end)
+        return [s for s in self.slots[lo:hi] if s.end > start]
+
+
+class TimetableIndex:
+    """
+    老師與學生的每週課表索引（執行緒安全）。
+    由 AttendanceService 持有，排程、課程、報名異動時呼叫對應方法保持同步。
+    """
+
+    def __init__(self):
+        self._lanes = defaultdict(_Lane)          # (kind, owner_id, day) -> _Lane
+        self._course_teacher = {}                 # course_id -> teacher_id
+        self._course_students = defaultdict(set)  # course_id -> {student_id}
+        self._course_slots = defaultdict(dict)    # course_id -> {schedule_id: (day, _Slot)}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, courses, schedules, enrollments):
+        """
+        courses：[(course_id, teacher_id)]；
+        schedules：[(schedule_id, course_id, day_of_week, start_time, end_time)]；
+        enrollments：[(student_id, course_id)]。
+        """
+        index = cls()
+        for cid, tid in courses:
+            index._course_teacher[cid] = tid
+        for sid, cid in enrollments:
+            index._course_students[cid].add(sid)
+        for schedule_id, cid, day, start, end in schedules:
+            index.add_schedule(schedule_id, cid, day, start, end)
+        return index
+
+    def _owners(self, course_id):
+        tid = self._course_teacher.get(course_id)
+        owners = [("teacher", tid)] if tid is not None else []
+        owners.extend(("student", sid) for sid in self._course_students.get(course_id, ()))
+        return owners
+
+    # ----- 增量更新 -----
+    def add_course(self, course_id: int, teacher_id: int):
+        with self._lock:
+            self._course_teacher[course_id] = teacher_id
+
+    def add_schedule(self, schedule_id: int, course_id: int, day_of_week: str, start: time, end: time):
+        slot = _Slot(_minutes(start), _minutes(end), schedule_id, course_id, start, end)
+        with self._lock:
+            self._course_slots[course_id][schedule_id] = (day_of_week, slot)
+            for kind, owner in self._owners(course_id):
+                self._lanes[(kind, owner, day_of_week)].add(slot)
+
+    def remove_schedule(self, schedule_id: int, course_id: int):
+        with self._lock:
+            entry = self._course_slots.get(course_id, {}).pop(schedule_id, None)
+            if entry is None:
+                return
+            for kind, owner in self._owners(course_id):
+                self._lanes[(kind, owner, entry[0])].remove(schedule_id)
+
+    def remove_course(self, course_id: int):
+        with self._lock:
+            for schedule_id, (day, _) in self._course_slots.pop(course_id, {}).items():
+                for kind, owner in self._owners(course_id):
+                    self._lanes[(kind, owner, day)].remove(schedule_id)
+            self._course_teacher.pop(course_id, None)
+            self._course_students.pop(course_id, None)
+
+    def enroll(self, course_id: int, student_ids):
+        with self._lock:
+            new = set(student_ids) - self._course_students[course_id]
+            self._course_students[course_id] |= new
+            for day, slot in self._course_slots.get(course_id, {}).values():
+                for sid in new:
+                    self._lanes[("student", sid, day)].add(slot)
+
+    def unenroll(self, course_id: int, student_ids):
+        with self._lock:
+            gone = set(student_ids) & self._course_students[course_id]
+            self._course_students[course_id] -= gone
+            for schedule_id, (day, _) in self._course_slots.get(course_id, {}).items():
+                for sid in gone:
+                    self._lanes[("student", sid, day)].remove(schedule_id)
+
+    def remove_student(self, student_id: int):
+        with self._lock:
+            for students in self._course_students.values():
+                students.discard(student_id)
+            for key in [k for k in self._lanes if k[0] == "student" and k[1] == student_id]:
+                del self._lanes[key]
+
+    # ----- 查詢 -----
+    def conflicts_for(self, course_id: int, day_of_week: str, start: time, end: time,
+                      schedule_id: int | None = None):
+        """若 course_id 在 day_of_week 的 [start, end) 上課，列出老師與報名學生的衝突。"""
+        s, e = _minutes(start), _minutes(end)
+        found = []
+        with self._lock:
+            for kind, owner in self._owners(course_id):
+                lane = self._lanes.get((kind, owner, day_of_week))
+                if lane is None:
+                    continue
+                for other in lane.overlapping(s, e):
+                    if other.schedule_id != schedule_id:
+                        found.append(Conflict(kind, owner, day_of_week, schedule_id, course_id,
+                                              other.schedule_id, other.course_id,
+                                              other.start_time, other.end_time))
+        return found
+
+    def check_all(self):
+        """整份課表的衝突清單（每對重疊排程、每位相關老師 / 學生各一筆）。"""
+        found = []
+        with self._lock:
+            for (kind, owner, day), lane in self._lanes.items():
+                active = []     # 掃描線：開始時間排序下，尚未結束的排程
+                for slot in lane.slots:
+                    active = [a for a in active if a.end > slot.start]
+                    for other in active:
+                        found.append(Conflict(kind, owner, day, slot.schedule_id, slot.course_id,
+                                              other.schedule_id, other.course_id,
+                                              other.start_time, other.end_time))
+                    active.append(slot)
+        return found
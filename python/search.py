@@ -0,0 +1,110 @@
+"""
+學生搜尋：姓名、電話、地址的部分比對與模糊比對，依相關程度排序。
+
+SQLite 以 FTS5 trigram 全文索引（models.install_student_fts，觸發器與 students 同步）查詢，
+以 bm25 排序（姓名權重最高）；中英文混合的姓名都以 3 字元片段比對，不需斷詞。
+查詢字串不足 3 個字元（trigram 無法比對）或資料庫沒有全文索引時，改用 LIKE 子字串比對。
+fuzzy=True 時，完全相符的結果不足 limit 筆會再補上「部分片段相符」的結果（打錯字、少打字）。
+"""
+from sqlalchemy import select, text, case, or_, func, literal, literal_column, table, column
+
+from dto import StudentRow, columns_for
+from models import Student, STUDENT_FTS_TABLE
+
+SEARCH_LIMIT = 20
+# bm25 欄位權重：姓名、電話、地址
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+_fts = table(STUDENT_FTS_TABLE, column("rowid"))
+
+
+def fts_available(conn) -> bool:
+    """資料庫是否已建立學生全文索引（conn 可為 Connection 或 Session）。"""
+    bind = conn.get_bind() if hasattr(conn, "get_bind") else conn
+    if bind.dialect.name != "sqlite":
+        return False
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"),
+        {"n": STUDENT_FTS_TABLE}).first() is not None
+
+
+def _phrase(s: str) -> str:
+    """FTS5 字串常值：trigram 分詞下等同子字串比對。"""
+    return '"' + s.replace('"', '""') + '"'
+
+
+def _ngrams(s: str, n: int):
+    return list(dict.fromkeys(s[i:i + n] for i in range(len(s) - n + 1)))
+
+
+def _contains(col, s: str, sqlite: bool):
+    """col 含有子字串 s（不分大小寫）；SQLite 的 LIKE 本身即不分 ASCII 大小寫，不必再套 lower()。"""
+    pattern = "%" + s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return col.like(pattern, escape="\\") if sqlite else col.ilike(pattern, escape="\\")
+
+
+def _exact_first(q: str):
+    # 姓名完全相符者排最前面（不分大小寫）
+    return case((func.lower(Student.name) == q.lower(), 0), else_=1)
+
+
+def _fts_query(session, match: str, q: str, limit: int):
+    fts = literal_column(STUDENT_FTS_TABLE)
+    stmt = (select(*columns_for(Student, StudentRow))
+            .select_from(_fts.join(Student.__table__, Student.id == _fts.c.rowid))
+            .where(fts.op("MATCH")(match))
+            .order_by(_exact_first(q), func.bm25(fts, *BM25_WEIGHTS), Student.name)
+            .limit(limit))
+    return [StudentRow(*r) for r in session.execute(stmt)]
+
+
+def _like_query(session, q: str, limit: int, sqlite: bool):
+    fields = (Student.name, Student.phone, Student.address)
+    stmt = (select(*columns_for(Student, StudentRow))
+            .where(or_(*(_contains(f, q, sqlite) for f in fields)))
+            .order_by(_exact_first(q),
+                      case((_contains(Student.name, q, sqlite), 0), else_=1),
+                      func.length(Student.name), Student.name)
+            .limit(limit))
+    return [StudentRow(*r) for r in session.execute(stmt)]
+
+
+def _fuzzy_like_query(session, q: str, limit: int, sqlite: bool):
+    """以 2 字元片段計分：至少一半片段出現在姓名 / 電話 / 地址中即列入，相符片段越多越前面。"""
+    grams = _ngrams(q, 2)
+    if not grams:
+        return []
+    haystack = (func.coalesce(Student.name, "") + " " + func.coalesce(Student.phone, "")
+                + " " + func.coalesce(Student.address, ""))
+    name_score = sum(case((_contains(Student.name, g, sqlite), 2), else_=0) for g in grams)
+    score = sum(case((_contains(haystack, g, sqlite), 1), else_=0) for g in grams) + name_score
+    stmt = (select(*columns_for(Student, StudentRow))
+            .where(score >= literal(max(1, len(grams) // 2)))
+            .order_by(score.desc(), Student.name)
+            .limit(limit))
+    return [StudentRow(*r) for r in session.execute(stmt)]
+
+
+def search_students(session, query: str, limit: int = SEARCH_LIMIT, fuzzy: bool = True,
+                    use_fts: bool = True):
+    """回傳依相關程度排序的 StudentRow 清單（最多 limit 筆）。"""
+    q = (query or "").strip()
+    if not q or limit <= 0:
+        return []
+    sqlite = session.get_bind().dialect.name == "sqlite"
+    use_fts = use_fts and len(q) >= 3
+    rows = _fts_query(session, _phrase(q), q, limit) if use_fts else _like_query(session, q, limit, sqlite)
+    if not fuzzy or len(rows) >= limit:
+        return rows
+
+    seen = {r.id for r in rows}
+    if use_fts and len(q) > 3:
+        # 任一 trigram 相符即列入，bm25 讓相符片段較多者排前面
+        more = _fts_query(session, " OR ".join(_phrase(g) for g in _ngrams(q, 3)), q, limit + len(rows))
+    elif not rows:
+        # 太短無法用 trigram：完全找不到時才以 2 字元片段逐筆計分（需掃描整張表）
+        more = _fuzzy_like_query(session, q, limit, sqlite)
+    else:
+        return rows
+    rows.extend(r for r in more if r.id not in seen)
+    return rows[:limit]
@@ -0,0 +1,273 @@
+"""
+區網 HTTP/JSON 伺服器：讓多台平板透過 AsyncAttendanceService 同時點名。
+只用標準庫 asyncio，支援 HTTP/1.1 keep-alive；僅供內部網路使用，未做身分驗證。
+
+    python server.py [--host 0.0.0.0] [--port 8080] [--db sqlite+aiosqlite:///attendance.db]
+
+路由：
+    GET  /students                              全部學生
+    GET  /students?q=&limit=&after_name=&after_id=
+                                                依 (姓名, id) 分頁搜尋：{"items": [...], "next": {...} | null}
+    GET  /students/search?q=&limit=[&fuzzy=0]    姓名 / 電話 / 地址部分或模糊比對，依相關程度排序
+    GET  /teachers                              全部老師
+    GET  /courses                               課程與排程
+    GET  /courses/{id}/students                 課程報名學生
+    GET  /occurrences?start=YYYY-MM-DD&end=YYYY-MM-DD[&teacher_id=&course_id=]
+    PUT  /courses/{id}/enrollments              {"student_ids": [...]}
+    POST /attendance                            {"schedule_id": 1, "date": "YYYY-MM-DD",
+                                                 "statuses": {"<student_id>": "有到"}}
+    POST /attendance/batch                      {"entries": [同上, ...], "atomic": true}
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+from datetime import date, time, datetime
+from urllib.parse import urlsplit, parse_qs
+
+from async_service import AsyncAttendanceService, ASYNC_DATABASE_URL
+from search import SEARCH_LIMIT
+from services import STUDENT_PAGE_SIZE
+
+logger = logging.getLogger("attendance.server")
+
+MAX_BODY = 1 << 20
+MAX_PAGE_SIZE = 1000
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details      # 併入錯誤回應的其他欄位（例如衝突清單）
+
+
+def to_jsonable(obj):
+    """dto 資料列（NamedTuple）轉 dict，日期時間轉 ISO 字串。"""
+    if hasattr(obj, "_asdict"):
+        return {k: to_jsonable(v) for k, v in obj._asdict().items()}
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    if isinstance(obj, (date, time, datetime)):
+        return obj.isoformat()
+    return obj
+
+
+def _parse_date(value, field):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{field} 必須是 YYYY-MM-DD")
+
+
+def _optional_int(query, field):
+    value = query.get(field, [None])[0]
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(400, f"{field} 必須是整數")
+
+
+def _roll_call_entry(body):
+    """{"schedule_id", "date", "statuses"} -> (schedule_id, date, {student_id: 狀態})。"""
+    if not isinstance(body, dict) or not isinstance(body.get("statuses"), dict):
+        raise HttpError(400, "statuses 必須是 {student_id: 狀態}")
+    try:
+        schedule_id = int(body.get("schedule_id"))
+        statuses = {int(sid): str(st) for sid, st in body["statuses"].items()}
+    except (TypeError, ValueError):
+        raise HttpError(400, "schedule_id / student_id 必須是整數")
+    return schedule_id, _parse_date(body.get("date"), "date"), statuses
+
+
+class AttendanceServer:
+    def __init__(self, service: AsyncAttendanceService):
+        self.service = service
+        self.routes = [
+            ("GET", re.compile(r"^/students$"), self.list_students),
+            ("GET", re.compile(r"^/students/search$"), self.search_students),
+            ("GET", re.compile(r"^/teachers$"), self.list_teachers),
+            ("GET", re.compile(r"^/courses$"), self.list_courses),
+            ("GET", re.compile(r"^/courses/(\d+)/students$"), self.course_students),
+            ("GET", re.compile(r"^/occurrences$"), self.occurrences),
+            ("PUT", re.compile(r"^/courses/(\d+)/enrollments$"), self.update_enrollments),
+            ("POST", re.compile(r"^/attendance$"), self.take_attendance),
+            ("POST", re.compile(r"^/attendance/batch$"), self.take_attendance_batch),
+        ]
+
+    # ----- handlers：回傳可 JSON 化的結果 -----
+    async def list_students(self, query, body):
+        if not any(k in query for k in ("q", "limit", "after_name", "after_id")):
+            return await self.service.get_all_students()
+        limit = min(_optional_int(query, "limit") or STUDENT_PAGE_SIZE, MAX_PAGE_SIZE)
+        after_id = _optional_int(query, "after_id")
+        after = (query.get("after_name", [""])[0], after_id) if after_id is not None else None
+        rows, cursor = await self.service.search_students(query.get("q", [""])[0], after, max(limit, 1))
+        return {"items": rows,
+                "next": {"after_name": cursor[0], "after_id": cursor[1]} if cursor else None}
+
+    async def search_students(self, query, body):
+        limit = min(_optional_int(query, "limit") or SEARCH_LIMIT, MAX_PAGE_SIZE)
+        fuzzy = query.get("fuzzy", ["1"])[0] not in ("0", "false")
+        return await self.service.find_students(query.get("q", [""])[0], max(limit, 1), fuzzy)
+
+    async def list_teachers(self, query, body):
+        return await self.service.get_all_teachers()
+
+    async def list_courses(self, query, body):
+        return await self.service.get_all_courses_with_schedules()
+
+    async def course_students(self, query, body, course_id):
+        return await self.service.get_students_for_course(int(course_id))
+
+    async def occurrences(self, query, body):
+        start = _parse_date(query.get("start", [None])[0], "start")
+        end = _parse_date(query.get("end", [None])[0], "end")
+        return await self.service.get_courses_for_period(
+            start, end, _optional_int(query, "teacher_id"), _optional_int(query, "course_id"))
+
+    async def update_enrollments(self, query, body, course_id):
+        ids = body.get("student_ids")
+        if not isinstance(ids, list):
+            raise HttpError(400, "student_ids 必須是陣列")
+        result = await self.service.update_course_enrollments(int(course_id), ids)
+        if result is None:
+            raise HttpError(404, "找不到課程")
+        if "conflicts" in result:
+            raise HttpError(409, "加選的學生在同一時段已有其他課程", conflicts=result["conflicts"])
+        return result
+
+    async def take_attendance(self, query, body):
+        outcomes = await self.service.take_attendance(*_roll_call_entry(body))
+        if outcomes is None:
+            raise HttpError(404, "找不到排程或點名失敗")
+        return outcomes
+
+    async def take_attendance_batch(self, query, body):
+        entries = body.get("entries")
+        if not isinstance(entries, list):
+            raise HttpError(400, "entries 必須是陣列")
+        results = await self.service.take_attendance_batch(
+            [_roll_call_entry(e) for e in entries], atomic=bool(body.get("atomic", True)))
+        if results is None:
+            raise HttpError(404, "有堂次找不到排程或寫入失敗，整批未寫入")
+        return results
+
+    # ----- HTTP -----
+    async def dispatch(self, method, target, raw_body):
+        parts = urlsplit(target)
+        allowed = False
+        for m, pattern, handler in self.routes:
+            match = pattern.match(parts.path)
+            if not match:
+                continue
+            allowed = True
+            if m != method:
+                continue
+            body = {}
+            if raw_body:
+                try:
+                    body = json.loads(raw_body)
+                except ValueError:
+                    raise HttpError(400, "JSON 格式錯誤")
+                if not isinstance(body, dict):
+                    raise HttpError(400, "請求內容必須是 JSON 物件")
+            return await handler(parse_qs(parts.query), body, *match.groups())
+        raise HttpError(405 if allowed else 404, "不支援的方法" if allowed else "找不到路徑")
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                # 請求內容沒有讀完（長度錯誤或過大）時，回應後關閉連線
+                body_read = False
+                try:
+                    try:
+                        length = int(headers.get("content-length") or 0)
+                    except ValueError:
+                        raise HttpError(400, "Content-Length 格式錯誤")
+                    if length < 0:
+                        raise HttpError(400, "Content-Length 格式錯誤")
+                    if length > MAX_BODY:
+                        raise HttpError(413, "請求內容過大")
+                    raw_body = await reader.readexactly(length) if length else b""
+                    body_read = True
+                    status, payload = 200, await self.dispatch(method.upper(), target, raw_body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e), **e.details}
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception:
+                    # 例外細節只記在伺服器端，不回傳給用戶端
+                    logger.exception("處理 %s %s 失敗", method, target)
+                    status, payload = 500, {"error": "伺服器內部錯誤"}
+
+                data = json.dumps(to_jsonable(payload), ensure_ascii=False).encode("utf-8")
+                keep_alive = (body_read and headers.get("connection", "").lower() != "close"
+                              and version.upper() == "HTTP/1.1")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080, db_url=ASYNC_DATABASE_URL, profile="desktop", ready=None):
+    """啟動伺服器直到被取消；ready 為 asyncio.Event 時，開始監聽後會 set()。"""
+    service = AsyncAttendanceService(db_url, profile)
+    await service.init_schema()
+    server = await asyncio.start_server(AttendanceServer(service).handle_client, host, port)
+    try:
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.dispose()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="學生點名系統 HTTP/JSON 伺服器")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--db", default=ASYNC_DATABASE_URL, help="async driver 的資料庫 URL")
+    ap.add_argument("--profile", default="desktop", help="引擎設定檔（database.ENGINE_PROFILES）")
+    args = ap.parse_args(argv)
+    print(f"點名伺服器啟動：http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port, args.db, args.profile))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker, joinedload
+from sqlalchemy import func, select, or_, and_, tuple_, literal
+from sqlalchemy.orm import sessionmaker, scoped_session, joinedload
+from contextlib import contextmanager
 from datetime import date, time, timedelta, datetime
 from sqlalchemy.orm.exc import NoResultFound
+import numpy as np
 import pandas as pd
-import pathlib, os
+from itertools import chain
+from openpyxl import Workbook
+import argparse, pathlib, os, threading
 
+import profiling
+from cache import ResultCache
+from database import make_engine, insert_ignore, upsert
+from roster_import import ImportReport, RowError, iter_roster_chunks
+from scheduling import Conflict, TimetableIndex
+from search import SEARCH_LIMIT, fts_available, search_students
+from dto import (
+    StudentRow, TeacherRow, ScheduleRow, CourseRow, ScheduleDetailRow, AttendanceRow,
+    LedgerRow, columns_for
+)
 from models import (
-    Base, Student, Teacher, Course, CourseSchedule, AttendanceRecord,
-    student_course_association
+    Base, Student, Teacher, Course, CourseSchedule, CourseSession, SessionHorizon,
+    AttendanceRecord, ClassLedgerEntry,
+    MonthlyReportState, MonthlyReportRow, ReportMonthVersion, student_course_association, upgrade_schema,
+    report_month_key, report_month_version, report_versions_installed
 )
 
 # 以檔案所在資料夾為基準，避免不同工作目錄造成多顆 DB
@@ -15,15 +31,240 @@ BASE_DIR = pathlib.Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "attendance.db"
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+SESSION_MODES = ("per_call", "scoped")
+
+# 需要扣堂的出勤狀態
+DEDUCTING_STATUSES = ("有到", "遲到")
+# take_attendance 回傳的每位學生結果
+ATTENDANCE_OUTCOMES = ("inserted", "duplicate", "unknown", "not_deducted")
+
+# 月報表欄位與串流批次大小
+REPORT_HEADERS = ["日期", "學生姓名", "課程名稱", "上課時間", "授課老師", "出勤狀態", "剩餘堂數"]
+REPORT_CHUNK_SIZE = 2000
+
+# 學生分頁查詢的每頁筆數；前綴查詢的上界字元（UTF-8 最大碼位）
+STUDENT_PAGE_SIZE = 200
+PREFIX_UPPER = "\U0010ffff"
+
+# course_sessions 滾動展開的天數（自今天起）
+CALENDAR_HORIZON_DAYS = 180
+
+WEEKDAYS = ('MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN')
+OCCURRENCE_COLUMNS = ["date", "course_id", "schedule_id", "course_name",
+                      "teacher_name", "start_time", "end_time"]
+
+
+def month_bounds(year: int, month: int):
+    """回傳該月份的第一天與最後一天。"""
+    start_date = date(year, month, 1)
+    end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    return start_date, end_date
+
+
+def parse_month(text: str) -> date:
+    """解析命令列的 YYYY-MM，回傳該月第一天（供 argparse 的 type= 使用）。"""
+    try:
+        year, month = (int(x) for x in text.split("-"))
+        return date(year, month, 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"月份格式應為 YYYY-MM：{text}")
+
+
+def months_between(start_date: date, end_date: date):
+    """回傳兩個日期之間（含頭尾所在月份）的 (year, month) 清單。"""
+    y, m = start_date.year, start_date.month
+    months = []
+    while (y, m) <= (end_date.year, end_date.month):
+        months.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+def expand_occurrences(schedule_rows, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    把排程規則展開成實際上課日期。
+    排程先依 day_of_week 分組，每個星期幾只算一次日期序列（第一個符合日 + 每 7 天），
+    再與該組排程做笛卡兒積，複雜度與輸出筆數成正比，而非「天數 × 排程數」。
+    """
+    if not schedule_rows or start_date > end_date:
+        return pd.DataFrame(columns=OCCURRENCE_COLUMNS)
+
+    sched = pd.DataFrame(schedule_rows, columns=[
+        "schedule_id", "course_id", "course_name", "teacher_name",
+        "day_of_week", "start_time", "end_time"])
+    end = np.datetime64(end_date, "D")
+    parts = []
+    for dow, group in sched.groupby("day_of_week", sort=False):
+        if dow not in WEEKDAYS:
+            continue
+        offset = (WEEKDAYS.index(dow) - start_date.weekday()) % 7
+        first = np.datetime64(start_date, "D") + offset
+        if first > end:
+            continue
+        dates = np.arange(first, end + 1, 7)
+        k = len(group)
+        part = group.iloc[np.tile(np.arange(k), len(dates))].reset_index(drop=True)
+        part.insert(0, "date", np.repeat(dates, k))
+        parts.append(part)
+
+    if not parts:
+        return pd.DataFrame(columns=OCCURRENCE_COLUMNS)
+    df = pd.concat(parts, ignore_index=True)
+    df["date"] = pd.to_datetime(df["date"])
+    return (df.sort_values(["date", "start_time"], kind="stable")
+              .reset_index(drop=True)[OCCURRENCE_COLUMNS])
+
+
+def occurrence_records(df: pd.DataFrame):
+    """把 Occurrence DataFrame 轉成 get_courses_for_period 的 list[dict]（date 為 datetime.date）。"""
+    if df.empty:
+        return []
+    df = df.assign(date=df["date"].dt.date)
+    return df.to_dict("records")
+
+
 class AttendanceService:
-    def __init__(self, db_url: str = DATABASE_URL):
-        self.engine = create_engine(db_url, future=True)
-        Base.metadata.create_all(self.engine)  # 首次自動建表
+    def __init__(self, db_url: str = DATABASE_URL, profile: str = "default",
+                 session_mode: str = "per_call", cache_size: int = 128,
+                 orm_results: bool = False, reports_dir=None,
+                 instrument: bool | None = None, slow_ms: float | None = None,
+                 report_cache: bool = True, session_calendar: bool = False, read_only: bool = False):
+        """
+        profile：引擎設定檔（見 database.ENGINE_PROFILES），例如 "desktop" 啟用 WAL。
+        session_mode："per_call" 每次呼叫建立新 Session；
+                      "scoped" 每個執行緒重複使用同一個 Session（scoped_session）。
+        cache_size：名單類查詢的快取筆數上限，0 表示不快取。
+        orm_results：True 時查詢 API 回傳舊版的 ORM 物件，預設回傳 dto 模組的輕量資料列。
+        reports_dir：報表輸出資料夾，預設為程式目錄下的 reports/。
+        instrument：啟用 profiling 量測（None 時依環境變數 ROLLCALL_PROFILE 決定），
+                    slow_ms 為慢呼叫門檻（預設讀 ROLLCALL_SLOW_MS，否則 200ms）。
+        report_cache：讀取月報表時使用 warm_report_cache 建立的快取（report_cache_rows），
+                      快取的版本與該月目前的報表版本相同才使用，否則即時查詢；讀取時不寫入資料庫。
+        session_calendar：啟用 course_sessions 上課日表（可停課 / 補課），
+                          範圍落在已展開區間內的課表查詢改為依日期索引的範圍掃描。
+        read_only：唯讀模式（搭配 profile="readonly"，供 batch_reports 的工作行程使用）：
+                   不建表、不補索引、不展開上課日表。
+        """
+        if session_mode not in SESSION_MODES:
+            raise ValueError(f"未知的 session_mode：{session_mode}")
+        self.engine = make_engine(db_url, profile)
+        self.read_only = read_only
+        if not read_only:
+            Base.metadata.create_all(self.engine)  # 首次自動建表
+            upgrade_schema(self.engine)            # 舊資料庫補建索引
+        with self.engine.connect() as conn:
+            self._fts = fts_available(conn)    # 學生全文索引（見 search.py）
         self.Session = sessionmaker(bind=self.engine, future=True)
+        self.session_mode = session_mode
+        self._scoped = scoped_session(self.Session) if session_mode == "scoped" else None
+        self._scope = threading.local()    # scoped 模式：目前執行緒的 session_scope 狀態
+        self.cache = ResultCache(cache_size)
+        self.orm_results = orm_results
+        self.reports_dir = pathlib.Path(reports_dir) if reports_dir else BASE_DIR / "reports"
+        self.report_cache = report_cache
+        # 排課衝突索引：第一次檢查時才建立，之後隨異動增量更新
+        self._timetable = None
+        self._timetable_lock = threading.Lock()
+
+        self.session_calendar = session_calendar
+        self._horizon = None      # (start_date, end_date)，已展開的上課日範圍
+        if session_calendar and not read_only:
+            self.extend_session_calendar()
+
+        self.profiler = None
+        from_env = instrument is None and profiling.env_enabled()
+        if instrument or from_env:
+            self.profiler = profiling.ServiceProfiler(
+                self.engine,
+                slow_ms=slow_ms if slow_ms is not None else float(os.environ.get(profiling.ENV_SLOW_MS, 200)),
+                slow_sql_ms=float(os.environ.get(profiling.ENV_SLOW_SQL_MS, 100)))
+            self.profiler.wrap(self)
+            if from_env:
+                self.profiler.print_at_exit()
+
+    # scoped 模式下，session_scope 區塊內呼叫的服務方法與呼叫端共用同一個 Session：
+    # 方法各自在 savepoint 內執行，_commit / _rollback 只結束自己的 savepoint，
+    # _release 不關閉 Session；交易只由最外層的 session_scope commit 並關閉。
+    def _in_scope(self) -> bool:
+        return self._scoped is not None and getattr(self._scope, "savepoints", None) is not None
 
     def _get_session(self):
+        if self._scoped is not None:
+            session = self._scoped()
+            if self._in_scope():
+                # [savepoint, 是否已結束]；flush 失敗的 savepoint 仍需 rollback 才能繼續使用 Session
+                self._scope.savepoints.append([session.begin_nested(), False])
+            return session
         return self.Session()
 
+    def _end_savepoint(self, commit: bool):
+        entry = self._scope.savepoints[-1]
+        if not entry[1]:
+            entry[1] = True
+            entry[0].commit() if commit else entry[0].rollback()
+
+    def _commit(self, session):
+        if self._in_scope():
+            self._end_savepoint(commit=True)
+        else:
+            session.commit()
+
+    def _rollback(self, session):
+        if self._in_scope():
+            self._end_savepoint(commit=False)
+        else:
+            session.rollback()
+
+    def _release(self, session):
+        """方法結束時呼叫（取代 session.close()）；savepoint 未 commit 者一律退回。"""
+        if self._in_scope():
+            self._end_savepoint(commit=False)
+            self._scope.savepoints.pop()
+        else:
+            session.close()
+
+    @contextmanager
+    def session_scope(self):
+        """
+        Unit of work：區塊內的操作共用一個交易，成功才 commit，失敗則 rollback。
+        scoped 模式下區塊內呼叫的服務方法也加入同一個交易（巢狀的 session_scope 為 savepoint）；
+        per_call 模式下服務方法仍各自使用獨立的 Session 與交易。
+        """
+        if self._in_scope():
+            session = self._scoped()
+            with session.begin_nested():
+                yield session
+            return
+        session = self._scoped() if self._scoped is not None else self.Session()
+        if self._scoped is not None:
+            self._scope.savepoints = []
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self._scope.savepoints = None
+            session.close()
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def profiling_summary(self):
+        """各方法耗時 / SQL 條數摘要；未啟用量測時回傳 None。"""
+        return self.profiler.summary() if self.profiler else None
+
+    def reset_profiling(self):
+        if self.profiler:
+            self.profiler.reset()
+
+    def dispose(self):
+        """釋放連線池（關閉程式或切換資料庫時呼叫）。"""
+        if self._scoped is not None:
+            self._scoped.remove()
+        self.engine.dispose()
+
     # ---------- 1) 學生 ----------
     def add_student(self, name, phone, address, registered_classes=0):
         session = self._get_session()
@@ -34,43 +275,127 @@ class AttendanceService:
                 remaining_classes=registered_classes
             )
             session.add(obj)
-            session.commit()
+            session.flush()
+            if registered_classes:
+                self._write_ledger(session, [{"student_id": obj.id, "kind": "purchase",
+                                              "amount": registered_classes, "note": "新增學生"}])
+            self._commit(session)
+            self.cache.invalidate(("students",), ("enrollment",))
             return obj
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return None
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _student_row(session, condition):
+        r = session.execute(select(*columns_for(Student, StudentRow)).where(condition)).first()
+        return StudentRow(*r) if r else None
 
     def get_all_students(self):
+        return self.cache.get_or_load(("students",), self._load_all_students)
+
+    def _load_all_students(self):
         session = self._get_session()
         try:
-            return session.query(Student).order_by(Student.id).all()
+            if self.orm_results:
+                return session.query(Student).order_by(Student.id).all()
+            return self._query_all_students(session)
         finally:
-            session.close()
+            self._release(session)
+
+    # 以下 _query_* / _apply_* 為 session 層級的輔助函式：不開關 Session、不 commit，
+    # 同步 API 與 async_service（AsyncSession.run_sync）共用同一套查詢邏輯。
+    @staticmethod
+    def _query_all_students(session):
+        return [StudentRow(*r) for r in session.execute(
+            select(*columns_for(Student, StudentRow)).order_by(Student.id))]
+
+    def search_students(self, prefix: str = "", after=None, limit: int = STUDENT_PAGE_SIZE,
+                        course_id: int | None = None, enrolled: bool | None = None):
+        """
+        依 (姓名, id) keyset 分頁查詢學生，回傳 (本頁學生, 下一頁游標)；已到最後一頁時游標為 None。
+        prefix：姓名或電話的開頭；after：上一頁回傳的游標；
+        course_id 搭配 enrolled=True / False 只列出已報名 / 未報名該課程的學生。
+        """
+        session = self._get_session()
+        try:
+            return self._query_student_page(session, prefix, after, limit, course_id, enrolled,
+                                            orm=self.orm_results)
+        finally:
+            self._release(session)
+
+    @staticmethod
+    def _query_student_page(session, prefix: str = "", after=None, limit: int = STUDENT_PAGE_SIZE,
+                            course_id: int | None = None, enrolled: bool | None = None, orm: bool = False):
+        stmt = select(Student) if orm else select(*columns_for(Student, StudentRow))
+        prefix = (prefix or "").strip()
+        if prefix:
+            # 以範圍條件取代 LIKE 'x%'：不受大小寫設定影響，姓名 / 電話索引都能使用
+            upper = prefix + PREFIX_UPPER
+            stmt = stmt.where(or_(and_(Student.name >= prefix, Student.name < upper),
+                                  and_(Student.phone >= prefix, Student.phone < upper)))
+        if course_id is not None and enrolled is not None:
+            members = (select(student_course_association.c.student_id)
+                       .where(student_course_association.c.course_id == int(course_id)))
+            stmt = stmt.where(Student.id.in_(members) if enrolled else ~Student.id.in_(members))
+        if after is not None:
+            name, sid = after
+            stmt = stmt.where(tuple_(Student.name, Student.id) > tuple_(name, int(sid)))
+        stmt = stmt.order_by(Student.name, Student.id).limit(limit + 1)
+
+        if orm:
+            rows = list(session.scalars(stmt))
+        else:
+            rows = [StudentRow(*r) for r in session.execute(stmt)]
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1].name, rows[-1].id)
+
+    def find_students(self, query: str, limit: int = SEARCH_LIMIT, fuzzy: bool = True):
+        """姓名 / 電話 / 地址的部分或模糊比對，依相關程度排序（見 search.py）。"""
+        session = self._get_session()
+        try:
+            return search_students(session, query, limit, fuzzy, self._fts)
+        finally:
+            self._release(session)
 
     def get_student_by_id(self, student_id: int):
         session = self._get_session()
         try:
-            return session.query(Student).get(student_id)
+            if self.orm_results:
+                return session.query(Student).get(student_id)
+            return self._student_row(session, Student.id == int(student_id))
         finally:
-            session.close()
+            self._release(session)
 
     def add_classes_to_student(self, student_id: int, num_classes: int):
+        # 帳本的 purchase 只能是正數；扣堂走點名，不經過這裡
+        if num_classes <= 0:
+            return False
         session = self._get_session()
         try:
-            s = session.query(Student).get(student_id)
-            if not s:
+            students = Student.__table__
+            # 以 SQL 運算式原子地加值，避免「讀出再寫回」遺失並行的更新
+            res = session.execute(
+                students.update().where(students.c.id == int(student_id))
+                .values(registered_classes=students.c.registered_classes + num_classes,
+                        remaining_classes=students.c.remaining_classes + num_classes))
+            if not res.rowcount:
+                self._rollback(session)
                 return False
-            s.registered_classes += num_classes
-            s.remaining_classes += num_classes
-            session.commit()
+            self._write_ledger(session, [{"student_id": int(student_id), "kind": "purchase",
+                                          "amount": num_classes, "note": "增加堂數"}])
+            self._commit(session)
+            self.cache.invalidate(("students",), ("enrollment",))
             return True
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return False
         finally:
-            session.close()
+            self._release(session)
 
     def delete_student(self, student_id: int):
         session = self._get_session()
@@ -79,13 +404,89 @@ class AttendanceService:
             if not s:
                 return False
             session.delete(s)
-            session.commit()
+            self._commit(session)
+            self.cache.invalidate(("students",), ("enrollment",))
+            if self._timetable is not None:
+                self._timetable.remove_student(int(student_id))
             return True
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return False
         finally:
-            session.close()
+            self._release(session)
+
+    def import_students(self, path, course_ids=None, chunk_size: int = 500,
+                        add_classes: bool = False) -> ImportReport:
+        """
+        由 CSV / XLSX 批次匯入學生，每批以一條 upsert（依姓名）寫入：
+        新學生直接新增並記入帳本；同名學生只更新電話 / 地址，同一份名冊重複匯入結果不變。
+        add_classes=True 時，同名學生也把檔案中的報名堂數加到總堂數與剩餘堂數（並記入帳本）。
+        course_ids 不為空時，同時把該批學生報名到這些課程。
+        每批一個交易；回傳 ImportReport，逐列列出錯誤而非整批失敗。
+        """
+        imported = enrolled = 0
+        errors = []
+        cids = []
+        dialect = self.engine.dialect.name
+        students = Student.__table__
+        assoc = student_course_association
+        try:
+            with self.engine.connect() as conn:
+                if course_ids:
+                    wanted = {int(c) for c in course_ids}
+                    with conn.begin():
+                        cids = sorted(conn.execute(select(Course.id).where(Course.id.in_(wanted))).scalars())
+                    for missing in sorted(wanted - set(cids)):
+                        errors.append(RowError(0, "", f"找不到課程 ID {missing}，略過報名"))
+
+                for valid, row_errors in iter_roster_chunks(path, chunk_size):
+                    errors.extend(row_errors)
+                    if not valid:
+                        continue
+                    rows = [{**d, "remaining_classes": d["registered_classes"]} for _, d in valid]
+                    names = [d["name"] for _, d in valid]
+                    try:
+                        with conn.begin():
+                            existing = set(conn.execute(
+                                select(Student.name).where(Student.name.in_(names))).scalars())
+                            upsert(dialect, conn, students, rows, ["name"],
+                                   lambda ex: self._import_update(students, ex, add_classes))
+                            id_by_name = dict(conn.execute(
+                                select(Student.name, Student.id).where(Student.name.in_(names))).all())
+                            # 帳本與堂數一致：只有實際加上的堂數才記帳
+                            self._write_ledger(conn, [
+                                {"student_id": id_by_name[d["name"]], "kind": "purchase",
+                                 "amount": d["registered_classes"], "note": "批次匯入"}
+                                for _, d in valid
+                                if d["registered_classes"] and (add_classes or d["name"] not in existing)])
+                            if cids:
+                                ids = list(id_by_name.values())
+                                enrolled += insert_ignore(
+                                    dialect, conn, assoc,
+                                    [{"student_id": sid, "course_id": cid} for sid in ids for cid in cids],
+                                    ["student_id", "course_id"])
+                        imported += len(valid)
+                    except Exception as e:
+                        errors.extend(RowError(row_no, d["name"], f"寫入失敗：{e}") for row_no, d in valid)
+        except Exception as e:
+            errors.append(RowError(0, "", str(e)))
+        finally:
+            self.cache.invalidate(("students",), ("enrollment",))
+            if cids:
+                self._timetable = None   # 大量報名：下次檢查時重建排課索引
+        return ImportReport(imported, enrolled, errors)
+
+    @staticmethod
+    def _import_update(students, excluded, add_classes: bool):
+        """import_students 遇到同名學生時要更新的欄位（空白的電話 / 地址不覆蓋原值）。"""
+        values = {
+            "phone": func.coalesce(excluded.phone, students.c.phone),
+            "address": func.coalesce(excluded.address, students.c.address),
+        }
+        if add_classes:
+            values["registered_classes"] = students.c.registered_classes + excluded.registered_classes
+            values["remaining_classes"] = students.c.remaining_classes + excluded.registered_classes
+        return values
 
     # ---------- 2) 老師 ----------
     def add_teacher(self, name, phone, address):
@@ -93,20 +494,31 @@ class AttendanceService:
         try:
             obj = Teacher(name=name, phone=phone, address=address)
             session.add(obj)
-            session.commit()
+            self._commit(session)
+            self.cache.invalidate(("teachers",))
             return obj
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return None
         finally:
-            session.close()
+            self._release(session)
 
     def get_all_teachers(self):
+        return self.cache.get_or_load(("teachers",), self._load_all_teachers)
+
+    def _load_all_teachers(self):
         session = self._get_session()
         try:
-            return session.query(Teacher).order_by(Teacher.id).all()
+            if self.orm_results:
+                return session.query(Teacher).order_by(Teacher.id).all()
+            return self._query_all_teachers(session)
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _query_all_teachers(session):
+        return [TeacherRow(*r) for r in session.execute(
+            select(*columns_for(Teacher, TeacherRow)).order_by(Teacher.id))]
 
     def delete_teacher(self, teacher_id: int):
         session = self._get_session()
@@ -117,13 +529,14 @@ class AttendanceService:
             if t.courses:
                 return False, f"無法刪除，該老師仍有 {len(t.courses)} 門課程。"
             session.delete(t)
-            session.commit()
+            self._commit(session)
+            self.cache.invalidate(("teachers",))
             return True, ""
         except Exception as e:
-            session.rollback()
+            self._rollback(session)
             return False, str(e)
         finally:
-            session.close()
+            self._release(session)
 
     # ---------- 3) 課程與排程 ----------
     def add_course(self, name, teacher_id, duration_minutes=60, break_minutes=10):
@@ -136,22 +549,43 @@ class AttendanceService:
                 duration_minutes=duration_minutes, break_minutes=break_minutes
             )
             session.add(obj)
-            session.commit()
+            self._commit(session)
+            self.cache.invalidate(("courses",))
+            if self._timetable is not None:
+                self._timetable.add_course(obj.id, obj.teacher_id)
             return obj
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return None
         finally:
-            session.close()
+            self._release(session)
 
     def get_all_courses_with_schedules(self):
+        return self.cache.get_or_load(("courses",), self._load_all_courses_with_schedules)
+
+    def _load_all_courses_with_schedules(self):
         session = self._get_session()
         try:
-            return (session.query(Course)
-                    .options(joinedload(Course.teacher), joinedload(Course.schedules))
-                    .all())
+            if self.orm_results:
+                return (session.query(Course)
+                        .options(joinedload(Course.teacher), joinedload(Course.schedules))
+                        .all())
+            return self._query_courses_with_schedules(session)
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _query_courses_with_schedules(session):
+        schedules = {}
+        for r in session.execute(select(*columns_for(CourseSchedule, ScheduleRow))
+                                 .order_by(CourseSchedule.id)):
+            schedules.setdefault(r.course_id, []).append(ScheduleRow(*r))
+        rows = session.execute(
+            select(Course.id, Course.name, Course.teacher_id, Teacher.name,
+                   Course.duration_minutes, Course.break_minutes)
+            .join(Teacher, Course.teacher_id == Teacher.id)
+            .order_by(Course.id))
+        return [CourseRow(*r, schedules=tuple(schedules.get(r[0], ()))) for r in rows]
 
     def add_course_schedule(self, course_id: int, day_of_week: str, start_time_str: str):
         session = self._get_session()
@@ -167,239 +601,991 @@ class AttendanceService:
             lunch_start, lunch_end = time(12, 10), time(13, 0)
             if not (end_time <= lunch_start or start_time >= lunch_end):
                 return None
+            # 同一老師、或已報名學生同一天時段重疊也不可排
+            day = day_of_week.upper()
+            timetable = self._get_timetable()
+            if timetable.conflicts_for(course.id, day, start_time, end_time):
+                return None
 
             obj = CourseSchedule(
                 course_id=course_id,
-                day_of_week=day_of_week.upper(),
+                day_of_week=day,
                 start_time=start_time,
                 end_time=end_time
             )
             session.add(obj)
-            session.commit()
+            session.flush()
+            # 上課日表已建立時（不論本實例是否啟用）一併展開新排程
+            horizon = session.get(SessionHorizon, 1)
+            if horizon:
+                self._generate_sessions(session, max(horizon.start_date, date.today()),
+                                        horizon.end_date, schedule_id=obj.id)
+            self._commit(session)
+            self.cache.invalidate(("courses",))
+            timetable.add_schedule(obj.id, obj.course_id, day, start_time, end_time)
             return obj
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return None
         finally:
-            session.close()
+            self._release(session)
+
+    def update_course_schedule(self, schedule_id: int, day_of_week: str, start_time_str: str):
+        """
+        修改排程的星期 / 開始時間（同樣檢查午休與衝突）。
+        上課日表只重建這個排程今天以後、狀態為 scheduled 的日子；停課與補課保留。
+        該排程點名記錄所在月份的月報表快取隨同一交易失效（報表版本由 course_schedules 的觸發器遞增）。
+        """
+        session = self._get_session()
+        try:
+            obj = session.get(CourseSchedule, int(schedule_id))
+            if not obj:
+                return None
+            course = obj.course
+            start_time = datetime.strptime(start_time_str, "%H:%M").time()
+            end_time = (datetime.combine(date.min, start_time)
+                        + timedelta(minutes=course.duration_minutes)).time()
+            lunch_start, lunch_end = time(12, 10), time(13, 0)
+            if not (end_time <= lunch_start or start_time >= lunch_end):
+                return None
+            day = day_of_week.upper()
+            timetable = self._get_timetable()
+            if timetable.conflicts_for(course.id, day, start_time, end_time, schedule_id=obj.id):
+                return None
+
+            obj.day_of_week, obj.start_time, obj.end_time = day, start_time, end_time
+            horizon = session.get(SessionHorizon, 1)
+            if horizon:
+                today = date.today()
+                sessions = CourseSession.__table__
+                session.execute(sessions.delete().where(
+                    sessions.c.schedule_id == obj.id, sessions.c.status == 'scheduled',
+                    sessions.c.date >= today))
+                session.flush()
+                self._generate_sessions(session, max(horizon.start_date, today), horizon.end_date,
+                                        schedule_id=obj.id)
+            self._commit(session)
+            self.cache.invalidate(("courses",))
+            timetable.remove_schedule(obj.id, course.id)
+            timetable.add_schedule(obj.id, course.id, day, start_time, end_time)
+            return obj
+        except Exception:
+            self._rollback(session)
+            return None
+        finally:
+            self._release(session)
 
     def delete_course(self, course_id: int):
         session = self._get_session()
         try:
-            c = session.query(Course).get(course_id)
+            cid = int(course_id)
+            c = session.get(Course, cid)
             if not c:
                 return False
             session.delete(c)
-            session.commit()
+            self._commit(session)
+            self.cache.invalidate(("courses",), ("enrollment", cid))
+            if self._timetable is not None:
+                self._timetable.remove_course(cid)
             return True
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return False
         finally:
-            session.close()
+            self._release(session)
 
     def get_course_schedule_by_id(self, schedule_id: int):
         session = self._get_session()
         try:
-            return (session.query(CourseSchedule)
-                    .options(joinedload(CourseSchedule.course).joinedload(Course.teacher))
-                    .get(schedule_id))
+            if self.orm_results:
+                return (session.query(CourseSchedule)
+                        .options(joinedload(CourseSchedule.course).joinedload(Course.teacher))
+                        .get(schedule_id))
+            r = session.execute(
+                select(CourseSchedule.id, Course.id, Course.name, Teacher.name,
+                       CourseSchedule.day_of_week, CourseSchedule.start_time, CourseSchedule.end_time)
+                .join(Course, CourseSchedule.course_id == Course.id)
+                .join(Teacher, Course.teacher_id == Teacher.id)
+                .where(CourseSchedule.id == int(schedule_id))
+            ).first()
+            return ScheduleDetailRow(*r) if r else None
         finally:
-            session.close()
+            self._release(session)
 
     # ---------- 4) 依日期範圍列出「實際上課 Occurrence」 ----------
-    def get_courses_for_period(self, start_date: date, end_date: date):
-        session = self._get_session()
-        try:
-            schedules = (session.query(CourseSchedule)
-                         .options(joinedload(CourseSchedule.course).joinedload(Course.teacher))
-
-                         .all())
-            day_map = {0: 'MON', 1: 'TUE', 2: 'WED', 3: 'THU', 4: 'FRI', 5: 'SAT', 6: 'SUN'}
-
-            occ = []
-            d = start_date
-            while d <= end_date:
-                day_name = day_map[d.weekday()]
-                for s in schedules:
-                    if s.day_of_week == day_name:
-                        occ.append({
-                            "date": d,
-                            "course_id": s.course.id,
-                            "schedule_id": s.id,
-                            "course_name": s.course.name,
-                            "teacher_name": s.course.teacher.name,
-                            "start_time": s.start_time,
-                            "end_time": s.end_time
-
-                        })
-                d += timedelta(days=1)
-            return sorted(occ, key=lambda x: (x["date"], x["start_time"]))
+    def get_course_occurrences_frame(self, start_date: date, end_date: date,
+                                     teacher_id: int | None = None, course_id: int | None = None):
+        """
+        以欄位化 DataFrame 回傳期間內的上課 Occurrence（欄位見 OCCURRENCE_COLUMNS），
+        可依老師或課程篩選。
+        """
+        if self._calendar_covers(start_date, end_date):
+            session = self._get_session()
+            try:
+                return self._query_session_frame(session, start_date, end_date, teacher_id, course_id)
+            finally:
+                self._release(session)
+        session = self._get_session()
+        try:
+            rows = self._query_schedule_rows(session, teacher_id, course_id)
         finally:
-            session.close()
+            self._release(session)
+        return expand_occurrences(rows, start_date, end_date)
+
+    @staticmethod
+    def _query_schedule_rows(session, teacher_id: int | None = None, course_id: int | None = None):
+        """expand_occurrences 所需的排程資料列。"""
+        q = (select(CourseSchedule.id.label("schedule_id"),
+                    Course.id.label("course_id"),
+                    Course.name.label("course_name"),
+                    Teacher.name.label("teacher_name"),
+                    CourseSchedule.day_of_week,
+                    CourseSchedule.start_time,
+                    CourseSchedule.end_time)
+             .join(Course, CourseSchedule.course_id == Course.id)
+             .join(Teacher, Course.teacher_id == Teacher.id))
+        if teacher_id is not None:
+            q = q.where(Course.teacher_id == int(teacher_id))
+        if course_id is not None:
+            q = q.where(Course.id == int(course_id))
+        return session.execute(q).all()
+
+    def get_courses_for_period(self, start_date: date, end_date: date,
+                               teacher_id: int | None = None, course_id: int | None = None):
+        return occurrence_records(
+            self.get_course_occurrences_frame(start_date, end_date, teacher_id, course_id))
+
+    # ---------- 4.5) 上課日表（course_sessions） ----------
+    @staticmethod
+    def _query_session_frame(session, start_date: date, end_date: date,
+                             teacher_id: int | None = None, course_id: int | None = None):
+        """依 ix_course_sessions_date 範圍掃描，回傳與 expand_occurrences 相同欄位（不含停課）。"""
+        q = (select(CourseSession.date, Course.id, CourseSession.schedule_id, Course.name,
+                    Teacher.name, CourseSession.start_time, CourseSession.end_time)
+             .join(CourseSchedule, CourseSession.schedule_id == CourseSchedule.id)
+             .join(Course, CourseSchedule.course_id == Course.id)
+             .join(Teacher, Course.teacher_id == Teacher.id)
+             .where(CourseSession.date.between(start_date, end_date),
+                    CourseSession.status != 'cancelled'))
+        if teacher_id is not None:
+            q = q.where(Course.teacher_id == int(teacher_id))
+        if course_id is not None:
+            q = q.where(Course.id == int(course_id))
+        rows = session.execute(q.order_by(CourseSession.date, CourseSession.start_time)).all()
+        df = pd.DataFrame(rows, columns=OCCURRENCE_COLUMNS)
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def _generate_sessions(self, session, start_date: date, end_date: date, schedule_id: int | None = None):
+        """以 expand_occurrences 展開排程並 insert-or-ignore 寫入（已存在的日子不變）。"""
+        rows = self._query_schedule_rows(session)
+        if schedule_id is not None:
+            rows = [r for r in rows if r.schedule_id == schedule_id]
+        df = expand_occurrences(rows, start_date, end_date)
+        if df.empty:
+            return 0
+        return insert_ignore(self.engine.dialect.name, session, CourseSession.__table__, [
+            {"schedule_id": int(sid), "date": d, "start_time": st, "end_time": et,
+             "status": "scheduled", "note": None}
+            for d, sid, st, et in zip(df["date"].dt.date, df["schedule_id"], df["start_time"], df["end_time"])],
+            ["schedule_id", "date"])
+
+    def _calendar_covers(self, start_date: date, end_date: date) -> bool:
+        """範圍是否落在已展開的上課日表內（必要時先把滾動區間往後延伸）。"""
+        if not self.session_calendar:
+            return False
+        today = date.today()
+        if self._horizon is None or self._horizon[1] < today + timedelta(days=CALENDAR_HORIZON_DAYS):
+            self.extend_session_calendar()
+        return self._horizon is not None and self._horizon[0] <= start_date and end_date <= self._horizon[1]
+
+    def extend_session_calendar(self, until: date | None = None):
+        """
+        把上課日表展開到 until（預設今天 + CALENDAR_HORIZON_DAYS），只產生尚未展開的日期；
+        首次建立時自本月一日開始。回傳新增的上課日數，失敗回傳 None。
+        """
+        until = until or date.today() + timedelta(days=CALENDAR_HORIZON_DAYS)
+        session = self._get_session()
+        try:
+            horizon = session.get(SessionHorizon, 1)
+            if horizon is None:
+                first = date.today().replace(day=1)
+                horizon = SessionHorizon(id=1, start_date=first, end_date=first - timedelta(days=1))
+                session.add(horizon)
+            added = 0
+            if until > horizon.end_date:
+                added = self._generate_sessions(session, horizon.end_date + timedelta(days=1), until)
+                horizon.end_date = until
+            self._commit(session)
+            self._horizon = (horizon.start_date, horizon.end_date)
+            return added
+        except Exception as e:
+            self._rollback(session)
+            print("展開上課日表失敗：", e)
+            return None
+        finally:
+            self._release(session)
+
+    def cancel_session(self, schedule_id: int, session_date: date, note: str | None = None) -> bool:
+        """停課：把該排程當天標為 cancelled（尚未展開的日期會直接新增一筆停課）。"""
+        session = self._get_session()
+        try:
+            sched = session.get(CourseSchedule, int(schedule_id))
+            if not sched:
+                return False
+            row = session.execute(select(CourseSession).where(
+                CourseSession.schedule_id == sched.id, CourseSession.date == session_date)).scalar_one_or_none()
+            if row is None:
+                row = CourseSession(schedule_id=sched.id, date=session_date,
+                                    start_time=sched.start_time, end_time=sched.end_time)
+                session.add(row)
+            row.status, row.note = 'cancelled', note
+            self._commit(session)
+            return True
+        except Exception:
+            self._rollback(session)
+            return False
+        finally:
+            self._release(session)
+
+    def cancel_sessions_on(self, holiday: date, note: str | None = "國定假日") -> int:
+        """
+        假日：當天所有已排定的課一律停課，回傳停課數。
+        未啟用 session_calendar 時只停已展開的上課日，不替這個實例建立或延伸上課日表。
+        """
+        if self.session_calendar and (self._horizon is None or holiday > self._horizon[1]):
+            self.extend_session_calendar(max(holiday, date.today() + timedelta(days=CALENDAR_HORIZON_DAYS)))
+        session = self._get_session()
+        try:
+            sessions = CourseSession.__table__
+            res = session.execute(
+                sessions.update()
+                .where(sessions.c.date == holiday, sessions.c.status != 'cancelled')
+                .values(status='cancelled', note=note))
+            self._commit(session)
+            return res.rowcount
+        except Exception:
+            self._rollback(session)
+            return 0
+        finally:
+            self._release(session)
+
+    def add_makeup_session(self, schedule_id: int, session_date: date,
+                           start_time_str: str | None = None, note: str | None = None):
+        """
+        補課：為排程新增一天（時間預設同排程），點名時沿用該排程 id。
+        當天已有該排程的上課日時回傳 None。
+        """
+        session = self._get_session()
+        try:
+            sched = session.get(CourseSchedule, int(schedule_id))
+            if not sched:
+                return None
+            start_time, end_time = sched.start_time, sched.end_time
+            if start_time_str:
+                start_time = datetime.strptime(start_time_str, "%H:%M").time()
+                end_time = (datetime.combine(date.min, start_time)
+                            + timedelta(minutes=sched.course.duration_minutes)).time()
+            obj = CourseSession(schedule_id=sched.id, date=session_date, start_time=start_time,
+                                end_time=end_time, status='makeup', note=note)
+            session.add(obj)
+            self._commit(session)
+            return obj
+        except Exception:
+            self._rollback(session)
+            return None
+        finally:
+            self._release(session)
 
     # ---------- 5) 報名名單 ----------
     def get_students_for_course(self, course_id: int):
+        cid = int(course_id)
+        return self.cache.get_or_load(("enrollment", cid, True),
+                                      lambda: self._load_students_for_course(cid))
+
+    def _load_students_for_course(self, course_id: int):
         session = self._get_session()
         try:
             cid = int(course_id)
-            q = (session.query(Student)
-                 .join(student_course_association, Student.id == student_course_association.c.student_id)
-                 .filter(student_course_association.c.course_id == cid)
-                 .order_by(Student.name))
-            return q.all()
+            if self.orm_results:
+                q = (session.query(Student)
+                     .join(student_course_association, Student.id == student_course_association.c.student_id)
+                     .filter(student_course_association.c.course_id == cid)
+                     .order_by(Student.name))
+                return q.all()
+            return self._query_students_for_course(session, cid)
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _query_students_for_course(session, course_id: int):
+        return [StudentRow(*r) for r in session.execute(
+            select(*columns_for(Student, StudentRow))
+            .join(student_course_association, Student.id == student_course_association.c.student_id)
+            .where(student_course_association.c.course_id == int(course_id))
+            .order_by(Student.name))]
 
     def get_students_not_in_course(self, course_id: int):
+        cid = int(course_id)
+        return self.cache.get_or_load(("enrollment", cid, False),
+                                      lambda: self._load_students_not_in_course(cid))
+
+    def _load_students_not_in_course(self, course_id: int):
         session = self._get_session()
         try:
             cid = int(course_id)
-            rows = (session.query(student_course_association.c.student_id)
-                    .filter(student_course_association.c.course_id == cid).all())
-            enrolled_ids = [r[0] for r in rows]
-            q = session.query(Student).order_by(Student.name)
-            if enrolled_ids:
-                q = q.filter(~Student.id.in_(enrolled_ids))
-            return q.all()     # 沒人報名 => 全體學生皆屬「未報名」
+            enrolled = (select(student_course_association.c.student_id)
+                        .where(student_course_association.c.course_id == cid))
+            if self.orm_results:
+                return (session.query(Student).filter(~Student.id.in_(enrolled))
+                        .order_by(Student.name).all())
+            # 沒人報名 => 全體學生皆屬「未報名」
+            return [StudentRow(*r) for r in session.execute(
+                select(*columns_for(Student, StudentRow))
+                .where(~Student.id.in_(enrolled))
+                .order_by(Student.name))]
         finally:
-            session.close()
+            self._release(session)
 
-    def update_course_enrollments(self, course_id: int, student_ids: list[int]) -> bool:
+    def update_course_enrollments(self, course_id: int, student_ids: list[int]):
+        """
+        只套用差異：與現有報名名單比對後，刪除退選者、新增加選者（同一交易）。
+        成功回傳 {"added": n, "removed": n, "unchanged": n}；
+        加選學生同一時段已有其他課程時不做任何異動，回傳 {"conflicts": [scheduling.Conflict, ...]}；
+        課程不存在或寫入失敗時回傳 None。
+        """
         session = self._get_session()
         try:
             cid = int(course_id)
-            if not session.query(Course).get(cid):
-                return False
-            # 先清空
-            session.execute(
-                student_course_association.delete()
-                .where(student_course_association.c.course_id == cid)
-            )
-            # 再新增
-            to_add = list({int(sid) for sid in (student_ids or [])})
-            if to_add:
-                session.execute(
-                    student_course_association.insert(),
-                    [{"student_id": sid, "course_id": cid} for sid in to_add]
-                )
-            session.commit()
-            return True
+            applied = self._apply_enrollments(session, cid, student_ids)
+            if applied is None:
+                return None
+            result, added, removed = applied
+            if "conflicts" in result:
+                return result
+            self._commit(session)
+            if added or removed:
+                self.cache.invalidate(("enrollment", cid))
+                if self._timetable is not None:
+                    self._timetable.enroll(cid, added)
+                    self._timetable.unenroll(cid, removed)
+            return result
         except Exception as e:
-            session.rollback()
+            self._rollback(session)
             print("更新報名名單失敗：", e)
-            return False
+            return None
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _apply_enrollments(session, course_id: int, student_ids):
+        """
+        計算並套用報名差異（不 commit）；回傳 (結果, 加選 id, 退選 id)。
+        加選的學生與自己其他課程的時段重疊時不做任何異動，結果為 {"conflicts": [...]}；
+        課程不存在時回傳 None。
+        """
+        cid = int(course_id)
+        if not session.get(Course, cid):
+            return None
+        assoc = student_course_association
+        current = set(session.execute(
+            select(assoc.c.student_id).where(assoc.c.course_id == cid)
+        ).scalars())
+        wanted = {int(sid) for sid in (student_ids or [])}
+
+        to_remove = current - wanted
+        to_add = wanted - current
+        if to_add:
+            # 忽略已不存在的學生，避免留下孤兒關聯
+            to_add = set(session.execute(
+                select(Student.id).where(Student.id.in_(to_add))
+            ).scalars())
+        if to_add:
+            conflicts = AttendanceService._enrollment_conflicts(session, cid, to_add)
+            if conflicts:
+                return {"conflicts": conflicts}, set(), set()
+
+        if to_remove:
+            session.execute(
+                assoc.delete()
+                .where(assoc.c.course_id == cid, assoc.c.student_id.in_(to_remove))
+            )
+        if to_add:
+            session.execute(
+                assoc.insert(),
+                [{"student_id": sid, "course_id": cid} for sid in sorted(to_add)]
+            )
+        return ({"added": len(to_add), "removed": len(to_remove),
+                 "unchanged": len(current & wanted)}, to_add, to_remove)
+
+    @staticmethod
+    def _enrollment_conflicts(session, course_id: int, student_ids):
+        """加選學生的既有課程中，與 course_id 同一天且時段重疊的排程（scheduling.Conflict 清單）。"""
+        new, other = CourseSchedule.__table__.alias("new"), CourseSchedule.__table__.alias("other")
+        assoc = student_course_association
+        rows = session.execute(
+            select(assoc.c.student_id, new.c.day_of_week, new.c.id, new.c.course_id,
+                   other.c.id, other.c.course_id, other.c.start_time, other.c.end_time)
+            .join(other, other.c.course_id == assoc.c.course_id)
+            .join(new, and_(new.c.course_id == course_id,
+                            new.c.day_of_week == other.c.day_of_week,
+                            new.c.start_time < other.c.end_time,
+                            other.c.start_time < new.c.end_time))
+            .where(assoc.c.student_id.in_(student_ids), assoc.c.course_id != course_id)
+            .order_by(assoc.c.student_id, new.c.id, other.c.id)
+        ).all()
+        return [Conflict("student", *row) for row in rows]
+
+    # ---------- 5.5) 排課衝突 ----------
+    def _get_timetable(self):
+        """取得排課衝突索引；尚未建立時以三條查詢一次載入。"""
+        with self._timetable_lock:
+            if self._timetable is None:
+                session = self._get_session()
+                try:
+                    self._timetable = TimetableIndex.build(
+                        session.execute(select(Course.id, Course.teacher_id)).all(),
+                        session.execute(select(*columns_for(CourseSchedule, ScheduleRow))).all(),
+                        session.execute(select(student_course_association.c.student_id,
+                                               student_course_association.c.course_id)).all())
+                finally:
+                    self._release(session)
+            return self._timetable
+
+    def find_schedule_conflicts(self, course_id: int, day_of_week: str, start_time_str: str):
+        """
+        預先檢查新增排程是否與老師或已報名學生的既有排程重疊，
+        回傳 scheduling.Conflict 清單（空清單表示可排）；課程不存在回傳 None。
+        """
+        session = self._get_session()
+        try:
+            course = session.get(Course, int(course_id))
+            if not course:
+                return None
+            start_time = datetime.strptime(start_time_str, "%H:%M").time()
+            end_time = (datetime.combine(date.min, start_time)
+                        + timedelta(minutes=course.duration_minutes)).time()
+        finally:
+            self._release(session)
+        return self._get_timetable().conflicts_for(int(course_id), day_of_week.upper(), start_time, end_time)
+
+    def check_timetable(self):
+        """整學期（每週課表）的衝突清單，供排課完成後一次檢查。"""
+        return self._get_timetable().check_all()
 
     # ---------- 6) 點名 ----------
     def take_attendance(self, course_schedule_id: int, attendance_date: date, student_statuses: dict[int, str]):
+        """
+        以集合查詢一次完成整班點名。
+        回傳 {student_id: 結果}，結果為 ATTENDANCE_OUTCOMES 之一；排程不存在或寫入失敗時回傳 None。
+        """
         session = self._get_session()
         try:
-            schedule = session.query(CourseSchedule).get(course_schedule_id)
-            if not schedule:
-                return False
+            outcomes = self._record_attendance(session, course_schedule_id, attendance_date, student_statuses)
+            if outcomes is None:
+                return None
+            self._commit(session)
+            if outcomes:
+                self.cache.invalidate(("students",), ("enrollment",))
+            return outcomes
+        except Exception:
+            self._rollback(session)
+            return None
+        finally:
+            self._release(session)
 
-            for sid, status in (student_statuses or {}).items():
-                stu = session.query(Student).get(sid)
-                if not stu:
-                    continue
-
-                exists = (session.query(AttendanceRecord)
-                          .filter_by(student_id=sid,
-                                     course_schedule_id=course_schedule_id,
-                                     date=attendance_date)
-                          .first())
-                if exists:
-                    continue
-
-                deducted = False
-                if status in ("有到", "遲到"):
-                    if stu.remaining_classes > 0:
-                        stu.remaining_classes -= 1
-                        deducted = True
-
-                rec = AttendanceRecord(
-                    student_id=sid, course_schedule_id=course_schedule_id,
-                    date=attendance_date, status=status, class_deducted=deducted
-                )
-                session.add(rec)
+    def take_attendance_batch(self, entries, atomic: bool = True):
+        """
+        一次提交多堂點名（連堂、或離線平板同步一整天的點名），整批共用一個交易。
+        entries 為 [(schedule_id, date, {student_id: 狀態})]，回傳與 entries 對齊的 list，
+        每項同 take_attendance 的 {student_id: 結果}。
+        atomic=True：全部成功才寫入；任一堂排程不存在或寫入失敗即整批取消並回傳 None。
+        atomic=False：盡力而為，失敗的堂次結果為 None，其餘照常寫入。
+        """
+        session = self._get_session()
+        try:
+            results = self._apply_attendance_batch(session, list(entries or ()), atomic)
+            if results is None:
+                self._rollback(session)
+                return None
+            self._commit(session)
+            if any(results):
+                self.cache.invalidate(("students",), ("enrollment",))
+            return results
+        except Exception:
+            self._rollback(session)
+            return None
+        finally:
+            self._release(session)
 
-            session.commit()
+    @classmethod
+    def _apply_attendance_batch(cls, session, entries, atomic: bool):
+        """take_attendance_batch 的 session 層級實作（不 commit）；atomic 且有無效堂次時不寫入任何資料並回傳 None。"""
+        if atomic:
+            return cls._record_attendance_batch(session, entries, reject_unknown=True)
+        try:
+            # 先整批套用；有任何一堂出錯時退回 savepoint，改為逐堂各自套用
+            with session.begin_nested():
+                return cls._record_attendance_batch(session, entries)
+        except Exception:
+            results = []
+            for entry in entries:
+                try:
+                    with session.begin_nested():
+                        results.append(cls._record_attendance_batch(session, [entry])[0])
+                except Exception:
+                    results.append(None)
+            return results
+
+    @classmethod
+    def _record_attendance(cls, session, course_schedule_id: int, attendance_date: date,
+                           student_statuses: dict[int, str]):
+        """take_attendance 的 session 層級實作（不 commit）；排程不存在回傳 None。"""
+        return cls._record_attendance_batch(session, [(course_schedule_id, attendance_date, student_statuses)])[0]
+
+    @classmethod
+    def _record_attendance_batch(cls, session, entries, reject_unknown: bool = False):
+        """
+        以集合查詢一次驗證並寫入多堂點名（不 commit）。
+        回傳與 entries 對齊的 list；排程不存在的堂次為 None（reject_unknown 時不寫入並直接回傳 None）。
+        """
+        entries = [(int(sched_id), d, {int(sid): status for sid, status in (statuses or {}).items()})
+                   for sched_id, d, statuses in entries]
+        if not entries:
+            return []
+        schedule_ids = {e[0] for e in entries}
+        dates = {e[1] for e in entries}
+        student_ids = set().union(*(e[2] for e in entries))
+
+        # 1) 一次確認排程與學生是否存在
+        known_schedules = set(session.execute(
+            select(CourseSchedule.id).where(CourseSchedule.id.in_(schedule_ids))
+        ).scalars())
+        if reject_unknown and known_schedules != schedule_ids:
+            return None
+        known = set(session.execute(
+            select(Student.id).where(Student.id.in_(student_ids))
+        ).scalars()) if student_ids else set()
+        # 2) 一次找出已點過名的 (排程, 日期, 學生)
+        existing = cls._attendance_keys(session, schedule_ids, dates, student_ids)
+
+        results, new_rows, wants_deduct = [], [], {}
+        for sched_id, d, statuses in entries:
+            if sched_id not in known_schedules:
+                results.append(None)
+                continue
+            outcomes = {}
+            for sid, status in statuses.items():
+                key = (sched_id, d, sid)
+                if sid not in known:
+                    outcomes[sid] = "unknown"
+                elif key in existing:
+                    outcomes[sid] = "duplicate"
+                else:
+                    existing[key] = None     # 同一批內重複的點名也視為 duplicate
+                    outcomes[sid] = "inserted"
+                    new_rows.append({"student_id": sid, "course_schedule_id": sched_id, "date": d,
+                                     "status": status, "class_deducted": False})
+                    if status in DEDUCTING_STATUSES:
+                        wants_deduct.setdefault(sid, []).append((new_rows[-1], outcomes))
+            results.append(outcomes)
+
+        # 3) 扣堂：每輪一條條件式 UPDATE（剩餘 > 0 才扣），同一學生在批次中有幾堂就最多扣幾輪
+        pending = wants_deduct
+        while pending:
+            deducted = cls._deduct_one_class(session, list(pending))
+            remaining = {}
+            for sid, items in pending.items():
+                (row, outcomes), rest = items[0], items[1:]
+                if sid in deducted:
+                    row["class_deducted"] = True
+                    if rest:
+                        remaining[sid] = rest
+                else:
+                    for _, out in items:
+                        out[sid] = "not_deducted"
+            pending = remaining
+
+        # 4) executemany 一次寫入所有新點名記錄
+        if new_rows:
+            session.execute(AttendanceRecord.__table__.insert(), new_rows)
+
+        # 5) 扣堂寫入帳本，並關聯到對應的點名記錄
+        charged = [r for r in new_rows if r["class_deducted"]]
+        if charged:
+            record_ids = cls._attendance_keys(
+                session, {r["course_schedule_id"] for r in charged}, {r["date"] for r in charged},
+                {r["student_id"] for r in charged})
+            cls._write_ledger(session, [
+                {"student_id": r["student_id"], "kind": "deduction", "amount": -1,
+                 "attendance_record_id": record_ids[(r["course_schedule_id"], r["date"], r["student_id"])]}
+                for r in charged])
+        return results
+
+    @staticmethod
+    def _attendance_keys(session, schedule_ids, dates, student_ids):
+        """{(排程, 日期, 學生): 記錄 id}；以三個 IN 條件查詢，涵蓋整批的所有組合。"""
+        if not (schedule_ids and dates and student_ids):
+            return {}
+        return {(sched_id, d, sid): rid for sched_id, d, sid, rid in session.execute(
+            select(AttendanceRecord.course_schedule_id, AttendanceRecord.date,
+                   AttendanceRecord.student_id, AttendanceRecord.id)
+            .where(AttendanceRecord.course_schedule_id.in_(schedule_ids),
+                   AttendanceRecord.date.in_(dates),
+                   AttendanceRecord.student_id.in_(student_ids)))}
+
+    # ---------- 6.5) 堂數帳本 ----------
+    @staticmethod
+    def _write_ledger(session, entries):
+        if entries:
+            now = datetime.now()
+            session.execute(ClassLedgerEntry.__table__.insert(), [
+                {"attendance_record_id": None, "note": None, "created_at": now, **e} for e in entries])
+
+    @staticmethod
+    def _deduct_one_class(session, student_ids):
+        """UPDATE ... SET remaining = remaining - 1 WHERE remaining > 0；回傳實際被扣堂的學生 id。"""
+        if not student_ids:
+            return set()
+        students = Student.__table__
+        cond = (students.c.id.in_(student_ids), students.c.remaining_classes > 0)
+        stmt = students.update().where(*cond).values(remaining_classes=students.c.remaining_classes - 1)
+        if session.get_bind().dialect.update_returning:
+            return set(session.execute(stmt.returning(students.c.id)).scalars())
+        # 不支援 RETURNING 的資料庫：同一交易內先鎖定符合條件的列再更新
+        eligible = set(session.execute(select(students.c.id).where(*cond).with_for_update()).scalars())
+        if eligible:
+            session.execute(stmt.where(students.c.id.in_(eligible)))
+        return eligible
+
+    def refund_attendance(self, attendance_record_id: int, note: str | None = None) -> bool:
+        """撤銷某筆點名的扣堂：退還一堂並寫入 refund 帳目。"""
+        session = self._get_session()
+        try:
+            rid = int(attendance_record_id)
+            records = AttendanceRecord.__table__
+            # 條件式 UPDATE：同一筆記錄只會被退還一次
+            res = session.execute(
+                records.update()
+                .where(records.c.id == rid, records.c.class_deducted.is_(True))
+                .values(class_deducted=False))
+            if not res.rowcount:
+                self._rollback(session)
+                return False
+            sid = session.execute(select(records.c.student_id).where(records.c.id == rid)).scalar_one()
+            students = Student.__table__
+            session.execute(students.update().where(students.c.id == sid)
+                            .values(remaining_classes=students.c.remaining_classes + 1))
+            self._write_ledger(session, [{"student_id": sid, "kind": "refund", "amount": 1,
+                                          "attendance_record_id": int(attendance_record_id),
+                                          "note": note}])
+            self._commit(session)
+            self.cache.invalidate(("students",), ("enrollment",))
             return True
         except Exception:
-            session.rollback()
+            self._rollback(session)
             return False
         finally:
-            session.close()
+            self._release(session)
+
+    def get_student_ledger(self, student_id: int):
+        session = self._get_session()
+        try:
+            return [LedgerRow(*r) for r in session.execute(
+                select(*columns_for(ClassLedgerEntry, LedgerRow))
+                .where(ClassLedgerEntry.student_id == int(student_id))
+                .order_by(ClassLedgerEntry.id))]
+        finally:
+            self._release(session)
+
+    def reconcile_balances(self) -> int:
+        """
+        以帳本一次重算所有學生的剩餘堂數（單一 set-based UPDATE），
+        回傳被修正的學生數。
+        """
+        students = Student.__table__
+        ledger = ClassLedgerEntry.__table__
+        total = (select(func.coalesce(func.sum(ledger.c.amount), 0))
+                 .where(ledger.c.student_id == students.c.id)
+                 .scalar_subquery())
+        with self.engine.begin() as conn:
+            res = conn.execute(
+                students.update()
+                .where(func.coalesce(students.c.remaining_classes, 0) != total)
+                .values(remaining_classes=total))
+        self.cache.invalidate(("students",), ("enrollment",))
+        return res.rowcount
 
     # ---------- 7) 查詢 / 報表 ----------
     def get_student_attendance(self, student_identifier):
         session = self._get_session()
         try:
             if isinstance(student_identifier, int):
-                stu = session.query(Student).get(student_identifier)
+                cond = Student.id == student_identifier
             else:
-                stu = (session.query(Student)
-                       .filter(func.lower(Student.name) == func.lower(student_identifier))
-                       .first())
+                cond = Student.id == self._student_id_by_name(session, student_identifier, self._fts)
+
+            if self.orm_results:
+                stu = session.query(Student).filter(cond).first()
+                if not stu:
+                    return None, []
+                records = (session.query(AttendanceRecord)
+                           .options(joinedload(AttendanceRecord.course_schedule)
+                                    .joinedload(CourseSchedule.course))
+                           .filter(AttendanceRecord.student_id == stu.id)
+                           .order_by(AttendanceRecord.date.desc())
+                           .all())
+                return stu, records
+
+            stu = self._student_row(session, cond)
             if not stu:
                 return None, []
-
-            records = (session.query(AttendanceRecord)
-                       .options(joinedload(AttendanceRecord.course_schedule)
-                                .joinedload(CourseSchedule.course))
-                       .filter(AttendanceRecord.student_id == stu.id)
-                       .order_by(AttendanceRecord.date.desc())
-                       .all())
+            records = [AttendanceRow(*r) for r in session.execute(
+                select(AttendanceRecord.id, AttendanceRecord.date, AttendanceRecord.student_id,
+                       AttendanceRecord.course_schedule_id, Course.id, Course.name,
+                       AttendanceRecord.status, AttendanceRecord.class_deducted)
+                .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
+                .join(Course, CourseSchedule.course_id == Course.id)
+                .where(AttendanceRecord.student_id == stu.id)
+                .order_by(AttendanceRecord.date.desc()))]
             return stu, records
         finally:
-            session.close()
+            self._release(session)
+
+    @staticmethod
+    def _student_id_by_name(session, name: str, use_fts: bool = False):
+        """姓名（不分大小寫）-> 學生 id：先以唯一索引精確比對，找不到再經全文索引比對候選者。"""
+        sid = session.scalar(select(Student.id).where(Student.name == name))
+        if sid is not None:
+            return sid
+        for row in search_students(session, name, limit=5, fuzzy=False, use_fts=use_fts):
+            if row.name.lower() == name.strip().lower():
+                return row.id
+        return None
+
+    def _monthly_report_query(self, year: int, month: int):
+        return self._attendance_report_query(*month_bounds(year, month))
+
+    def _attendance_report_query(self, start_date: date, end_date: date,
+                                 course_id: int | None = None, teacher_id: int | None = None):
+        """月報表欄位的五表 join，可指定任意日期範圍並依課程 / 老師篩選。"""
+        stmt = (select(
+                    AttendanceRecord.date,
+                    Student.name.label('student_name'),
+                    Course.name.label('course_name'),
+                    CourseSchedule.start_time.label('start_time'),
+                    CourseSchedule.end_time.label('end_time'),
+                    Teacher.name.label('teacher_name'),
+                    AttendanceRecord.status,
+                    Student.remaining_classes.label('remaining_classes')
+                )
+                .join(Student, AttendanceRecord.student_id == Student.id)
+                .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
+                .join(Course, CourseSchedule.course_id == Course.id)
+                .join(Teacher, Course.teacher_id == Teacher.id)
+                .where(AttendanceRecord.date.between(start_date, end_date))
+                .order_by(AttendanceRecord.date, Student.name))
+        if course_id is not None:
+            stmt = stmt.where(Course.id == int(course_id))
+        if teacher_id is not None:
+            stmt = stmt.where(Course.teacher_id == int(teacher_id))
+        return stmt
 
     def get_monthly_attendance_report(self, year: int, month: int):
         session = self._get_session()
         try:
-            start_date = date(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            rows = (session.query(
-                        AttendanceRecord.date,
-                        Student.name.label('student_name'),
-                        Course.name.label('course_name'),
-                        CourseSchedule.start_time.label('start_time'),
-                        CourseSchedule.end_time.label('end_time'),
-                        Teacher.name.label('teacher_name'),
-                        AttendanceRecord.status
-                    )
-                    .join(Student, AttendanceRecord.student_id == Student.id)
-                    .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
-                    .join(Course, CourseSchedule.course_id == Course.id)
-                    .join(Teacher, Course.teacher_id == Teacher.id)
-
-                    .filter(AttendanceRecord.date.between(start_date, end_date))
-                    .order_by(AttendanceRecord.date, Student.name)
-                    .all())
-            return rows
+            return session.execute(self._month_report_statement(session, year, month)).all()
         finally:
-            session.close()
+            self._release(session)
 
-    def export_report_to_excel(self, records, year: int, month: int):
-        if not records:
+    def iter_monthly_attendance_report(self, year: int, month: int, chunk_size: int = REPORT_CHUNK_SIZE):
+        """逐批（每批 chunk_size 筆）產出月報表資料列，不一次載入整個月份。"""
+        session = self._get_session()
+        try:
+            result = session.execute(
+                self._month_report_statement(session, year, month).execution_options(yield_per=chunk_size)
+            )
+            for chunk in result.partitions():
+                yield chunk
+        finally:
+            self._release(session)
+
+    def iter_attendance_report(self, start_date: date, end_date: date, course_id: int | None = None,
+                               teacher_id: int | None = None, chunk_size: int = REPORT_CHUNK_SIZE):
+        """任意日期範圍（可依課程 / 老師篩選）的報表資料列，逐批產出（即時查詢，不經月報表快取）。"""
+        session = self._get_session()
+        try:
+            result = session.execute(
+                self._attendance_report_query(start_date, end_date, course_id, teacher_id)
+                .execution_options(yield_per=chunk_size))
+            for chunk in result.partitions():
+                yield chunk
+        finally:
+            self._release(session)
+
+    # ---------- 7.5) 月報表快取 ----------
+    def _month_report_statement(self, session, year: int, month: int):
+        """快取仍是最新時讀快取，否則即時查詢（同一交易內判斷與讀取，看到的是同一份資料）。"""
+        if self.report_cache and self._report_cache_fresh(session, year, month):
+            return self._cached_report_query(year, month)
+        return self._monthly_report_query(year, month)
+
+    @staticmethod
+    def _report_cache_fresh(session, year: int, month: int) -> bool:
+        version = func.coalesce(
+            select(ReportMonthVersion.version)
+            .where(ReportMonthVersion.month == report_month_key(year, month))
+            .scalar_subquery(), 0)
+        return session.execute(
+            select(MonthlyReportState.year)
+            .where(MonthlyReportState.year == year, MonthlyReportState.month == month,
+                   MonthlyReportState.version == version)
+        ).first() is not None
+
+    @staticmethod
+    def _cached_report_query(year: int, month: int):
+        """快取的報表列，剩餘堂數 join 學生目前的餘額；欄位與 _monthly_report_query 相同。"""
+        rows = MonthlyReportRow
+        return (select(
+                    rows.date, rows.student_name, rows.course_name, rows.start_time, rows.end_time,
+                    rows.teacher_name, rows.status,
+                    Student.remaining_classes.label('remaining_classes'))
+                .outerjoin(Student, rows.student_id == Student.id)
+                .where(rows.year == year, rows.month == month)
+                .order_by(rows.seq))
+
+    def _monthly_report_source(self, year: int, month: int):
+        """寫入快取用的五表 join（以 student_id 取代剩餘堂數），seq 為報表順序。"""
+        start_date, end_date = month_bounds(year, month)
+        order = (AttendanceRecord.date, Student.name)
+        return (select(
+                    literal(year), literal(month), func.row_number().over(order_by=order),
+                    AttendanceRecord.date, AttendanceRecord.student_id, Student.name, Course.name,
+                    CourseSchedule.start_time, CourseSchedule.end_time, Teacher.name,
+                    AttendanceRecord.status)
+                .join(Student, AttendanceRecord.student_id == Student.id)
+                .join(CourseSchedule, AttendanceRecord.course_schedule_id == CourseSchedule.id)
+                .join(Course, CourseSchedule.course_id == Course.id)
+                .join(Teacher, Course.teacher_id == Teacher.id)
+                .where(AttendanceRecord.date.between(start_date, end_date))
+                .order_by(*order))
+
+    def _refresh_month_report(self, session, year: int, month: int, force: bool = False) -> bool:
+        """
+        版本與快取不同（或 force）時重建該月快取，回傳是否有重建。
+        以一條 INSERT ... SELECT 在資料庫內寫入，資料列不經過 Python。
+        """
+        version = report_month_version(session.connection(), year, month)
+        state = session.get(MonthlyReportState, (year, month))
+        if not force and state is not None and state.version == version:
+            return False
+
+        rows = MonthlyReportRow.__table__
+        session.execute(rows.delete().where(rows.c.year == year, rows.c.month == month))
+        session.execute(rows.insert().from_select(
+            ['year', 'month', 'seq', 'date', 'student_id', 'student_name', 'course_name',
+             'start_time', 'end_time', 'teacher_name', 'status'],
+            self._monthly_report_source(year, month)))
+        if state is None:
+            state = MonthlyReportState(year=year, month=month)
+            session.add(state)
+        state.version = version
+        state.built_at = datetime.now()
+        return True
+
+    def warm_report_cache(self, start_date: date, end_date: date, force: bool = False):
+        """
+        建立範圍內各月份的報表快取（只由此方法與 admin.py report-cache warm 寫入）；
+        force=True 時不論版本一律重建。
+        回傳 {"rebuilt": 重建月份數, "fresh": 已是最新的月份數}，
+        失敗或資料庫沒有報表版本觸發器（非 SQLite）時回傳 None。
+        """
+        session = self._get_session()
+        try:
+            if not report_versions_installed(session.connection()):
+                print("此資料庫沒有報表版本觸發器，無法建立月報表快取。")
+                return None
+            rebuilt = fresh = 0
+            for year, month in months_between(start_date, end_date):
+                if self._refresh_month_report(session, year, month, force=force):
+                    rebuilt += 1
+                else:
+                    fresh += 1
+            self._commit(session)
+            return {"rebuilt": rebuilt, "fresh": fresh}
+        except Exception as e:
+            self._rollback(session)
+            print("建立月報表快取失敗：", e)
             return None
+        finally:
+            self._release(session)
 
-        # Convert records to list of dict including remaining classes and time
-        data = [{"日期": r.date, "學生姓名": r.student_name, "課程名稱": r.course_name,
-                 "上課時間": f"{r.start_time.strftime('%H:%M')}-{r.end_time.strftime('%H:%M')}", "授課老師": r.teacher_name, "出勤狀態": r.status, "剩餘堂數": self.get_student_remaining_classes(r.student_name)} for r in records]
-        df = pd.DataFrame(data)
+    def invalidate_report_cache(self, start_date: date | None = None, end_date: date | None = None) -> int:
+        """
+        清除範圍內（未指定則全部）月份的報表快取，回傳清除的月份數。
+        快取過期時讀取會自動改走即時查詢；此方法只是釋放空間。
+        """
+        # 以 year * 100 + month 比較月份範圍
+        lo = start_date.year * 100 + start_date.month if start_date else 0
+        hi = end_date.year * 100 + end_date.month if end_date else 999999
+        states, rows = MonthlyReportState.__table__, MonthlyReportRow.__table__
+        session = self._get_session()
+        try:
+            session.execute(rows.delete().where((rows.c.year * 100 + rows.c.month).between(lo, hi)))
+            n = session.execute(
+                states.delete().where((states.c.year * 100 + states.c.month).between(lo, hi))).rowcount
+            self._commit(session)
+            return n
+        except Exception as e:
+            self._rollback(session)
+            print("清除月報表快取失敗：", e)
+            return 0
+        finally:
+            self._release(session)
 
-        reports_dir = BASE_DIR / "reports"
-        reports_dir.mkdir(exist_ok=True)
-        out = reports_dir / f"attendance_report_{year}_{month:02d}.xlsx" 
+    def has_attendance_in_month(self, year: int, month: int) -> bool:
+        start_date, end_date = month_bounds(year, month)
+        session = self._get_session()
         try:
-            df.to_excel(out, index=False, engine="openpyxl")
+            return session.execute(
+                select(AttendanceRecord.id)
+                .where(AttendanceRecord.date.between(start_date, end_date))
+                .limit(1)
+            ).first() is not None
+        finally:
+            self._release(session)
+
+    def export_report_to_excel(self, records, year: int, month: int, filename: str | None = None):
+        """
+        以 openpyxl write-only 模式逐列寫入，records 可為任意可迭代的資料列
+        （含 remaining_classes 欄位），記憶體用量不隨資料量成長。
+        filename 省略時為 attendance_report_<年>_<月>.xlsx。
+        """
+        rows = iter(records or ())
+        first = next(rows, None)
+        if first is None:
+            return None
+
+        self.reports_dir.mkdir(parents=True, exist_ok=True)
+        out = self.reports_dir / (filename or f"attendance_report_{year}_{month:02d}.xlsx")
+        try:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Sheet1")
+            ws.append(REPORT_HEADERS)
+            for r in chain((first,), rows):
+                ws.append([r.date, r.student_name, r.course_name,
+                           f"{r.start_time.strftime('%H:%M')}-{r.end_time.strftime('%H:%M')}",
+                           r.teacher_name, r.status, r.remaining_classes])
+            wb.save(out)
             return str(out.resolve())
         except Exception:
             return None
 
+    def export_monthly_report(self, year: int, month: int, chunk_size: int = REPORT_CHUNK_SIZE):
+        """直接由資料庫分批串流匯出月報表。"""
+        rows = chain.from_iterable(self.iter_monthly_attendance_report(year, month, chunk_size))
+        return self.export_report_to_excel(rows, year, month)
+
     def get_student_remaining_classes(self, student_name: str) -> int:
         """
         Helper function to get the remaining classes for a student.
@@ -409,4 +1595,4 @@ class AttendanceService:
             student = session.query(Student).filter(Student.name == student_name).first()
             return student.remaining_classes if student else 0
         finally:
-            session.close()
+            self._release(session)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+import pytest
+
+from conftest import MONDAY
+from analytics import AttendanceAnalytics, SUMMARY_COLUMNS
+
+
+def test_summary_by_student_counts_statuses_and_rate(service, school):
+    a, b, c = school["students"]
+    service.take_attendance(school["schedule"], MONDAY, {a: "有到", b: "遲到", c: "曠課"})
+    service.take_attendance(school["schedule"], MONDAY + timedelta(days=7), {a: "有到", b: "曠課", c: "曠課"})
+    df = AttendanceAnalytics(service).by_student().set_index("student_id")
+    assert df.loc[a, ["sessions", "present", "late", "absent", "deducted"]].tolist() == [2, 2, 0, 0, 2]
+    assert df.loc[b, "attendance_rate"] == 0.5
+    assert df.loc[c, "attendance_rate"] == 0.0
+
+
+def test_summary_groups_by_month_and_course_with_filters(service, school):
+    a = school["students"][0]
+    for w in range(5):          # 1 月 6、13、20、27 日與 2 月 3 日
+        service.take_attendance(school["schedule"], MONDAY + timedelta(days=7 * w), {a: "有到"})
+    df = AttendanceAnalytics(service).yearly_dashboard(2025)
+    assert df[["month", "course_name", "sessions"]].values.tolist() == [["2025-01", "鋼琴", 4], ["2025-02", "鋼琴", 1]]
+    only_feb = AttendanceAnalytics(service).by_month(start_date=MONDAY + timedelta(days=20), student_id=a)
+    assert only_feb["sessions"].tolist() == [1, 1]
+
+
+def test_summary_without_data_returns_empty_frame_with_columns(service, school):
+    df = AttendanceAnalytics(service).by_teacher(teacher_id=school["teacher"])
+    assert df.empty and list(df.columns) == ["teacher_id", "teacher_name"] + SUMMARY_COLUMNS
+
+
+def test_summary_rejects_unknown_dimension(service):
+    with pytest.raises(ValueError):
+        AttendanceAnalytics(service).summary("room")
@@ -0,0 +1,89 @@
+import json
+from datetime import date
+
+import pytest
+from openpyxl import load_workbook
+
+import batch_reports
+from batch_reports import main, plan_jobs, run_batch
+from conftest import MONDAY
+from services import AttendanceService, month_bounds
+
+FEB = MONDAY.replace(month=2, day=3)
+
+
+@pytest.fixture
+def attended(service, school):
+    service.take_attendance(school["schedule"], MONDAY, {sid: "有到" for sid in school["students"]})
+    service.take_attendance(school["schedule"], FEB, {school["students"][0]: "遲到"})
+    return school
+
+
+@pytest.fixture
+def worker_service(db_url, tmp_path, attended, monkeypatch):
+    """在測試行程內模擬工作行程：_init_worker 建立的唯讀服務。"""
+    batch_reports._init_worker(db_url, "readonly", tmp_path / "batch")
+    yield batch_reports._service
+    batch_reports._service.dispose()
+    monkeypatch.setattr(batch_reports, "_service", None)
+
+
+def test_plan_jobs_lists_months_and_all_courses(service, attended):
+    months = plan_jobs(service, "months", MONDAY, date(2025, 3, 31))
+    assert [key for _, key, _, _ in months] == [(2025, 1), (2025, 2), (2025, 3)]
+    assert months[1][2:] == month_bounds(2025, 2)
+    assert plan_jobs(service, "courses", MONDAY, FEB) == [("course", attended["course"], MONDAY, FEB)]
+    assert plan_jobs(service, "teachers", MONDAY, FEB, ids=["7"]) == [("teacher", 7, MONDAY, FEB)]
+
+
+def test_run_job_writes_month_report_without_touching_the_database(worker_service, service):
+    with service.engine.connect() as conn:
+        before = conn.exec_driver_sql("SELECT count(*) FROM report_cache_rows").scalar()
+    result = batch_reports._run_job(("month", (2025, 1), *month_bounds(2025, 1)))
+    assert (result["job"], result["rows"], result["error"]) == ("2025-01", 3, None)
+    ws = load_workbook(result["path"]).active
+    assert ws.max_row == 4                                  # 標題列 + 3 筆
+    with service.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM report_cache_rows").scalar() == before
+
+
+def test_run_job_reports_empty_month_and_errors(worker_service):
+    empty = batch_reports._run_job(("month", (2025, 3), *month_bounds(2025, 3)))
+    assert (empty["path"], empty["rows"], empty["error"]) == (None, 0, None)
+    broken = batch_reports._run_job(("month", (2025, 13), date(2025, 1, 1), date(2025, 1, 31)))
+    assert broken["path"] is None and broken["error"]
+
+
+def test_read_only_worker_cannot_write(worker_service):
+    assert not worker_service.add_teacher("新老師", "0900", "台北")
+    assert [t.name for t in worker_service.get_all_teachers()] == ["王老師"]
+
+
+def test_run_batch_uses_worker_processes(db_url, tmp_path, attended):
+    result = run_batch(db_url, "months", MONDAY, date(2025, 3, 31), workers=2, reports_dir=tmp_path / "batch")
+    assert (result["jobs"], result["workers"]) == (3, 2)
+    assert [r["job"] for r in result["reports"]] == ["2025-01", "2025-02"]
+    assert result["skipped"] == ["2025-03"] and result["errors"] == []
+    assert all(r["path"].startswith(str(tmp_path / "batch")) for r in result["reports"])
+
+
+def test_run_batch_rejects_unknown_kind(db_url):
+    with pytest.raises(ValueError):
+        run_batch(db_url, "students", MONDAY, FEB)
+
+
+def test_main_reports_unopenable_database(tmp_path):
+    with pytest.raises(SystemExit, match="無法以唯讀方式開啟資料庫"):
+        main(["months", "--from", "2025-01", "--to", "2025-01", "--db", f"sqlite:///{tmp_path / 'none.db'}"])
+
+
+def test_main_rejects_malformed_month(capsys):
+    with pytest.raises(SystemExit):
+        main(["months", "--from", "2025/01", "--to", "2025-13"])
+    assert "月份格式應為 YYYY-MM：2025/01" in capsys.readouterr().err
+
+def test_main_prints_json_summary(db_url, tmp_path, attended, capsys):
+    main(["courses", "--from", "2025-01", "--to", "2025-02", "--workers", "1",
+          "--out", str(tmp_path / "batch"), "--db", db_url])
+    result = json.loads(capsys.readouterr().out)
+    assert result["kind"] == "courses" and [r["rows"] for r in result["reports"]] == [4]
@@ -0,0 +1,72 @@
+from conftest import add_student
+from cache import ResultCache
+
+
+# ---------- ResultCache ----------
+def test_result_cache_evicts_least_recently_used_entry():
+    cache = ResultCache(maxsize=2)
+    loads = []
+
+    def loader(k):
+        return lambda: loads.append(k) or [k]
+
+    cache.get_or_load(("a",), loader("a"))
+    cache.get_or_load(("b",), loader("b"))
+    cache.get_or_load(("a",), loader("a"))        # a 變成最近使用
+    cache.get_or_load(("c",), loader("c"))        # 擠掉 b
+    cache.get_or_load(("a",), loader("a"))
+    cache.get_or_load(("b",), loader("b"))
+    assert loads == ["a", "b", "c", "b"]
+    assert cache.stats() == {"hits": 2, "misses": 4, "size": 2, "maxsize": 2}
+
+
+def test_result_cache_invalidate_by_prefix_and_returns_copies():
+    cache = ResultCache()
+    cache.get_or_load(("enrollment", 1, True), lambda: [1])
+    cache.get_or_load(("enrollment", 2, True), lambda: [2])
+    got = cache.get_or_load(("enrollment", 1, True), lambda: [99])
+    got.append("呼叫端修改")
+    assert cache.get_or_load(("enrollment", 1, True), lambda: [99]) == [1]
+
+    cache.invalidate(("enrollment", 1))
+    assert cache.get_or_load(("enrollment", 1, True), lambda: [10]) == [10]
+    assert cache.get_or_load(("enrollment", 2, True), lambda: [20]) == [2]
+
+
+def test_result_cache_does_not_store_result_invalidated_while_loading():
+    cache = ResultCache()
+
+    def loader():
+        cache.invalidate(("students",))           # 載入期間有寫入
+        return ["舊資料"]
+
+    assert cache.get_or_load(("students",), loader) == ["舊資料"]
+    assert cache.get_or_load(("students",), lambda: ["新資料"]) == ["新資料"]
+
+
+def test_result_cache_disabled_always_loads():
+    cache = ResultCache(maxsize=0)
+    assert cache.get_or_load(("x",), lambda: [1]) == [1]
+    assert cache.get_or_load(("x",), lambda: [2]) == [2]
+
+
+# ---------- AttendanceService 讀取快取 ----------
+def test_service_writes_invalidate_cached_lists(service, school):
+    names = [s.name for s in service.get_all_students()]
+    assert names == ["學生1", "學生2", "學生3"]
+    hits = service.cache_stats()["hits"]
+    service.get_all_students()
+    assert service.cache_stats()["hits"] == hits + 1
+
+    add_student(service, "學生4")
+    assert len(service.get_all_students()) == 4
+
+
+def test_service_enrollment_change_invalidates_both_rosters(service, school):
+    course = school["course"]
+    assert len(service.get_students_for_course(course)) == 3
+    assert service.get_students_not_in_course(course) == []
+
+    service.update_course_enrollments(course, school["students"][:2])
+    assert [s.id for s in service.get_students_for_course(course)] == school["students"][:2]
+    assert [s.id for s in service.get_students_not_in_course(course)] == school["students"][2:]
@@ -0,0 +1,108 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, select
+from sqlalchemy.exc import OperationalError
+
+import database
+from database import insert_ignore, make_engine, upsert
+
+metadata = MetaData()
+people = Table("people", metadata,
+               Column("name", String, primary_key=True),
+               Column("phone", String),
+               Column("visits", Integer))
+
+
+def _engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'portable.db'}")
+    metadata.create_all(engine)
+    return engine
+
+
+def _bump(ex):
+    return {"phone": func.coalesce(ex.phone, people.c.phone), "visits": people.c.visits + ex.visits}
+
+
+# ---------- ON CONFLICT 與先查詢再寫入的版本結果一致 ----------
+def _run_upserts(conn, dialect):
+    upsert(dialect, conn, people, [{"name": "甲", "phone": "1", "visits": 1},
+                                   {"name": "乙", "phone": None, "visits": 1}], ["name"], _bump)
+    upsert(dialect, conn, people, [{"name": "甲", "phone": None, "visits": 2},
+                                   {"name": "丙", "phone": "3", "visits": 1}], ["name"], _bump)
+    added = insert_ignore(dialect, conn, people, [{"name": "丙", "phone": "x", "visits": 9},
+                                                  {"name": "丁", "phone": "4", "visits": 1},
+                                                  {"name": "丁", "phone": "5", "visits": 1}], ["name"])
+    return added, conn.execute(select(people).order_by(people.c.name)).all()
+
+
+def test_portable_fallback_matches_on_conflict(tmp_path):
+    engine = _engine(tmp_path)
+    results = []
+    for dialect in ("sqlite", "mssql"):      # mssql：沒有 ON CONFLICT，走先查詢再寫入
+        with engine.begin() as conn:
+            conn.execute(people.delete())
+            results.append(_run_upserts(conn, dialect))
+    engine.dispose()
+    added, rows = results[1]
+    assert results[0][1] == rows
+    assert added == 1
+    assert rows == [("丁", "4", 1), ("丙", "3", 1), ("乙", None, 1), ("甲", "1", 3)]
+
+
+# ---------- 唯讀設定檔 ----------
+def _wal_database(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'wal.db'}", "desktop")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+    engine.dispose()          # 最後一條連線關閉時 checkpoint 並刪除 -wal 檔
+    return tmp_path / "wal.db"
+
+
+def _fail_without_immutable(monkeypatch):
+    """模擬資料夾無法寫入：mode=ro 開啟 WAL 資料庫失敗，只有 immutable=1 能讀取。"""
+    probe = database._probe
+
+    def fake_probe(engine):
+        if engine.url.query.get("immutable") != "1":
+            raise OperationalError("SELECT", {}, sqlite3.OperationalError("unable to open database file"))
+        probe(engine)
+
+    monkeypatch.setattr(database, "_probe", fake_probe)
+
+
+def test_read_only_engine_rejects_writes(tmp_path):
+    engine = make_engine(f"sqlite:///{_wal_database(tmp_path)}", "readonly")
+    try:
+        assert engine.url.query.get("mode") == "ro" and "immutable" not in engine.url.query
+        with pytest.raises(OperationalError):
+            with engine.begin() as conn:
+                conn.exec_driver_sql("INSERT INTO t VALUES (2)")
+    finally:
+        engine.dispose()
+
+
+def test_read_only_engine_falls_back_to_immutable_without_wal_file(tmp_path, monkeypatch):
+    path = _wal_database(tmp_path)
+    _fail_without_immutable(monkeypatch)
+    engine = make_engine(f"sqlite:///{path}", "readonly")
+    try:
+        assert engine.url.query.get("immutable") == "1"
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("SELECT x FROM t").scalar() == 1
+    finally:
+        engine.dispose()
+
+
+def test_read_only_engine_refuses_immutable_with_pending_wal(tmp_path, monkeypatch):
+    path = _wal_database(tmp_path)
+    (tmp_path / "wal.db-wal").write_bytes(b"")
+    _fail_without_immutable(monkeypatch)
+    with pytest.raises(OperationalError, match="checkpoint"):
+        make_engine(f"sqlite:///{path}", "readonly")
+
+
+def test_read_only_engine_missing_database_raises(tmp_path):
+    with pytest.raises(OperationalError):
+        make_engine(f"sqlite:///{tmp_path / 'missing.db'}", "readonly")
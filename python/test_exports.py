@@ -0,0 +1,95 @@
+import csv
+
+import pytest
+from sqlalchemy import text
+
+from conftest import MONDAY
+from exports import EXPORT_COLUMNS, AttendanceExporter
+from models import REPORT_VERSION_TRIGGER
+
+JAN, FEB = MONDAY, MONDAY.replace(month=2, day=3)
+
+
+@pytest.fixture
+def exporter(service, school):
+    service.take_attendance(school["schedule"], JAN, {sid: "有到" for sid in school["students"]})
+    service.take_attendance(school["schedule"], FEB, {school["students"][0]: "遲到"})
+    return AttendanceExporter(service, chunk_size=2)
+
+
+def _export(exporter, tmp_path, **kwargs):
+    return exporter.export_months(JAN, FEB, "csv", tmp_path / "out", **kwargs)
+
+
+def _read(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_export_streams_rows_in_date_order(exporter, tmp_path):
+    result = exporter.export(JAN, FEB, "csv", tmp_path / "all.csv")
+    rows = _read(result["path"])
+    assert result["rows"] == 4 and rows[0] == EXPORT_COLUMNS and len(rows) == 5
+    assert [r[1] for r in rows[1:]] == [JAN.isoformat()] * 3 + [FEB.isoformat()]
+    assert rows[1][EXPORT_COLUMNS.index("class_deducted")] == "1"
+
+
+def test_export_parquet_keeps_column_types(exporter, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    result = exporter.export(JAN, FEB, "parquet", tmp_path / "all.parquet")
+    table = pq.read_table(result["path"])
+    assert table.column_names == EXPORT_COLUMNS and table.num_rows == 4
+    assert table.column("date").to_pylist()[-1] == FEB
+
+
+def test_export_rejects_unknown_format(exporter):
+    with pytest.raises(ValueError):
+        exporter.export(JAN, FEB, "json")
+
+
+def test_export_months_rewrites_only_changed_months(exporter, tmp_path):
+    assert _export(exporter, tmp_path)["written"] == ["2025-01", "2025-02"]
+    assert _export(exporter, tmp_path)["unchanged"] == ["2025-01", "2025-02"]
+    # 改名不影響筆數與 id，但匯出的姓名欄會變：依報表版本判斷才會重寫
+    with exporter.service.engine.begin() as conn:
+        conn.execute(text("UPDATE students SET name = '改名' WHERE name = '學生2'"))
+    result = _export(exporter, tmp_path)
+    assert (result["written"], result["unchanged"]) == (["2025-01"], ["2025-02"])
+    assert "改名" in {r[3] for r in _read(tmp_path / "out" / "attendance_2025-01.csv")}
+
+
+def test_export_months_follows_status_and_schedule_edits(exporter, service, school, tmp_path):
+    _export(exporter, tmp_path)
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE attendance_records SET status = '曠課' WHERE date = :d"), {"d": FEB.isoformat()})
+    assert _export(exporter, tmp_path)["written"] == ["2025-02"]
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE course_schedules SET day_of_week = 'TUE'"))
+    assert _export(exporter, tmp_path)["written"] == ["2025-01", "2025-02"]
+
+
+def test_export_months_removes_emptied_months_and_records_versions(exporter, service, tmp_path):
+    _export(exporter, tmp_path)
+    with service.engine.begin() as conn:
+        conn.execute(text("DELETE FROM attendance_records WHERE date = :d"), {"d": FEB.isoformat()})
+    assert _export(exporter, tmp_path)["removed"] == ["2025-02"]
+    assert not (tmp_path / "out" / "attendance_2025-02.csv").exists()
+    manifest = exporter._load_manifest(tmp_path / "out" / "_manifest_csv.json")
+    assert list(manifest["months"]) == ["2025-01"] and manifest["months"]["2025-01"]["version"] > 0
+
+
+def test_export_months_force_or_missing_file_rewrites(exporter, tmp_path):
+    _export(exporter, tmp_path)
+    assert _export(exporter, tmp_path, force=True)["written"] == ["2025-01", "2025-02"]
+    (tmp_path / "out" / "attendance_2025-01.csv").unlink()
+    assert _export(exporter, tmp_path)["written"] == ["2025-01"]
+
+
+def test_export_months_without_version_triggers_always_rewrites(exporter, service, tmp_path):
+    with service.engine.begin() as conn:
+        conn.execute(text(f"DROP TRIGGER {REPORT_VERSION_TRIGGER}"))
+    _export(exporter, tmp_path)
+    result = _export(exporter, tmp_path)
+    assert (result["written"], result["unchanged"]) == (["2025-01", "2025-02"], [])
+    manifest = exporter._load_manifest(tmp_path / "out" / "_manifest_csv.json")
+    assert manifest["months"]["2025-01"]["version"] is None
@@ -0,0 +1,333 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import MONDAY, add_student
+from journal import JournalSyncer, RollCallJournal
+from main_gui import App, BackgroundWorker, EnrollmentWindow, PagedLoader, ROLL_CALL_STATUSES
+
+
+class FakeRoot:
+    """代替 tk.Tk：after() 只記錄回呼，由測試以 pump() 在「主執行緒」執行。"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.next_id = 0
+
+    def after(self, ms, fn, *args):
+        self.next_id += 1
+        self.callbacks.append((self.next_id, fn, args))
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.callbacks = [c for c in self.callbacks if c[0] != after_id]
+
+    def pump(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for _, fn, args in callbacks:
+            fn(*args)
+
+
+@pytest.fixture
+def root():
+    return FakeRoot()
+
+
+@pytest.fixture
+def worker(root):
+    busy = []
+    w = BackgroundWorker(root, on_busy_change=busy.append, max_workers=1)
+    w.busy = busy
+    yield w
+    w.shutdown()
+
+
+def _drain(worker, root):
+    worker.executor.submit(lambda: None).result()      # 等工作執行緒把佇列中的工作做完
+    root.pump()
+
+
+# ---------- BackgroundWorker ----------
+def test_worker_delivers_result_on_the_polling_thread(worker, root):
+    got = []
+    worker.submit("k", lambda x: (threading.current_thread().name, x * 2), 21, on_done=got.append)
+    _drain(worker, root)
+    assert got and got[0][1] == 42 and got[0][0].startswith("service")
+    root.pump()
+    assert worker.busy == [True, False]
+
+
+def test_worker_newer_submit_with_same_key_supersedes_older(worker, root):
+    gate = threading.Event()
+    got = []
+    worker.submit("blocker", gate.wait)
+    worker.submit("tab", lambda: "舊", on_done=got.append)
+    worker.submit("tab", lambda: "新", on_done=got.append)     # 舊工作尚未開始，直接取消
+    gate.set()
+    _drain(worker, root)
+    assert got == ["新"]
+    root.pump()
+    assert worker.pending == 0 and worker.busy[-1] is False
+
+
+def test_worker_cancel_by_prefix_discards_running_result(worker, root):
+    started, gate = threading.Event(), threading.Event()
+    got = []
+
+    def slow():
+        started.set()
+        gate.wait()
+        return "結果"
+
+    worker.submit("tab:students:list", slow, on_done=got.append)
+    started.wait()
+    worker.cancel("tab:students")
+    gate.set()
+    _drain(worker, root)
+    assert got == []
+
+
+def test_worker_routes_exceptions_to_on_error(worker, root):
+    errors = []
+    worker.submit("k", lambda: 1 / 0, on_error=errors.append)
+    _drain(worker, root)
+    assert isinstance(errors[0], ZeroDivisionError)
+
+
+# ---------- 點名表格 ----------
+class FakeTree:
+    """點名用到的 ttk.Treeview 子集合。"""
+
+    def __init__(self):
+        self.rows, self.selected = {}, ()
+
+    def insert(self, parent, index, iid, values):
+        self.rows[iid] = {"values": list(values), "tags": ()}
+
+    def get_children(self):
+        return tuple(self.rows)
+
+    def delete(self, *iids):
+        for iid in iids:
+            del self.rows[iid]
+
+    def selection(self):
+        return self.selected
+
+    def set(self, iid, column, value):
+        self.rows[iid]["values"][2] = value
+
+    def item(self, iid, tags):
+        self.rows[iid]["tags"] = tags
+
+    def focus_set(self):
+        pass
+
+
+class RollCallGrid:
+    """只掛上 App 的點名方法，不建立 Tk 視窗。"""
+    clear_roll_call = App.clear_roll_call
+    _build_roll_call = App._build_roll_call
+    set_roll_call_status = App.set_roll_call_status
+    cycle_roll_call_status = App.cycle_roll_call_status
+
+    def __init__(self):
+        self.roll_call_tree = FakeTree()
+        self.roll_call_status = {}
+        self.attendance_frame = SimpleNamespace(config=lambda **kw: None)
+
+
+def _students(*names):
+    return [SimpleNamespace(id=i, name=n, remaining_classes=5) for i, n in enumerate(names, 1)]
+
+
+def test_roll_call_grid_defaults_everyone_to_present():
+    grid = RollCallGrid()
+    grid._build_roll_call(_students("甲", "乙"))
+    assert grid.roll_call_status == {"1": "有到", "2": "有到"}
+    assert grid.roll_call_tree.rows["2"]["values"] == ["乙", "5 堂", "有到"]
+
+
+def test_roll_call_bulk_and_cycle_update_status_and_row():
+    grid = RollCallGrid()
+    grid._build_roll_call(_students("甲", "乙", "丙"))
+    grid.set_roll_call_status("曠課", all_rows=True)
+    assert set(grid.roll_call_status.values()) == {"曠課"}
+
+    grid.roll_call_tree.selected = ("1", "3")
+    grid.cycle_roll_call_status()                 # 曠課 → 有到（循環）
+    assert grid.roll_call_status == {"1": ROLL_CALL_STATUSES[0], "2": "曠課", "3": ROLL_CALL_STATUSES[0]}
+    assert grid.roll_call_tree.rows["1"]["tags"] == (ROLL_CALL_STATUSES[0],)
+
+    grid.clear_roll_call()
+    assert grid.roll_call_status == {} and grid.roll_call_tree.rows == {}
+
+
+# ---------- 新增排程（背景執行） ----------
+def test_add_schedule_job_collects_conflict_details_off_the_ui_thread(service, school):
+    gui = SimpleNamespace(service=service)
+    ok, lines, total = App._add_schedule_job(gui, school["course"], "MON", "18:30")
+    # 同一門課的老師與三位報名學生都已在週一 18:00 上這門課
+    assert (ok, total) == (False, 4)
+    assert lines == ["老師 王老師：鋼琴 18:00-19:00"] + [f"學生 學生{i}：鋼琴 18:00-19:00" for i in (1, 2, 3)]
+    assert App._add_schedule_job(gui, school["course"], "TUE", "18:30") == (True, [], 0)
+
+
+# ---------- 送出點名（背景同步） ----------
+def test_sync_entry_classifies_result_off_the_ui_thread(service, school, tmp_path):
+    journal = RollCallJournal(tmp_path / "journal.jsonl")
+    gui = SimpleNamespace(journal=journal, syncer=JournalSyncer(journal, service))
+    sid = school["students"][0]
+    ok = journal.append(school["schedule"], MONDAY, {sid: "有到"})
+    assert App._sync_entry(gui, ok) == ("synced", ["inserted"])
+    gone = journal.append(9999, MONDAY, {sid: "有到"})
+    assert App._sync_entry(gui, gone) == ("rejected", None)
+
+    gui.syncer.service = None                           # 資料庫無法使用：留在日誌待重試
+    waiting = journal.append(school["schedule"], MONDAY, {sid: "遲到"})
+    assert App._sync_entry(gui, waiting) == ("pending", None)
+
+
+def test_journal_status_is_drained_on_the_ui_thread(root):
+    labels = []
+    gui = SimpleNamespace(journal_status=queue.Queue(), after=root.after, _update_journal_label=labels.append)
+    gui._poll_journal_status = lambda: App._poll_journal_status(gui)
+    App._poll_journal_status(gui)
+    assert labels == []                                 # 還沒有回報：不更新
+    for n in (3, 2, 0):
+        gui.journal_status.put(n)                       # 同步執行緒只放進佇列
+    root.pump()
+    assert labels == [0]                                # 只顯示最新的筆數
+    assert len(root.callbacks) == 1                     # 持續輪詢
+
+
+# ---------- 資料寫入（背景執行） ----------
+class FakeFocusTree:
+    """只提供 focus()/item() 的 ttk.Treeview，代表使用者選取的那一列。"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def focus(self):
+        return "I001"
+
+    def item(self, iid):
+        return {"values": self.values}
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    import main_gui
+    shown = []
+    monkeypatch.setattr(main_gui.messagebox, "showerror", lambda title, msg, **kw: shown.append((title, msg)))
+    monkeypatch.setattr(main_gui.messagebox, "showinfo", lambda title, msg, **kw: shown.append((title, msg)))
+    return shown
+
+
+def test_delete_teacher_runs_on_worker_and_refreshes_in_on_done(worker, root, service, school, messages):
+    refreshed = []
+    gui = SimpleNamespace(worker=worker, service=service, teacher_tree=FakeFocusTree(school["teacher"], "王老師"),
+                          refresh_teacher_list=lambda: refreshed.append(True))
+    gui._on_teacher_deleted = lambda res: App._on_teacher_deleted(gui, res)
+    App.delete_teacher(gui)
+    assert refreshed == [] and messages == []           # 送出時不呼叫服務、不更新畫面
+    _drain(worker, root)
+    assert messages == [("刪除失敗", "無法刪除，該老師仍有 1 門課程。")]
+
+    assert service.add_teacher("李老師", None, None)
+    gui.teacher_tree = FakeFocusTree(next(t.id for t in service.get_all_teachers() if t.name == "李老師"), "李老師")
+    App.delete_teacher(gui)
+    _drain(worker, root)
+    assert refreshed == [True] and [t.name for t in service.get_all_teachers()] == ["王老師"]
+
+
+def _enrollment_window(worker, service, course_id, student_ids, closed):
+    win = SimpleNamespace(worker=worker, service=service, course_id=course_id,
+                          enrolled={sid: SimpleNamespace(name=f"學生{i}") for i, sid in enumerate(student_ids, 1)},
+                          winfo_exists=lambda: not closed, destroy=lambda: closed.append(True))
+    win._save_job = lambda cid, enrolled: EnrollmentWindow._save_job(win, cid, enrolled)
+    win._on_saved = lambda saved: EnrollmentWindow._on_saved(win, saved)
+    return win
+
+
+def test_enrollment_save_runs_on_worker_and_skips_closed_window(worker, root, service, school, messages):
+    closed = []
+    win = _enrollment_window(worker, service, school["course"], school["students"][:2], closed)
+    EnrollmentWindow.save_changes(win)
+    _drain(worker, root)
+    assert closed == [True] and "移除 1 位" in messages[0][1]
+
+    messages.clear()
+    win.enrolled = dict.fromkeys(school["students"])
+    EnrollmentWindow.save_changes(win)                  # 視窗已關閉：結果不再顯示
+    _drain(worker, root)
+    assert messages == [] and len(service.get_students_for_course(school["course"])) == 3
+
+
+def test_enrollment_save_lists_students_with_clashing_courses(worker, root, service, school, messages):
+    assert service.add_teacher("李老師", None, None)
+    teacher = next(t.id for t in service.get_all_teachers() if t.name == "李老師")
+    assert service.add_course("小提琴", teacher)
+    course = next(c.id for c in service.get_all_courses_with_schedules() if c.name == "小提琴")
+    assert service.add_course_schedule(course, "MON", "18:30")
+    closed = []
+    win = _enrollment_window(worker, service, course, school["students"][:1], closed)
+    EnrollmentWindow.save_changes(win)
+    _drain(worker, root)
+    assert closed == [] and service.get_students_for_course(course) == []
+    assert messages == [("時段衝突", "以下加選的學生在同一時段已有其他課程，名單未儲存：\n"
+                                 "學生 學生1：鋼琴 MON 18:00-19:00")]
+
+
+# ---------- PagedLoader（keyset 分頁） ----------
+@pytest.fixture
+def loader(worker, service):
+    for name in ("甲", "乙", "丙", "丁", "戊"):
+        add_student(service, name)
+    pages = []
+    loader = PagedLoader(worker, "students",
+                         lambda q, cursor: service.search_students(q, cursor, limit=2),
+                         lambda rows, first: pages.append(([r.name for r in rows], first)))
+    loader.pages = pages
+    return loader
+
+
+def test_paged_loader_loads_next_pages_until_exhausted(loader, worker, root):
+    loader.reset()
+    _drain(worker, root)
+    loader.more()
+    loader.more()                                       # 上一頁還在載入：不重複送出
+    _drain(worker, root)
+    loader.more()
+    _drain(worker, root)
+    assert loader.pages == [(["丁", "丙"], True), (["乙", "戊"], False), (["甲"], False)]
+    assert loader.exhausted
+    loader.more()
+    _drain(worker, root)
+    assert len(loader.pages) == 3
+
+
+def test_paged_loader_debounces_search_and_restarts_from_first_page(loader, worker, root):
+    loader.reset()
+    _drain(worker, root)
+    loader.reset_later("丙")
+    loader.reset_later("甲")
+    assert [c[1] for c in root.callbacks].count(loader._reset_now) == 1
+    assert root.callbacks[-1][2] == ("甲",)
+    root.pump()                                         # 停止輸入一段時間後才查詢
+    _drain(worker, root)
+    assert loader.pages[-1] == (["甲"], True) and loader.exhausted
+
+
+def test_paged_loader_scrollbar_near_bottom_requests_more(loader, worker, root):
+    seen = []
+    command = loader.yscrollcommand(SimpleNamespace(set=lambda *a: seen.append(a)))
+    loader.reset()
+    _drain(worker, root)
+    command("0.0", "0.5")
+    assert not loader.loading
+    command("0.2", "0.95")
+    _drain(worker, root)
+    assert seen == [("0.0", "0.5"), ("0.2", "0.95")] and loader.pages[-1] == (["乙", "戊"], False)
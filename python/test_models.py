@@ -0,0 +1,128 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from conftest import MONDAY
+from models import Base, report_month_version, upgrade_schema
+
+ATTENDANCE_INDEXES = {"ux_attendance_student_schedule_date", "ix_attendance_date", "ix_attendance_student_date"}
+
+
+def _index_names(engine):
+    return {ix["name"] for ix in inspect(engine).get_indexes("attendance_records")}
+
+
+# ---------- 索引升級 ----------
+def test_upgrade_schema_adds_missing_indexes_to_existing_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for name in ATTENDANCE_INDEXES:
+            conn.execute(text(f"DROP INDEX {name}"))
+    assert not _index_names(engine) & ATTENDANCE_INDEXES
+
+    upgrade_schema(engine)
+    assert ATTENDANCE_INDEXES <= _index_names(engine)
+    engine.dispose()
+
+
+def test_unique_index_rejects_second_roll_call_for_same_student_and_day(service, school):
+    row = {"s": school["students"][0], "c": school["schedule"], "d": MONDAY.isoformat()}
+    insert = text("INSERT INTO attendance_records (student_id, course_schedule_id, date, status, class_deducted) "
+                  "VALUES (:s, :c, :d, '有到', 0)")
+    with service.engine.begin() as conn:
+        conn.execute(insert, row)
+    with pytest.raises(IntegrityError):
+        with service.engine.begin() as conn:
+            conn.execute(insert, row)
+
+
+def test_upgrade_schema_removes_duplicate_roll_calls_before_unique_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dup.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ux_attendance_student_schedule_date"))
+        for status in ("曠課", "遲到", "有到"):
+            conn.execute(text("INSERT INTO attendance_records (student_id, course_schedule_id, date, status, "
+                              "class_deducted) VALUES (1, 1, '2025-01-06', :st, 1)"), {"st": status})
+        conn.execute(text("INSERT INTO attendance_records (student_id, course_schedule_id, date, status, "
+                          "class_deducted) VALUES (2, 1, '2025-01-06', '有到', 1)"))
+        conn.execute(text("INSERT INTO class_ledger (student_id, kind, amount, attendance_record_id, created_at) "
+                          "VALUES (1, 'deduction', -1, 1, '2025-01-06')"))
+
+    upgrade_schema(engine)
+    assert "ux_attendance_student_schedule_date" in _index_names(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, student_id, status FROM attendance_records ORDER BY id")).all()
+        assert rows == [(3, 1, "有到"), (4, 2, "有到")]      # 每組只留最新一筆
+        # 刪除的點名已扣的堂數仍留在帳本
+        assert conn.execute(text("SELECT amount, attendance_record_id FROM class_ledger")).all() == [(-1, None)]
+    engine.dispose()
+
+# ---------- 帳本 ----------
+def test_opening_balance_backfill_runs_only_once(service):
+    with service.engine.begin() as conn:
+        conn.execute(text("INSERT INTO students (name, registered_classes, remaining_classes) "
+                          "VALUES ('舊學生', 5, 5)"))
+    # 期初餘額升級已在建立資料庫時執行過：之後新增且沒有帳本的學生不會再被補帳
+    upgrade_schema(service.engine)
+    with service.engine.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM class_ledger")) == 0
+        assert "0001_ledger_opening_balance" in conn.execute(text("SELECT name FROM schema_migrations")).scalars().all()
+
+
+def test_opening_balance_backfill_on_database_without_ledger_history(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE schema_migrations"))
+        conn.execute(text("INSERT INTO students (name, registered_classes, remaining_classes) VALUES ('甲', 9, 4)"))
+    upgrade_schema(engine)
+    upgrade_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT kind, amount FROM class_ledger")).all() == [("opening", 4)]
+    engine.dispose()
+
+
+def test_deleting_attendance_keeps_ledger_entry_with_null_reference(service, school):
+    sid = school["students"][0]
+    service.take_attendance(school["schedule"], MONDAY, {sid: "有到"})
+    with service.engine.begin() as conn:
+        conn.execute(text("DELETE FROM attendance_records"))
+    with service.engine.connect() as conn:
+        rows = conn.execute(text("SELECT amount, attendance_record_id FROM class_ledger WHERE kind = 'deduction'")).all()
+    assert rows == [(-1, None)]
+
+
+# ---------- 報表版本觸發器 ----------
+def _version(service, year=2025, month=1):
+    with service.engine.connect() as conn:
+        return report_month_version(conn, year, month)
+
+
+@pytest.mark.parametrize("sql", [
+    "UPDATE students SET name = '新名字' WHERE name = '學生1'",
+    "UPDATE teachers SET name = '李老師'",
+    "UPDATE courses SET name = '爵士鋼琴'",
+    "UPDATE course_schedules SET start_time = '19:00:00.000000', end_time = '20:00:00.000000'",
+    "UPDATE course_schedules SET day_of_week = 'TUE'",
+    "UPDATE attendance_records SET status = '遲到'",
+    "DELETE FROM attendance_records",
+])
+def test_changes_to_reported_columns_bump_the_month_version(service, school, sql):
+    service.take_attendance(school["schedule"], MONDAY, {sid: "有到" for sid in school["students"]})
+    before = _version(service)
+    with service.engine.begin() as conn:
+        conn.execute(text(sql))
+    assert _version(service) > before
+    assert _version(service, 2025, 2) == 0          # 其他月份不受影響
+
+
+def test_unreported_changes_keep_the_month_version(service, school):
+    service.take_attendance(school["schedule"], MONDAY, {sid: "有到" for sid in school["students"]})
+    before = _version(service)
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE students SET phone = '0900', remaining_classes = 1"))
+        conn.execute(text("UPDATE teachers SET phone = '0911'"))
+        conn.execute(text("UPDATE students SET name = name"))
+    assert _version(service) == before
@@ -0,0 +1,40 @@
+import profiling
+from conftest import MONDAY
+from services import AttendanceService
+
+
+def test_instrumented_service_counts_calls_and_statements(db_url, tmp_path):
+    service = AttendanceService(db_url, instrument=True, slow_ms=0, reports_dir=tmp_path)
+    try:
+        service.get_all_students()
+        service.get_all_students()
+        summary = service.profiling_summary()
+        st = summary["methods"]["get_all_students"]
+        assert st["calls"] == 2 and st["statements"] >= 1
+        # 第二次由快取回傳，不執行 SQL
+        assert st["statements_per_call"] == st["statements"] / 2
+        assert {c["method"] for c in summary["slow_calls"]} == {"get_all_students"}
+    finally:
+        service.dispose()
+
+
+def test_uninstrumented_service_is_not_wrapped(service):
+    assert service.profiler is None
+    assert service.take_attendance.__func__ is AttendanceService.take_attendance
+
+
+def test_exit_summary_is_registered_once_per_process(monkeypatch, db_url, tmp_path, capsys):
+    registered = []
+    monkeypatch.setattr(profiling.atexit, "register", registered.append)
+    monkeypatch.setattr(profiling, "_exit_registered", False)
+    monkeypatch.setattr(profiling, "_exit_profilers", profiling.weakref.WeakSet())
+    monkeypatch.setenv(profiling.ENV_ENABLE, "1")
+    services = [AttendanceService(db_url, reports_dir=tmp_path) for _ in range(3)]
+    try:
+        services[0].take_attendance(1, MONDAY, {})
+        assert registered == [profiling._print_exit_summaries]
+        registered[0]()
+        assert capsys.readouterr().err.count("條 SQL") == 3
+    finally:
+        for s in services:
+            s.dispose()
@@ -0,0 +1,35 @@
+from datetime import time
+
+from scheduling import TimetableIndex
+
+
+def _index():
+    # 課程 1、2 由老師 10 授課，課程 3 由老師 20；學生 100 報名課程 1、3
+    return TimetableIndex.build(
+        courses=[(1, 10), (2, 10), (3, 20)],
+        schedules=[(11, 1, "MON", time(18, 0), time(19, 0)),
+                   (31, 3, "TUE", time(9, 0), time(10, 0))],
+        enrollments=[(100, 1), (100, 3)])
+
+
+def test_conflicts_for_reports_teacher_and_student_overlaps():
+    index = _index()
+    # 課程 2 同老師，18:30 開始與課程 1 重疊；相鄰時段不算重疊
+    found = index.conflicts_for(2, "MON", time(18, 30), time(19, 30))
+    assert [(c.kind, c.owner_id, c.other_schedule_id) for c in found] == [("teacher", 10, 11)]
+    assert index.conflicts_for(2, "MON", time(19, 0), time(20, 0)) == []
+
+    # 課程 3 的學生 100 週一晚上已有課程 1
+    found = index.conflicts_for(3, "MON", time(18, 0), time(18, 30))
+    assert [(c.kind, c.owner_id) for c in found] == [("student", 100)]
+
+
+def test_incremental_updates_keep_index_in_sync():
+    index = _index()
+    index.unenroll(1, [100])
+    assert index.conflicts_for(3, "MON", time(18, 0), time(18, 30)) == []
+    index.enroll(1, [100])
+    index.remove_schedule(11, 1)
+    assert index.conflicts_for(3, "MON", time(18, 0), time(18, 30)) == []
+    index.add_schedule(12, 1, "TUE", time(9, 30), time(10, 30))
+    assert {(c.kind, c.owner_id, c.schedule_id) for c in index.check_all()} == {("student", 100, 12)}
@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from conftest import add_student
+from search import fts_available, search_students
+
+
+@pytest.fixture
+def roster(service):
+    add_student(service, "王小明", phone="0911222333")
+    add_student(service, "王小美", phone="0922333444")
+    add_student(service, "陳大文", phone="0933444555")
+    add_student(service, "Alice Wang", phone="0944555666")
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE students SET address = '台北市信義路' WHERE name = '陳大文'"))
+    return service
+
+
+def _names(rows):
+    return [r.name for r in rows]
+
+
+def _search(service, query, **kwargs):
+    with Session(service.engine) as session:
+        return _names(search_students(session, query, **kwargs))
+
+
+# ---------- FTS5 trigram ----------
+def test_new_database_has_student_fts_index(service):
+    with service.engine.connect() as conn:
+        assert fts_available(conn)
+    assert service._fts
+
+
+def test_fts_matches_substrings_of_name_phone_and_address(roster):
+    assert _names(roster.find_students("王小明")) == ["王小明"]
+    assert _names(roster.find_students("333444", fuzzy=False)) == ["王小美"]
+    assert _names(roster.find_students("信義路")) == ["陳大文"]
+    # 英文不分大小寫
+    assert _names(roster.find_students("alice")) == ["Alice Wang"]
+
+
+def test_fts_ranks_exact_name_first_and_fills_with_fuzzy_matches(roster):
+    # 打錯最後一個字：沒有完全相符，以 trigram 片段補上最接近的學生
+    assert _names(roster.find_students("王小明明", fuzzy=False)) == []
+    assert _names(roster.find_students("王小明明"))[0] == "王小明"
+    assert _names(roster.find_students("王小美", limit=1)) == ["王小美"]
+
+
+def test_fts_index_follows_student_updates_and_deletes(roster):
+    sid = roster.find_students("陳大文")[0].id
+    with roster.engine.begin() as conn:
+        conn.execute(text("UPDATE students SET name = '陳志明' WHERE id = :id"), {"id": sid})
+    assert _names(roster.find_students("陳大文", fuzzy=False)) == []
+    assert _names(roster.find_students("陳志明")) == ["陳志明"]
+    assert roster.delete_student(sid)
+    assert _names(roster.find_students("陳志明", fuzzy=False)) == []
+
+
+def test_fts_query_syntax_is_treated_as_text(roster):
+    # 引號與 OR 不會被當成 FTS5 語法（也不會丟出例外）
+    assert roster.find_students('王"小 OR 明', fuzzy=False) == []
+    assert roster.find_students("王小明 OR 陳大文", fuzzy=False) == []
+
+
+# ---------- LIKE 退回 ----------
+def test_short_query_uses_like_and_orders_name_matches_first(roster):
+    assert _search(roster, "王") == ["王小明", "王小美"]
+    assert _search(roster, "0933") == ["陳大文"]
+
+
+def test_like_fallback_without_fts_matches_substrings(roster):
+    assert _search(roster, "小明", use_fts=False) == ["王小明"]
+    assert _search(roster, "ALICE", use_fts=False) == ["Alice Wang"]
+    assert _search(roster, "100%", use_fts=False) == []          # 萬用字元視為一般字元
+
+
+def test_like_fuzzy_scores_two_character_fragments(roster):
+    # 「小明美」不是任何人的子字串；以 2 字元片段計分時「小明」相符，補上王小明
+    assert _search(roster, "小明美", use_fts=False, fuzzy=False) == []
+    assert _search(roster, "小明美", use_fts=False) == ["王小明"]
+
+
+def test_empty_query_or_limit_returns_nothing(roster):
+    assert roster.find_students("   ") == []
+    assert roster.find_students("王", limit=0) == []
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+from datetime import time
+
+from scheduling import Conflict
+from server import AttendanceServer
+
+CLASH = Conflict("student", 7, "MON", 3, 1, 5, 2, time(18, 0), time(19, 0))
+
+
+class FakeService:
+    async def get_all_teachers(self):
+        return []
+
+    async def get_all_students(self):
+        raise RuntimeError("database is locked: /srv/attendance.db")
+
+    async def update_course_enrollments(self, course_id, student_ids):
+        # 課程 1：加選衝突；其他課程不存在
+        return {"conflicts": [CLASH]} if course_id == 1 else None
+
+
+async def _exchange(raw: bytes):
+    """啟動伺服器送出一段原始請求，回傳 [(狀態碼, JSON 內容)] 與連線是否已被伺服器關閉。"""
+    server = await asyncio.start_server(AttendanceServer(FakeService()).handle_client, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(raw)
+        await writer.drain()
+        responses = []
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                return responses, True
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers["content-length"]))
+            responses.append((int(status_line.split()[1]), json.loads(body)))
+            if headers["connection"] == "keep-alive" and len(responses) == raw.count(b"HTTP/1.1"):
+                return responses, False
+    finally:
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+
+def _run(raw: bytes):
+    return asyncio.run(asyncio.wait_for(_exchange(raw), 5))
+
+
+def test_keep_alive_serves_several_requests():
+    responses, closed = _run(b"GET /teachers HTTP/1.1\r\n\r\n" * 2)
+    assert responses == [(200, []), (200, [])] and not closed
+
+
+def test_invalid_content_length_is_400_and_closes_connection():
+    for value in (b"abc", b"-5"):
+        responses, closed = _run(b"POST /attendance HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n{}"
+                                 + b"GET /teachers HTTP/1.1\r\n\r\n")
+        assert [s for s, _ in responses] == [400] and closed
+
+
+def test_oversized_body_is_413():
+    responses, closed = _run(b"POST /attendance HTTP/1.1\r\nContent-Length: 99999999\r\n\r\n")
+    assert [s for s, _ in responses] == [413] and closed
+
+
+def test_internal_error_is_logged_but_not_returned(caplog):
+    with caplog.at_level(logging.ERROR, logger="attendance.server"):
+        responses, _ = _run(b"GET /students HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert responses == [(500, {"error": "伺服器內部錯誤"})]
+    assert "database is locked" in caplog.text
+
+
+def test_enrollment_conflict_is_409_with_details_and_missing_course_is_404():
+    body = json.dumps({"student_ids": [7]}).encode()
+    request = b"PUT /courses/%d/enrollments HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s"
+    responses, _ = _run(request % (1, len(body), body) + request % (2, len(body), body))
+    (conflict, detail), (missing, _) = responses
+    assert (conflict, missing) == (409, 404)
+    assert detail["conflicts"] == [{"kind": "student", "owner_id": 7, "day_of_week": "MON", "schedule_id": 3,
+                                    "course_id": 1, "other_schedule_id": 5, "other_course_id": 2,
+                                    "other_start": "18:00:00", "other_end": "19:00:00"}]
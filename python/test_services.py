@@ -0,0 +1,414 @@
+from datetime import date, time, timedelta
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import text
+
+from conftest import MONDAY, add_student
+from dto import AttendanceRow, CourseRow, StudentRow
+from services import AttendanceService, OCCURRENCE_COLUMNS, REPORT_HEADERS, WEEKDAYS, expand_occurrences
+
+
+# ---------- take_attendance（整班一次點名） ----------
+def test_take_attendance_deducts_and_reports_outcomes(service, school):
+    a, b, c = school["students"]
+    outcomes = service.take_attendance(school["schedule"], MONDAY, {a: "有到", b: "遲到", c: "曠課", 999: "有到"})
+    assert outcomes == {a: "inserted", b: "inserted", c: "inserted", 999: "unknown"}
+    remaining = {s: service.get_student_by_id(s).remaining_classes for s in (a, b, c)}
+    # 有到、遲到扣堂，曠課不扣
+    assert remaining == {a: 9, b: 9, c: 10}
+
+
+def test_take_attendance_twice_is_duplicate_and_not_charged_again(service, school):
+    a = school["students"][0]
+    service.take_attendance(school["schedule"], MONDAY, {a: "有到"})
+    assert service.take_attendance(school["schedule"], MONDAY, {a: "有到"}) == {a: "duplicate"}
+    assert service.get_student_by_id(a).remaining_classes == 9
+
+
+def test_take_attendance_without_balance_is_not_deducted(service, school):
+    sid = add_student(service, "沒堂數")
+    assert service.take_attendance(school["schedule"], MONDAY, {sid: "有到"}) == {sid: "not_deducted"}
+    assert service.get_student_by_id(sid).remaining_classes == 0
+
+
+def test_take_attendance_unknown_schedule_returns_none(service, school):
+    assert service.take_attendance(12345, MONDAY, {school["students"][0]: "有到"}) is None
+
+
+# ---------- 上課 Occurrence 展開 ----------
+def _naive_occurrences(rows, start, end):
+    """逐日比對星期幾的參考實作。"""
+    out, d = [], start
+    while d <= end:
+        for r in rows:
+            if WEEKDAYS[d.weekday()] == r[4]:
+                out.append((d, r[0], r[5]))
+        d += timedelta(days=1)
+    return sorted(out, key=lambda x: (x[0], x[2]))
+
+
+def test_expand_occurrences_matches_day_by_day_expansion():
+    rows = [(1, 1, "鋼琴", "王老師", "MON", time(18, 0), time(19, 0)),
+            (2, 2, "小提琴", "李老師", "WED", time(9, 0), time(10, 0)),
+            (3, 2, "小提琴", "李老師", "MON", time(8, 0), time(9, 0)),
+            (4, 3, "停開", "李老師", "XXX", time(8, 0), time(9, 0))]
+    start, end = date(2025, 1, 1), date(2025, 3, 31)
+    df = expand_occurrences(rows, start, end)
+    got = [(d.date(), sid, st) for d, sid, st in zip(df["date"], df["schedule_id"], df["start_time"])]
+    assert got == _naive_occurrences(rows, start, end)
+    assert list(df.columns) == OCCURRENCE_COLUMNS
+
+
+def test_get_courses_for_period_lists_weekly_sessions(service, school):
+    occ = service.get_courses_for_period(MONDAY, MONDAY + timedelta(days=13))
+    assert [o["date"] for o in occ] == [MONDAY, MONDAY + timedelta(days=7)]
+    assert occ[0]["course_name"] == "鋼琴" and occ[0]["teacher_name"] == "王老師"
+    assert expand_occurrences([], MONDAY, MONDAY).empty
+
+
+# ---------- 月報表串流匯出 ----------
+def _roll_call_weeks(service, school, weeks):
+    for w in range(weeks):
+        service.take_attendance(school["schedule"], MONDAY + timedelta(days=7 * w),
+                                {sid: "有到" for sid in school["students"]})
+
+
+def test_iter_monthly_report_yields_chunks_in_report_order(service, school):
+    _roll_call_weeks(service, school, 4)
+    chunks = list(service.iter_monthly_attendance_report(2025, 1, chunk_size=5))
+    assert [len(c) for c in chunks] == [5, 5, 2]
+    rows = [r for c in chunks for r in c]
+    assert [(r.date, r.student_name) for r in rows] == sorted((r.date, r.student_name) for r in rows)
+    assert {r.remaining_classes for r in rows} == {6}
+
+
+def test_export_monthly_report_writes_every_row(service, school):
+    _roll_call_weeks(service, school, 2)
+    path = service.export_monthly_report(2025, 1, chunk_size=2)
+    ws = load_workbook(path, read_only=True).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert list(rows[0]) == REPORT_HEADERS
+    assert len(rows) == 1 + 6
+    assert rows[1][1:] == ("學生1", "鋼琴", "18:00-19:00", "王老師", "有到", 8)
+    assert service.export_monthly_report(2025, 2) is None     # 沒有資料時不產生檔案
+
+
+# ---------- 引擎設定檔與 scoped session ----------
+@pytest.fixture
+def scoped_service(db_url, tmp_path):
+    svc = AttendanceService(db_url, profile="desktop", session_mode="scoped", reports_dir=tmp_path)
+    yield svc
+    svc.dispose()
+
+
+def test_scoped_methods_inside_session_scope_join_the_callers_transaction(scoped_service):
+    with pytest.raises(RuntimeError):
+        with scoped_service.session_scope() as session:
+            sid = add_student(scoped_service, "甲", 5)
+            assert scoped_service.add_classes_to_student(sid, 3)
+            # 區塊內仍是同一個交易：看得到尚未 commit 的變更，Session 也沒被關閉
+            assert scoped_service.get_student_by_id(sid).remaining_classes == 8
+            assert session.in_transaction()
+            raise RuntimeError("放棄整個 unit of work")
+    assert scoped_service.search_students("甲")[0] == []
+
+
+def test_failed_method_inside_session_scope_only_undoes_its_own_work(scoped_service):
+    with scoped_service.session_scope():
+        sid = add_student(scoped_service, "乙", 5)
+        assert scoped_service.add_student("乙", None, None, 1) is None     # 同名：只退回這一次呼叫
+        assert scoped_service.add_classes_to_student(sid, 2)
+    assert scoped_service.get_student_by_id(sid).remaining_classes == 7
+
+
+def test_scoped_methods_outside_session_scope_commit_immediately(scoped_service, db_url):
+    sid = add_student(scoped_service, "丙", 4)
+    other = AttendanceService(db_url)
+    try:
+        assert other.get_student_by_id(sid).remaining_classes == 4
+    finally:
+        other.dispose()
+
+
+# ---------- 回傳 DTO / 舊版 ORM 物件 ----------
+def test_read_apis_return_detached_dto_rows(service, school):
+    service.take_attendance(school["schedule"], MONDAY, {school["students"][0]: "有到"})
+    course = service.get_all_courses_with_schedules()[0]
+    assert isinstance(course, CourseRow) and course.teacher_name == "王老師"
+    stu, recs = service.get_student_attendance(school["students"][0])
+    assert isinstance(stu, StudentRow) and stu.remaining_classes == 9
+    assert recs == [AttendanceRow(recs[0].id, MONDAY, stu.id, school["schedule"], school["course"], "鋼琴", "有到", True)]
+
+
+def test_orm_results_expose_the_same_fields_the_gui_reads(db_url, tmp_path, school):
+    service = AttendanceService(db_url, orm_results=True, reports_dir=tmp_path)
+    try:
+        service.take_attendance(school["schedule"], MONDAY, {school["students"][0]: "有到"})
+        course = service.get_all_courses_with_schedules()[0]
+        assert course.teacher_name == "王老師"
+        _, recs = service.get_student_attendance(school["students"][0])
+        # Session 已關閉：欄位來自 joinedload 的關聯
+        assert [(r.course_id, r.course_name, r.status) for r in recs] == [(school["course"], "鋼琴", "有到")]
+    finally:
+        service.dispose()
+
+
+# ---------- 學生清單 keyset 分頁 ----------
+def _all_pages(service, prefix="", limit=2, **kwargs):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = service.search_students(prefix, cursor, limit, **kwargs)
+        pages.append([r.name for r in rows])
+        if cursor is None:
+            return pages
+
+
+def test_search_students_pages_by_name_without_gaps(service):
+    for name in ("丙", "甲", "乙", "戊", "丁"):
+        add_student(service, name)
+    assert _all_pages(service) == [["丁", "丙"], ["乙", "戊"], ["甲"]]
+    rows, cursor = service.search_students("", None, 3)
+    # 游標為最後一筆的 (姓名, id)；下一頁從它之後接續，不會重複或遺漏
+    assert cursor == (rows[-1].name, rows[-1].id)
+    rest, end = service.search_students("", cursor, 3)
+    assert end is None and sorted(r.id for r in rows + rest) == list(range(1, 6))
+    # 游標所指的學生已被刪除時仍能接續
+    assert service.delete_student(rows[-1].id)
+    assert [r.name for r in service.search_students("", cursor, 3)[0]] == [r.name for r in rest]
+
+
+def test_search_students_last_full_page_has_no_cursor(service):
+    for name in ("甲", "乙"):
+        add_student(service, name)
+    assert service.search_students("", None, 2)[1] is None
+
+
+def test_search_students_prefix_matches_name_or_phone(service):
+    add_student(service, "王小明", phone="0911222333")
+    add_student(service, "王大同", phone="0922333444")
+    add_student(service, "李王", phone="0933444555")
+    assert _all_pages(service, "王") == [["王大同", "王小明"]]
+    assert _all_pages(service, "0922") == [["王大同"]]
+    assert _all_pages(service, "  ") == [["李王", "王大同"], ["王小明"]]
+
+
+def test_search_students_filters_by_enrollment(service, school):
+    add_student(service, "旁聽生")
+    enrolled = _all_pages(service, course_id=school["course"], enrolled=True, limit=10)
+    assert enrolled == [["學生1", "學生2", "學生3"]]
+    assert _all_pages(service, course_id=school["course"], enrolled=False) == [["旁聽生"]]
+
+
+# ---------- 報名名單差異更新 ----------
+def test_update_course_enrollments_applies_only_the_delta(service, school):
+    a, b, c = school["students"]
+    d = add_student(service, "學生4")
+    assert service.update_course_enrollments(school["course"], [b, c, d, 9999]) == \
+        {"added": 1, "removed": 1, "unchanged": 2}
+    assert {s.id for s in service.get_students_for_course(school["course"])} == {b, c, d}
+    assert service.update_course_enrollments(school["course"], [b, c, d]) == \
+        {"added": 0, "removed": 0, "unchanged": 3}
+
+
+def test_update_course_enrollments_unknown_course_returns_none(service, school):
+    assert service.update_course_enrollments(12345, school["students"]) is None
+
+
+# ---------- 名冊批次匯入 ----------
+def _roster(tmp_path, text):
+    path = tmp_path / "roster.csv"
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_import_students_twice_is_idempotent(service, school, tmp_path):
+    path = _roster(tmp_path, "姓名,電話,報名堂數\n學生1,0933000001,5\n新生,,8\n,,3\n")
+    report = service.import_students(path, course_ids=[school["course"], 404])
+    assert report.imported == 2 and report.enrolled == 1
+    assert [e.row for e in report.errors] == [0, 4]     # 找不到課程 404、姓名空白
+
+    again = service.import_students(path, course_ids=[school["course"]])
+    assert again.imported == 2 and again.enrolled == 0
+    old = service.get_student_by_id(school["students"][0])
+    assert (old.phone, old.registered_classes, old.remaining_classes) == ("0933000001", 10, 10)
+    new = service.search_students("新生")[0][0]
+    assert (new.registered_classes, new.remaining_classes) == (8, 8)
+    assert service.reconcile_balances() == 0             # 帳本與堂數一致
+
+
+def test_import_students_add_classes_tops_up_existing_students(service, school, tmp_path):
+    path = _roster(tmp_path, "name,classes\n學生2,5\n")
+    service.import_students(path, add_classes=True)
+    stu = service.get_student_by_id(school["students"][1])
+    assert (stu.phone, stu.registered_classes, stu.remaining_classes) == ("0922000002", 15, 15)
+    assert service.reconcile_balances() == 0
+
+
+# ---------- 堂數帳本 ----------
+def test_add_classes_rejects_non_positive_amounts(service, school):
+    sid = school["students"][0]
+    assert service.add_classes_to_student(sid, 0) is False
+    assert service.add_classes_to_student(sid, -3) is False
+    assert service.add_classes_to_student(sid, 2) is True
+    assert service.get_student_by_id(sid).remaining_classes == 12
+    assert service.reconcile_balances() == 0
+
+
+def test_delete_student_and_course_with_foreign_keys_enforced(service, school):
+    service.take_attendance(school["schedule"], MONDAY, {sid: "有到" for sid in school["students"]})
+    assert service.delete_student(school["students"][0])
+    assert service.delete_course(school["course"])
+    assert service.get_all_courses_with_schedules() == []
+
+
+# ---------- 月報表快取 ----------
+def _report(service):
+    return [tuple(r) for r in service.get_monthly_attendance_report(2025, 1)]
+
+
+def _cache_months(service):
+    with service.engine.connect() as conn:
+        return conn.scalar(text("SELECT count(*) FROM report_cache_months"))
+
+
+def test_reading_month_report_never_writes_the_cache(service, school):
+    _roll_call_weeks(service, school, 2)
+    assert len(_report(service)) == 6
+    assert _cache_months(service) == 0
+
+
+def test_warm_cache_serves_same_rows_until_month_changes(service, school):
+    _roll_call_weeks(service, school, 2)
+    live = _report(service)
+    assert service.warm_report_cache(MONDAY, MONDAY) == {"rebuilt": 1, "fresh": 0}
+    assert service.warm_report_cache(MONDAY, MONDAY) == {"rebuilt": 0, "fresh": 1}
+    assert _report(service) == live
+
+    # 快取是最新的才會被讀到：直接改快取內容可觀察到
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE report_cache_rows SET status = '快取'"))
+    assert {r[6] for r in _report(service)} == {"快取"}
+
+    # 剩餘堂數不在快取內，永遠是學生目前的餘額
+    service.add_classes_to_student(school["students"][0], 1)
+    assert {r[7] for r in _report(service) if r[1] == "學生1"} == {9}
+
+    # 該月有新點名：版本改變，改走即時查詢
+    service.take_attendance(school["schedule"], MONDAY + timedelta(days=14), {school["students"][0]: "遲到"})
+    rows = _report(service)
+    assert len(rows) == 7 and "快取" not in {r[6] for r in rows}
+
+
+def test_cache_is_bypassed_after_renaming_a_student(service, school):
+    _roll_call_weeks(service, school, 1)
+    service.warm_report_cache(MONDAY, MONDAY)
+    with service.engine.begin() as conn:
+        conn.execute(text("UPDATE students SET name = '改名' WHERE id = :id"), {"id": school["students"][0]})
+    assert "改名" in {r[1] for r in _report(service)}
+    assert service.warm_report_cache(MONDAY, MONDAY) == {"rebuilt": 1, "fresh": 0}
+    assert "改名" in {r[1] for r in _report(service)}
+
+
+def test_invalidate_report_cache_removes_cached_months(service, school):
+    _roll_call_weeks(service, school, 5)          # 1 月與 2 月
+    assert service.warm_report_cache(MONDAY, MONDAY + timedelta(days=30)) == {"rebuilt": 2, "fresh": 0}
+    assert service.invalidate_report_cache(MONDAY, MONDAY) == 1
+    assert _cache_months(service) == 1
+    assert len(_report(service)) == 12
+
+
+# ---------- 排課衝突 ----------
+def _second_course(service, school, day="MON", start="18:30"):
+    assert service.add_teacher("李老師", None, None)
+    teacher = [t.id for t in service.get_all_teachers() if t.name == "李老師"][0]
+    assert service.add_course("小提琴", teacher)
+    course = [c.id for c in service.get_all_courses_with_schedules() if c.name == "小提琴"][0]
+    assert service.add_course_schedule(course, day, start)
+    return course
+
+
+def test_enrolling_student_into_overlapping_course_is_rejected(service, school):
+    course = _second_course(service, school)
+    sid = school["students"][0]
+    result = service.update_course_enrollments(course, [sid])
+    # 回報與哪一堂重疊（不是 None，與課程不存在區分）
+    assert [(c.owner_id, c.other_course_id, c.other_start) for c in result["conflicts"]] == \
+        [(sid, school["course"], time(18, 0))]
+    assert service.get_students_for_course(course) == []
+    # 被擋下後排課索引不變：仍可新增不衝突的學生
+    other = add_student(service, "學生4")
+    assert service.update_course_enrollments(course, [other]) == {"added": 1, "removed": 0, "unchanged": 0}
+
+
+def test_enrolling_into_non_overlapping_course_is_allowed(service, school):
+    course = _second_course(service, school, start="19:00")
+    assert service.update_course_enrollments(course, school["students"])["added"] == 3
+    # 已報名兩門課的學生，讓第一門課新增與第二門課重疊的排程會被擋下
+    assert service.add_course_schedule(school["course"], "MON", "19:30") is None
+    assert {c.kind for c in service.find_schedule_conflicts(school["course"], "MON", "19:30")} == {"student"}
+
+
+# ---------- 上課日表 ----------
+def _next_monday(weeks=1):
+    today = date.today()
+    return today + timedelta(days=(7 - today.weekday()) % 7 + 7 * weeks)
+
+
+def _course_session_count(service):
+    with service.engine.connect() as conn:
+        return conn.scalar(text("SELECT count(*) FROM course_sessions"))
+
+
+def test_session_calendar_skips_cancelled_days_and_adds_makeups(db_url, tmp_path, school):
+    service = AttendanceService(db_url, session_calendar=True, reports_dir=tmp_path)
+    try:
+        holiday, after = _next_monday(1), _next_monday(2)
+        assert service.cancel_sessions_on(holiday) == 1
+        assert service.add_makeup_session(school["schedule"], holiday + timedelta(days=2), "10:00")
+        occ = service.get_courses_for_period(holiday, after)
+        assert [(o["date"], o["start_time"]) for o in occ] == [(holiday + timedelta(days=2), time(10, 0)),
+                                                              (after, time(18, 0))]
+    finally:
+        service.dispose()
+
+
+def test_cancel_sessions_without_calendar_does_not_build_one(service, school):
+    assert service.cancel_sessions_on(_next_monday(1)) == 0
+    assert _course_session_count(service) == 0
+
+
+def test_update_course_schedule_invalidates_cached_month_reports(service, school):
+    _roll_call_weeks(service, school, 1)
+    service.warm_report_cache(MONDAY, MONDAY)
+    assert service.update_course_schedule(school["schedule"], "MON", "09:00")
+    assert {(r.start_time, r.end_time) for r in service.get_monthly_attendance_report(2025, 1)} == \
+        {(time(9, 0), time(10, 0))}
+    assert service.warm_report_cache(MONDAY, MONDAY) == {"rebuilt": 1, "fresh": 0}
+
+
+# ---------- 多堂點名一次提交 ----------
+def _two_schedules(service, school):
+    assert service.add_course_schedule(school["course"], "WED", "18:00")
+    return [s.id for s in service.get_all_courses_with_schedules()[0].schedules]
+
+
+def test_take_attendance_batch_records_every_entry(service, school):
+    mon, wed = _two_schedules(service, school)
+    a, b, _ = school["students"]
+    results = service.take_attendance_batch([(mon, MONDAY, {a: "有到", b: "曠課"}),
+                                             (wed, MONDAY + timedelta(days=2), {a: "遲到"})])
+    assert results == [{a: "inserted", b: "inserted"}, {a: "inserted"}]
+    assert service.get_student_by_id(a).remaining_classes == 8
+
+
+def test_take_attendance_batch_atomic_writes_nothing_on_unknown_schedule(service, school):
+    mon, _ = _two_schedules(service, school)
+    a = school["students"][0]
+    assert service.take_attendance_batch([(mon, MONDAY, {a: "有到"}), (999, MONDAY, {a: "有到"})]) is None
+    assert service.get_student_by_id(a).remaining_classes == 10
+
+    results = service.take_attendance_batch([(mon, MONDAY, {a: "有到"}), (999, MONDAY, {a: "有到"})],
+                                            atomic=False)
+    assert results == [{a: "inserted"}, None]
+    assert service.get_student_by_id(a).remaining_classes == 9